@@ -44,6 +44,7 @@ def autocnt_entry(args, ast):
         pm.state.set_reset(args.reset)
     pm.state.variablesToCount = validbits
     pm.state.counterWidth = args.counter_width
+    pm.state.cost_estimator = args.cost_estimator
     pm.register(IdentifierRefPass)
     pm.register(TypeInfoPass)
     pm.register(WidthPass)
@@ -64,6 +65,7 @@ def autocnt_entry(args, ast):
     pm = PassManager()
     pm.state = old_state
     pm.state.transitionPrintTargets = trans
+    pm.state.cost_estimator = args.cost_estimator
     pm.register(SimpleRefClockPass)
     if args.tag:
         PrintTransitionPass.DISPLAY_TAG = args.tag
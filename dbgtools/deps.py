@@ -98,6 +98,7 @@ def deps_entry(args, ast):
     pm.register(WidthPass)
     pm.state = old_state
     pm.state.transitionPrintTargets = tgts_list
+    pm.state.cost_estimator = args.cost_estimator
     pm.register(SimpleRefClockPass)
     if args.tag:
         PrintTransitionPass.DISPLAY_TAG = args.tag
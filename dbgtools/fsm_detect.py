@@ -60,6 +60,7 @@ def fsm_entry(args, ast):
     pm = PassManager()
     pm.state = old_state
     pm.state.transitionPrintTargets = tgts
+    pm.state.cost_estimator = args.cost_estimator
     pm.register(SimpleRefClockPass)
     if args.tag:
         PrintTransitionPass.DISPLAY_TAG = args.tag
@@ -12,6 +12,7 @@ from passes.ArraySplitPass import ArraySplitPass
 from passes.BoundaryCheckPass import ArrayBoundaryCheckPass
 from passes.common import PassManager
 from utils.XilinxILA import XilinxILA
+from utils.RecorderSizing import check_budget
 
 from pyverilog.vparser.parser import VerilogCodeParser
 import pyverilog.utils.util as util
@@ -27,6 +28,17 @@ def sv2v_regParser(subparsers):
     p.add_argument("--tasksupport", default=False, action="store_true", help="whether to run TaskSupportPass")
     p.add_argument("--tasksupport-mode", default='STP', choices=['STP', 'SWEEPSTP', 'SWEEPILA', 'ILA'], help="in what mode to run TaskSupportPass (default is STP)")
     p.add_argument("--tasksupport-tags", type=str, default=[], action="append", help="The tag (e.g. debug_display) enabling instrumentations of specific display tasks")
+    p.add_argument("--tasksupport-cond-backend", default="sympy", choices=["sympy", "bdd"], help="how to canonicalize and simplify the path constraints of display tasks, bdd scales to many deeply nested displays (default is sympy)")
+    p.add_argument("--tasksupport-cond-cache", default=None, type=str, help="Keep the simplified path constraints of display tasks in this file across runs (sympy backend)")
+    p.add_argument("--tasksupport-cond-encoding", default="onehot", choices=["onehot", "binary", "mux"], help="record one bit per display condition, binary condition IDs, or one display per sample with its args time-multiplexed into a narrower trace word (default is onehot)")
+    p.add_argument("--tasksupport-cond-slots", default=1, type=int, help="the number of condition ID slots recorded per cycle with the binary encoding (default=1)")
+    p.add_argument("--tasksupport-multi-clock", default=False, action="store_true", help="Instantiate one recorder per clock domain with displays instead of sampling all displays with the fastest clock. (default=False)")
+    p.add_argument("--tasksupport-delta", default=False, action="store_true", help="Only record a display sample when the fired conditions or the display arguments change, repeated samples are counted and replayed by the parsers (not with the mux encoding). (default=False)")
+    p.add_argument("--tasksupport-delta-repeat-width", default=8, type=int, help="the width of the repeat counter of --tasksupport-delta (default=8)")
+    p.add_argument("--tasksupport-sizing-profile", default=None, type=str, help="Size the sample depth of the recorders against the memory blocks of this device profile: M20K or BRAM36, which need --tasksupport-bram-budget[-bits], or a json profile file")
+    p.add_argument("--tasksupport-bram-budget", default=None, type=int, help="Size the sample depth of the recorders to fit in this number of memory blocks")
+    p.add_argument("--tasksupport-bram-budget-bits", default=None, type=int, help="Size the sample depth of the recorders to fit in this number of memory bits")
+    p.add_argument("--tasksupport-cost-model", default=None, type=str, help="The memory blocks measured by SWEEPSTP/SWEEPILA builds (csv or json of width, depth, blocks), used to size the recorders")
     p.add_argument("--tasksupport-log2width", default=None, type=int, help="The log2(width) of the fake data to instrument recording for")
     p.add_argument("--tasksupport-log2depth", default=None, type=int, help="The log2(depth) of the fake data to instrument recording for")
     p.add_argument("--tasksupport-ila-tcl", type=str, help="The path of the generated ila tcl scripts, which configs the ila IP with proper properties.")
@@ -65,6 +77,24 @@ def sv2v_entry(args, ast):
                 TaskSupportPass.INSTRUMENT_SAMPLE_DEPTH = 2**args.tasksupport_log2depth
         else:
             raise NotImplementedError("Unknown TaskSupport Mode")
+        if args.tasksupport_cond_backend == "bdd":
+            TaskSupportPass.COND_BACKEND = TaskSupportPass.COND_BACKEND_BDD
+        TaskSupportPass.COND_CACHE_PATH = args.tasksupport_cond_cache
+        if args.tasksupport_cond_encoding == "binary":
+            TaskSupportPass.COND_ENCODING = TaskSupportPass.COND_ENCODING_BINARY
+            TaskSupportPass.COND_ID_SLOTS = args.tasksupport_cond_slots
+        elif args.tasksupport_cond_encoding == "mux":
+            TaskSupportPass.COND_ENCODING = TaskSupportPass.COND_ENCODING_MUX
+        TaskSupportPass.MULTI_CLOCK = args.tasksupport_multi_clock
+        TaskSupportPass.ARG_DELTA = args.tasksupport_delta
+        TaskSupportPass.DELTA_REPEAT_WIDTH = args.tasksupport_delta_repeat_width
+        TaskSupportPass.SIZING_PROFILE = args.tasksupport_sizing_profile
+        TaskSupportPass.SIZING_BUDGET_BLOCKS = args.tasksupport_bram_budget
+        TaskSupportPass.SIZING_BUDGET_BITS = args.tasksupport_bram_budget_bits
+        if args.tasksupport_sizing_profile != None:
+            check_budget(args.tasksupport_sizing_profile, args.tasksupport_bram_budget,
+                    args.tasksupport_bram_budget_bits)
+        TaskSupportPass.SIZING_COST_MODEL = args.tasksupport_cost_model
         if args.tasksupport_ila_tcl:
             XilinxILA.ILA_TCL_OUTPUT = args.tasksupport_ila_tcl
         # If INSTURMENT_TAGS is empty, instrument all display tasks.
@@ -72,6 +102,7 @@ def sv2v_entry(args, ast):
         # If not empty, only instrument ones with the given verilator tags. This should also include the display instrumented above.
         if len(TaskSupportPass.INSTRUMENT_TAGS) > 0:
             TaskSupportPass.INSTRUMENT_TAGS.add(ArrayBoundaryCheckPass.DISPLAY_TAG)
+        pm.state.cost_estimator = args.cost_estimator
         pm.register(TaskSupportPass)
     pm.runAll(ast)
 
@@ -81,3 +112,7 @@ def sv2v_entry(args, ast):
         ast.condname2display = pm.state.condname2display
     if hasattr(pm.state, "displayarg_width") and len(pm.state.displayarg_width) != 0:
         ast.displayarg_width = pm.state.displayarg_width
+    if hasattr(pm.state, "traceinfo") and len(pm.state.traceinfo) != 0:
+        ast.traceinfo = pm.state.traceinfo
+    if hasattr(pm.state, "clock_domains") and len(pm.state.clock_domains) != 0:
+        ast.clock_domains = pm.state.clock_domains
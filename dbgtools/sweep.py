@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import os
+import copy
+import json
+import multiprocessing
+from passes.IdentifierRefPass import IdentifierRefPass
+from passes.TypeInfoPass import TypeInfoPass
+from passes.WidthPass import WidthPass
+from passes.CanonicalFormPass import CanonicalFormPass
+from passes.TaskSupportPass import TaskSupportPass
+from passes.VerilatorReTagPass import VerilatorReTagPass
+from passes.BoundaryCheckPass import ArrayBoundaryCheckPass
+from passes.common import PassManager
+from utils.XilinxILA import XilinxILA
+from pyverilog.ast_code_generator.codegen import ASTCodeGenerator
+
+
+def sweep_regParser(subparsers):
+    """
+    subparsers is the return value of "add_subparsers"
+    """
+    p = subparsers.add_parser('sweep', help="Generate the SWEEPSTP/SWEEPILA instrumentation of many (width, depth) points from one analysis")
+    p.set_defaults(toolEntry=sweep_entry)
+    p.add_argument("--sweep-mode", default="STP", choices=["STP", "ILA"], help="sweep SignalTapII (SWEEPSTP) or ILA (SWEEPILA) recorders (default is STP)")
+    p.add_argument("--sweep-log2width", type=int, action="append", default=[], help="The log2(width) of the fake data, can be stacked")
+    p.add_argument("--sweep-log2depth", type=int, action="append", default=[], help="The log2(depth) of the fake data, can be stacked. Every width is generated with every depth")
+    p.add_argument("--sweep-output-dir", type=str, default="sweep", help="The directory of the generated designs, ILA tcl scripts and manifest.json (default is sweep)")
+    p.add_argument("--tasksupport-tags", type=str, default=[], action="append", help="The tag (e.g. debug_display) enabling instrumentations of specific display tasks, as with sv2v, which picks the clock of the recorders")
+    p.add_argument("--sweep-jobs", type=int, default=1, help="the number of processes generating the points in parallel (default=1)")
+
+
+# (ast, pm, args) analyzed by sweep_entry. Forked workers inherit them as a copy-on-write
+# snapshot, and every worker generates one point only (maxtasksperchild=1), so every point
+# instruments a pristine ast without copying it.
+_sweep_context = None
+
+def _sweep_point(point):
+    """
+    point: (log2width, log2depth)
+    Instrument the fake recorder of one point to the ast of _sweep_context, and write it
+    Return: the manifest entry of the point
+    """
+    ast, pm, args = _sweep_context
+    log2width, log2depth = point
+    name = "{}_w{}_d{}".format(args.sweep_mode.lower(), log2width, log2depth)
+    entry = {
+        "name": name,
+        "mode": "SWEEP" + args.sweep_mode,
+        "log2width": log2width,
+        "log2depth": log2depth,
+        "width": 2**log2width,
+        "depth": 2**log2depth,
+        "verilog": os.path.join(args.sweep_output_dir, name + ".v")
+    }
+    if args.sweep_mode == "STP":
+        TaskSupportPass.INSTRUMENT_TYPE = TaskSupportPass.INSTRUMENT_TYPE_SWEEPSTP
+    else:
+        TaskSupportPass.INSTRUMENT_TYPE = TaskSupportPass.INSTRUMENT_TYPE_SWEEPILA
+        entry["tcl"] = os.path.join(args.sweep_output_dir, name + ".tcl")
+        XilinxILA.ILA_TCL_OUTPUT = entry["tcl"]
+        XilinxILA.ILA_INSTANCE_CNT = 0
+    TaskSupportPass.INSTRUMENT_SWEEP_CFG_WIDTH = entry["width"]
+    TaskSupportPass.INSTRUMENT_SWEEP_CFG_DEPTH = entry["depth"]
+    pm.register(TaskSupportPass)
+    pm.register(VerilatorReTagPass)
+    pm.runAll(ast)
+    codegen = ASTCodeGenerator()
+    with open(entry["verilog"], 'w+') as f:
+        f.write(codegen.visit(ast))
+    return entry
+
+def _sweep_copy_point(point):
+    """
+    Generate one point on a copy of the analyzed ast, used when the points are generated sequentially
+    """
+    global _sweep_context
+    context = _sweep_context
+    ast, pm = copy.deepcopy(context[:2])
+    _sweep_context = (ast, pm, context[2])
+    try:
+        return _sweep_point(point)
+    finally:
+        _sweep_context = context
+
+def sweep_entry(args, ast):
+    global _sweep_context
+    points = [(w, d) for w in args.sweep_log2width for d in args.sweep_log2depth]
+    print("Sweep points: {}".format(len(points)))
+    if len(points) == 0:
+        return
+    os.makedirs(args.sweep_output_dir, exist_ok=True)
+
+    # the analysis shared by all points
+    pm = PassManager()
+    if args.reset:
+        pm.state.set_reset(args.reset)
+    pm.register(IdentifierRefPass)
+    pm.register(TypeInfoPass)
+    pm.register(WidthPass)
+    pm.register(CanonicalFormPass)
+    pm.runAll(ast)
+    if args.recording_emulated:
+        TaskSupportPass.RECORDING_EMULATED = True
+    if args.not_retag_synthesis:
+        VerilatorReTagPass.SYNTHESIS_RETAG = False
+    # the same displays as sv2v --tasksupport-tags, see sv2v_entry
+    TaskSupportPass.INSTRUMENT_TAGS = set(args.tasksupport_tags)
+    if len(TaskSupportPass.INSTRUMENT_TAGS) > 0:
+        TaskSupportPass.INSTRUMENT_TAGS.add(ArrayBoundaryCheckPass.DISPLAY_TAG)
+
+    _sweep_context = (ast, pm, args)
+    try:
+        if args.sweep_jobs <= 1 or len(points) <= 1 or \
+                "fork" not in multiprocessing.get_all_start_methods():
+            entries = [_sweep_copy_point(p) for p in points]
+        else:
+            ctx = multiprocessing.get_context("fork")
+            with ctx.Pool(min(args.sweep_jobs, len(points)), maxtasksperchild=1) as pool:
+                entries = pool.map(_sweep_point, points, chunksize=1)
+    finally:
+        _sweep_context = None
+
+    manifest = {
+        "top": args.top_module,
+        "mode": "SWEEP" + args.sweep_mode,
+        "points": entries
+    }
+    manifest_path = os.path.join(args.sweep_output_dir, "manifest.json")
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    print("Sweep manifest: {}".format(manifest_path))
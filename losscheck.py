@@ -4,8 +4,10 @@ import sys
 import pathlib
 import argparse
 import time
+import json
 from verilator import *
-from passes.FlowGuardInstrumentationPass import FlowGuardInstrumentationPass
+from passes.FlowGuardInstrumentationPass import FlowGuardInstrumentationPass, FlowGuardSharedState
+from passes.FlowGuardInstrumentationPass import find_prop_chains_parallel
 from passes.IdentifierRefPass import IdentifierRefPass
 from passes.TypeInfoPass import TypeInfoPass
 from passes.WidthPass import WidthPass
@@ -14,6 +16,9 @@ from passes.TaskSupportPass import TaskSupportPass
 from passes.ArraySplitPass import ArraySplitPass
 from passes.RemoveStopPass import RemoveStopPass
 from passes.common import PassManager
+from utils.CostEstimator import CostEstimator
+from utils.GraphExport import GraphExporter
+from utils.RecorderSizing import check_budget
 
 start = time.time()
 
@@ -35,14 +40,42 @@ parser.add_argument("--filtered-list", default=None, dest="filtered_list", help=
 parser.add_argument("--source", default=None, dest="source", help="source of the data flow")
 parser.add_argument("--sink", default=None, dest="sink", help="sink of the data flow")
 parser.add_argument("--source-valid", default=None, dest="source_valid", help="the valid signal for the source")
+parser.add_argument("--flows", default=None, dest="flows", help="a json manifest of flows to check in one instrumented design, a list of {\"name\", \"source\", \"sink\", \"source_valid\"}. Cannot coexist with --source/--sink/--source-valid.")
+parser.add_argument("--jobs", default=1, type=int, help="the number of processes used to find the propagation chains of different flows in parallel (default=1)")
 parser.add_argument("--reset", default=None, dest="reset", help="the reset signal")
 parser.add_argument("--ignore-stop", default=False, dest="ignore_stop", action="store_true", help="ignore $stop")
 parser.add_argument("--recording-emulated", default=False, action="store_true", help="Use the emulated data recording implementation. (default=False)")
 parser.add_argument("--tasksupport-mode", default='STP', choices=['STP', 'SWEEPSTP', 'SWEEPILA', 'ILA'], help="in what mode to run TaskSupportPass (default is STP)")
+parser.add_argument("--tasksupport-cond-backend", default="sympy", choices=["sympy", "bdd"], help="how to canonicalize and simplify the path constraints of display tasks, bdd scales to many deeply nested displays (default is sympy)")
+parser.add_argument("--tasksupport-cond-cache", default=None, type=str, help="Keep the simplified path constraints of display tasks in this file across runs (sympy backend)")
+parser.add_argument("--tasksupport-cond-encoding", default="onehot", choices=["onehot", "binary", "mux"], help="record one bit per display condition, binary condition IDs, or one display per sample with its args time-multiplexed into a narrower trace word (default is onehot)")
+parser.add_argument("--tasksupport-cond-slots", default=1, type=int, help="the number of condition ID slots recorded per cycle with the binary encoding (default=1)")
+parser.add_argument("--tasksupport-multi-clock", default=False, action="store_true", help="Instantiate one recorder per clock domain with displays instead of sampling all displays with the fastest clock. (default=False)")
+parser.add_argument("--tasksupport-delta", default=False, action="store_true", help="Only record a display sample when the fired conditions or the display arguments change, repeated samples are counted and replayed by the parsers (not with the mux encoding). (default=False)")
+parser.add_argument("--tasksupport-delta-repeat-width", default=8, type=int, help="the width of the repeat counter of --tasksupport-delta (default=8)")
+parser.add_argument("--tasksupport-sizing-profile", default=None, type=str, help="Size the sample depth of the recorders against the memory blocks of this device profile: M20K or BRAM36, which need --tasksupport-bram-budget[-bits], or a json profile file")
+parser.add_argument("--tasksupport-bram-budget", default=None, type=int, help="Size the sample depth of the recorders to fit in this number of memory blocks")
+parser.add_argument("--tasksupport-bram-budget-bits", default=None, type=int, help="Size the sample depth of the recorders to fit in this number of memory bits")
+parser.add_argument("--tasksupport-cost-model", default=None, type=str, help="The memory blocks measured by SWEEPSTP/SWEEPILA builds (csv or json of width, depth, blocks), used to size the recorders")
 parser.add_argument("--tasksupport-log2width", default=None, type=int, help="The log2(width) of the fake data to instrument recording for")
+parser.add_argument("--gephi", default=False, action="store_true", help="Stream the propagation graph to a live Gephi instance at localhost:8080. (default=False)")
+parser.add_argument("--graph-output", default=None, type=str, help="Write the propagation graph to a .graphml, .gexf or .json file")
+parser.add_argument("--flowguard-pack-array", default=False, action="store_true", help="Pack the shadow signals of arrays accessed with non-constant pointers into one vector per signal instead of unrolling every element. (default=False)")
+parser.add_argument("--flowguard-pack-slices", default=False, action="store_true", help="Pack the shadow signals of all the slices of a signal into one vector per signal, updated by one assignment and one register. (default=False)")
+parser.add_argument("--no-flowguard-cse", default=False, action="store_true", help="Do not share common subexpressions of the FlowGuard instrumentation logic. (default=False)")
+parser.add_argument("--cost-report", default=None, type=str, help="Write the estimated hardware cost of the instrumentation to this json file")
+parser.add_argument("--budget-reg-bits", default=None, type=int, help="Only check the highest ranked registers of each flow whose instrumentation fits in this number of register bits")
+parser.add_argument("--budget-trace-bits", default=None, type=int, help="Only check the highest ranked registers of each flow whose loss messages fit in this number of recorded bits")
+parser.add_argument("--budget-report", default=None, type=str, help="Write the checked and dropped registers of the budgeted instrumentation to this json file")
+parser.add_argument("--chain-cache", default=None, type=str, help="Keep the propagation chain in this file across runs, only recompute it when the binds it depends on change")
 parser.add_argument("--tasksupport-log2depth", default=None, type=int, help="The log2(depth) of the fake data to instrument recording for")
 
 args = parser.parse_args()
+if args.graph_output != None:
+    GraphExporter.check_path(args.graph_output)
+if args.tasksupport_sizing_profile != None:
+    check_budget(args.tasksupport_sizing_profile, args.tasksupport_bram_budget,
+            args.tasksupport_bram_budget_bits)
 print("Top Module: {}".format(args.top_module))
 print("Desc File: {}".format(args.desc_file))
 print("Output Path: {}".format(args.output))
@@ -66,8 +99,35 @@ if args.tasksupport_mode:
             TaskSupportPass.INSTRUMENT_SAMPLE_DEPTH = 2**args.tasksupport_log2depth
     else:
         raise NotImplementedError("Unknown TaskSupport Mode")
+if args.tasksupport_cond_backend == "bdd":
+    TaskSupportPass.COND_BACKEND = TaskSupportPass.COND_BACKEND_BDD
+TaskSupportPass.COND_CACHE_PATH = args.tasksupport_cond_cache
+if args.tasksupport_cond_encoding == "binary":
+    TaskSupportPass.COND_ENCODING = TaskSupportPass.COND_ENCODING_BINARY
+    TaskSupportPass.COND_ID_SLOTS = args.tasksupport_cond_slots
+elif args.tasksupport_cond_encoding == "mux":
+    TaskSupportPass.COND_ENCODING = TaskSupportPass.COND_ENCODING_MUX
+TaskSupportPass.MULTI_CLOCK = args.tasksupport_multi_clock
+TaskSupportPass.ARG_DELTA = args.tasksupport_delta
+TaskSupportPass.DELTA_REPEAT_WIDTH = args.tasksupport_delta_repeat_width
+TaskSupportPass.SIZING_PROFILE = args.tasksupport_sizing_profile
+TaskSupportPass.SIZING_BUDGET_BLOCKS = args.tasksupport_bram_budget
+TaskSupportPass.SIZING_BUDGET_BITS = args.tasksupport_bram_budget_bits
+TaskSupportPass.SIZING_COST_MODEL = args.tasksupport_cost_model
 
-assert(args.source and args.sink and args.source_valid and args.reset)
+# list of (flow name, source, sink, source valid)
+flows = []
+if args.flows != None:
+    assert(not (args.source or args.sink or args.source_valid))
+    with open(args.flows, "r") as f:
+        manifest = json.load(f)
+    for flow in manifest:
+        flows.append((flow["name"], flow["source"], flow["sink"], flow["source_valid"]))
+    assert(len(set([flow[0] for flow in flows])) == len(flows) and "flow names should be unique")
+else:
+    assert(args.source and args.sink and args.source_valid)
+    flows.append((None, args.source, args.sink, args.source_valid))
+assert(args.reset)
 
 v = Verilator(top_module_name=args.top_module, desc_file=args.desc_file)
 ast = v.get_ast()
@@ -108,19 +168,50 @@ dataflow = bind_visitor.getDataflows()
 terms = dataflow.getTerms()
 binddict = dataflow.getBinddict()
 
-source = args.top_module + "." + args.source
-source_valid = args.top_module + "." + args.source_valid
-sink = args.top_module + "." + args.sink
 reset = args.top_module + "." + args.reset
+cost_estimator = CostEstimator() if args.cost_report else None
 
-flowguardpass = FlowGuardInstrumentationPass(ast, terms, binddict,
-        source, source_valid, sink, reset, identifierRef, typeInfo, gephi=True)
-flowguardpass.addBlackboxModule("altsyncram", altsyncram)
-flowguardpass.addBlackboxModule("dcfifo", dcfifo)
-flowguardpass.addBlackboxModule("scfifo", scfifo)
-if args.filtered_list != None:
-    flowguardpass.set_filtered(args.filtered_list)
-flowguardpass.instrument()
+# All flows are instrumented into the same ast, the AST and the dataflow are only
+# built once. Flow-independent shadow signals are shared through flowguard_shared.
+flowguard_shared = FlowGuardSharedState()
+flowguardpasses = []
+for flow_name, flow_source, flow_sink, flow_source_valid in flows:
+    source = args.top_module + "." + flow_source
+    source_valid = args.top_module + "." + flow_source_valid
+    sink = args.top_module + "." + flow_sink
+    graph_output = args.graph_output
+    if graph_output != None and flow_name != None:
+        graph_root, graph_ext = os.path.splitext(graph_output)
+        graph_output = graph_root + "." + flow_name + graph_ext
+
+    budget_report = args.budget_report
+    if budget_report != None and flow_name != None:
+        budget_root, budget_ext = os.path.splitext(budget_report)
+        budget_report = budget_root + "." + flow_name + budget_ext
+    chain_cache = args.chain_cache
+    if chain_cache != None and flow_name != None:
+        chain_cache = chain_cache + "." + flow_name
+
+    print("Flow: {} {} -> {}".format(flow_name, source, sink))
+    flowguardpass = FlowGuardInstrumentationPass(ast, terms, binddict,
+            source, source_valid, sink, reset, identifierRef, typeInfo, gephi=args.gephi,
+            packArray=args.flowguard_pack_array, graphOutput=graph_output,
+            flowName=flow_name, shared=flowguard_shared, cseGen=not args.no_flowguard_cse,
+            costEstimator=cost_estimator, budgetRegBits=args.budget_reg_bits,
+            budgetTraceBits=args.budget_trace_bits, budgetReport=budget_report,
+            chainCache=chain_cache, packSlices=args.flowguard_pack_slices)
+    flowguardpass.addBlackboxModule("altsyncram", altsyncram)
+    flowguardpass.addBlackboxModule("dcfifo", dcfifo)
+    flowguardpass.addBlackboxModule("scfifo", scfifo)
+    if args.filtered_list != None:
+        flowguardpass.set_filtered(args.filtered_list)
+    flowguardpasses.append(flowguardpass)
+
+# The analysis of each flow is independent and can run in parallel, the
+# instrumentation modifies the shared ast and runs sequentially.
+chains = find_prop_chains_parallel(flowguardpasses, args.jobs)
+for flowguardpass, chain in zip(flowguardpasses, chains):
+    flowguardpass.instrument(chain)
 
 TaskSupportPass.INSTRUMENT_TAGS = {FlowGuardInstrumentationPass.DISPLAY_TAG}
 TaskSupportPass.RECORDING_EMULATED = args.recording_emulated
@@ -132,6 +223,7 @@ pm.register(WidthPass)
 pm.register(CanonicalFormPass)
 pm.register(TaskSupportPass)
 pm.state.reset = vast.Identifier(args.reset)
+pm.state.cost_estimator = cost_estimator
 if args.ignore_stop:
     pm.register(RemoveStopPass)
 pm.runAll(ast)
@@ -143,6 +235,8 @@ with open(args.output, 'w+') as f:
 
 end = time.time()
 print(end - start)
+if cost_estimator != None:
+    cost_estimator.write(args.cost_report)
 if hasattr(pm.state, "condname2display"):
     with open(args.output+".displayinfo.txt", 'w+') as f:
         for condname in pm.state.condname2display:
@@ -151,3 +245,19 @@ if hasattr(pm.state, "displayarg_width"):
     with open(args.output+".widthinfo.txt", 'w+') as f:
         for varname in pm.state.displayarg_width:
             f.write("{} {}\n".format(varname, pm.state.displayarg_width[varname]))
+if hasattr(pm.state, "traceinfo") and len(pm.state.traceinfo) != 0:
+    with open(args.output+".traceinfo.txt", 'w+') as f:
+        for line in pm.state.traceinfo:
+            f.write("{}\n".format(line))
+# the manifests of the recorders of the other clock domains, see TaskSupportPass.MULTI_CLOCK
+if hasattr(pm.state, "clock_domains"):
+    for clock, manifests in pm.state.clock_domains.items():
+        with open(args.output+"."+clock+".displayinfo.txt", 'w+') as f:
+            for condname in manifests["condname2display"]:
+                f.write("{} {}\n".format(condname, manifests["condname2display"][condname]))
+        with open(args.output+"."+clock+".widthinfo.txt", 'w+') as f:
+            for varname in manifests["displayarg_width"]:
+                f.write("{} {}\n".format(varname, manifests["displayarg_width"][varname]))
+        with open(args.output+"."+clock+".traceinfo.txt", 'w+') as f:
+            for line in manifests["traceinfo"]:
+                f.write("{}\n".format(line))
@@ -55,9 +55,10 @@ class AltsyncramSimpleModel:
 
         instance, sigport = self.signal2instance[signame]
         instname = instance.name
+        instm_name = dataflowpass.get_instrumented_inst_name(instname)
 
         r = []
-        if not instname in self.instance2instrumented:
+        if not instm_name in self.instance2instrumented:
             new_paramlist = []
             for p in instance.parameterlist:
                 if p.paramname == "width_a":
@@ -83,16 +84,16 @@ class AltsyncramSimpleModel:
                 new_portlist.append(p)
 
             inst = vast.Instance("altsyncram",
-                    instname+"__INSTM__",
+                    instm_name,
                     new_portlist,
                     new_paramlist)
             instlist = vast.InstanceList("altsyncram",
                     new_paramlist,
                     [inst])
-            self.instance2instrumented[instname] = instlist
+            self.instance2instrumented[instm_name] = instlist
             r.append(instlist)
 
-        instrumented = self.instance2instrumented[instname].instances[0]
+        instrumented = self.instance2instrumented[instm_name].instances[0]
 
         if sigport == "data_a":
             instrumented.portlist.append(
@@ -30,9 +30,10 @@ class DcfifoSimpleModel:
 
         instance, sigport = self.signal2instance[signame]
         instname = instance.name
+        instm_name = dataflowpass.get_instrumented_inst_name(instname)
 
         r = []
-        if not instname in self.instance2instrumented:
+        if not instm_name in self.instance2instrumented:
             lpm_widthu = None
             lpm_numwords = None
             for param in instance.parameterlist:
@@ -58,16 +59,16 @@ class DcfifoSimpleModel:
                 if port.portname == "wrreq":
                     wrreq = vast.PortArg("wrreq", port.argname)
             inst = vast.Instance("dcfifo_simple_model",
-                    instname+"__INSTM__",
+                    instm_name,
                     [aclr, rdclk, rdreq, wrclk, wrreq],
                     [lpm_widthu, lpm_numwords])
             instlist = vast.InstanceList("dcfifo_simple_model",
                     [lpm_widthu, lpm_numwords],
                     [inst])
-            self.instance2instrumented[instname] = instlist
+            self.instance2instrumented[instm_name] = instlist
             r.append(instlist)
 
-        instrumented = self.instance2instrumented[instname].instances[0]
+        instrumented = self.instance2instrumented[instm_name].instances[0]
 
         if sigport == "data":
             instrumented.portlist.append(
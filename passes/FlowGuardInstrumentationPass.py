@@ -3,6 +3,10 @@ import sys
 import pathlib
 import argparse
 import copy
+import json
+import hashlib
+import pickle
+import multiprocessing
 from verilator import *
 
 from pyverilog.vparser.parser import VerilogCodeParser
@@ -18,9 +22,12 @@ import pyverilog.vparser.ast as vast
 from utils.SingleBitOptimizationVisitor import SingleBitOptimizationVisitor
 from utils.DoNothingVisitor import DoNothingVisitor
 from utils.DFBuildAstVisitor import DFBuildAstVisitor
+from utils.GraphExport import GraphExporter
+from utils.HashConsBuilder import HashConsExprBuilder
 
 from passes.common import getConstantWidth
 from passes.common import getWidthFromInt
+from passes.TaskSupportPass import TaskSupportPass
 
 
 try:
@@ -612,6 +619,183 @@ class DFPerciseDataDepVisitor:
         return (None, None, node.width(), None, None)
 
 
+# Memoize the result of DFPerciseDataDepVisitor. The result of visiting a bind tree
+# from its root only depends on the tree and on the (termname, msb, lsb, ptr) of the
+# target, so the same tree is never walked twice for the same target slice.
+class DFPerciseDataDepCache:
+    def __init__(self, terms, binddict):
+        self.terms = terms
+        self.binddict = binddict
+        # (tree key, target key) -> (tree, result)
+        # the tree is kept alive in the value so that id() based keys stay valid
+        self.cache = {}
+        self.hit = 0
+        self.miss = 0
+
+        # optional FlowGuardChainCache, which keeps the results across runs
+        self.persistent = None
+        self.persistent_hit = 0
+
+    def tree_key(self, tree):
+        return id(tree)
+
+    def target_key(self, target):
+        return (target.termname, target.msb, target.lsb, target.ptr)
+
+    def visit(self, tree, target):
+        key = (self.tree_key(tree), self.target_key(target))
+        if key in self.cache:
+            self.hit += 1
+            return self.cache[key][1]
+        self.miss += 1
+        r = None
+        if self.persistent != None:
+            r = self.persistent.get_datadep(tree, target)
+            if r != None:
+                self.persistent_hit += 1
+        if r == None:
+            v = DFPerciseDataDepVisitor(self.terms, self.binddict, target)
+            r = v.visit(tree)
+        if self.persistent != None:
+            self.persistent.put_datadep(tree, target, r)
+        self.cache[key] = (tree, r)
+        return r
+
+    def stats(self):
+        total = self.hit + self.miss
+        ratio = self.hit / total if total > 0 else 0.0
+        return "DFPerciseDataDepCache: {} hits, {} misses ({} from the previous run), {} entries, hit ratio {:.2%}".format(
+                self.hit, self.miss, self.persistent_hit, len(self.cache), ratio)
+
+
+# Keep the propagation chain of a flow across runs (see losscheck.py --chain-cache).
+# Everything is keyed by digests of the binds, so after an RTL edit:
+# 1. if none of the binds the chain was computed from changed, the whole chain is
+#    reused without any analysis
+# 2. otherwise the chain is recomputed, but the precise data dependency of every
+#    bind tree that did not change is reused from the previous run
+class FlowGuardChainCache:
+    VERSION = 1
+
+    def __init__(self, path, terms, binddict):
+        self.path = path
+        self.terms = terms
+        self.binddict = binddict
+        # termname => digest of the term and of all its binds
+        self.term_digests = {}
+        # id(tree) => (tree, digest)
+        self.tree_digests = {}
+        # (tree digest, target key) => DFPerciseDataDepVisitor result
+        self.prev_datadep = {}
+        self.next_datadep = {}
+        self.prev = None
+        if path != None and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    self.prev = pickle.load(f)
+            except Exception as e:
+                print("Ignoring unreadable chain cache {}: {}".format(path, e))
+            if self.prev != None and self.prev.get("version") != self.VERSION:
+                self.prev = None
+            if self.prev != None:
+                self.prev_datadep = self.prev["datadep"]
+
+    @staticmethod
+    def digest(s):
+        return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def node_str(node):
+        return "None" if node == None else node.tostr()
+
+    def get_referenced_terms(self, tree, referenced):
+        stack = [tree]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node == None:
+                continue
+            if isinstance(node, df.DFTerminal):
+                referenced.add(node.name)
+            stack.extend(node.children())
+
+    def get_tree_digest(self, tree):
+        """
+        The digest of a bind tree, including everything DFPerciseDataDepVisitor
+        reads besides the tree: the terms it references and the binds of the
+        Rename terms it inlines.
+        """
+        if id(tree) in self.tree_digests:
+            return self.tree_digests[id(tree)][1]
+        referenced = set()
+        self.get_referenced_terms(tree, referenced)
+        parts = [tree.tostr()]
+        for termname in sorted(referenced, key=str):
+            if not termname in self.terms:
+                continue
+            term = self.terms[termname]
+            if 'Rename' in term.termtype:
+                parts.append(self.get_term_digest(termname))
+            else:
+                parts.append(term.tostr())
+        d = self.digest("\n".join(parts))
+        self.tree_digests[id(tree)] = (tree, d)
+        return d
+
+    def get_term_digest(self, termname):
+        if termname in self.term_digests:
+            return self.term_digests[termname]
+        parts = [self.terms[termname].tostr() if termname in self.terms else str(termname)]
+        for bd in self.binddict.get(termname, []):
+            alwaysinfo = None
+            if bd.alwaysinfo != None:
+                alwaysinfo = tuple(str(getattr(bd.alwaysinfo, a, None)) for a in
+                        ("clock_name", "clock_edge", "clock_bit", "reset_name", "reset_edge", "reset_bit"))
+            parts.append(str((self.node_str(bd.msb), self.node_str(bd.lsb), self.node_str(bd.ptr),
+                str(bd.parameterinfo), alwaysinfo, self.get_tree_digest(bd.tree))))
+        d = self.digest("\n".join(parts))
+        self.term_digests[termname] = d
+        return d
+
+    @staticmethod
+    def get_target_key(target):
+        return (str(target.termname), FlowGuardChainCache.node_str(target.msb),
+                FlowGuardChainCache.node_str(target.lsb), FlowGuardChainCache.node_str(target.ptr))
+
+    def get_datadep(self, tree, target):
+        return self.prev_datadep.get((self.get_tree_digest(tree), self.get_target_key(target)))
+
+    def put_datadep(self, tree, target, r):
+        self.next_datadep[(self.get_tree_digest(tree), self.get_target_key(target))] = r
+
+    def load(self, config):
+        """
+        Return: the chain of the previous run if it was computed with the same
+        config and none of the terms it was computed from changed, otherwise None
+        """
+        if self.prev == None or self.prev["config"] != config:
+            return None
+        for termname, d in self.prev["terms"]:
+            if self.get_term_digest(termname) != d:
+                print("Chain cache: {} changed, recomputing the chain".format(termname))
+                return None
+        return self.prev["chain"]
+
+    def save(self, config, termnames, chain):
+        if self.path == None:
+            return
+        content = {
+            "version": self.VERSION,
+            "config": config,
+            "terms": [(t, self.get_term_digest(t)) for t in termnames],
+            "chain": chain,
+            "datadep": self.next_datadep
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+
 class TargetEntry:
     def __init__(self, termname, tree=None, msb=None, lsb=None, ptr=None, rd_ptr=None,
             rd_subling=None, wr_subling=None):
@@ -692,11 +876,25 @@ class GraphNode:
 #        for child in node.children():
 #            items += self.visit(child)
 
+# State shared by the FlowGuardInstrumentationPass instances of different flows that
+# instrument the same design (see losscheck.py --flows).
+class FlowGuardSharedState:
+    def __init__(self):
+        # signal name -> vast.Logic, for all instrumented signals defined so far
+        self.instrumented_def_cache = {}
+        # (signal name, ptr) of flow-independent signals that have been driven
+        self.emitted = set()
+
 class FlowGuardInstrumentationPass:
     DISPLAY_TAG = "debug_display_flowguard"
+    # The value of these shadow signals only depends on the target itself, not on
+    # the flow being checked, so they can be shared by all flows.
+    FLOW_INDEPENDENT_TYPES = {"assign", "assign_q"}
     def __init__(self, ast, terms, binddict, data_in, data_in_valid, 
             data_out, reset, identifierRef, typeInfo, gephi=False,
-            optimizeGen=True):
+            optimizeGen=True, packArray=False, graphOutput=None, flowName=None,
+            shared=None, cseGen=True, costEstimator=None, budgetRegBits=None,
+            budgetTraceBits=None, budgetReport=None, chainCache=None, packSlices=False):
         self.ast = ast
         self.terms = terms
         self.binddict = binddict
@@ -706,8 +904,8 @@ class FlowGuardInstrumentationPass:
         self.reset = util.toTermname(reset)
         self.vars = []
         self.parsed = {}
-        self.gephi = gephi
-        if gephi and GEPHISTREAMER_AVAILABLE:
+        self.gephi = gephi and GEPHISTREAMER_AVAILABLE
+        if self.gephi:
             try:
                 self.stream = streamer.Streamer(streamer.GephiWS(hostname="localhost", port=8080, workspace="workspace1"))
             except:
@@ -718,8 +916,24 @@ class FlowGuardInstrumentationPass:
         self.valid_cache = {}
         self.prop_cache = {}
         self.good_cache = {}
+        self.datadep_cache = DFPerciseDataDepCache(terms, binddict)
+        # If chainCache (a file path) is set, the propagation chain is kept across
+        # runs and only recomputed when the binds it depends on change.
+        self.chain_cache = None
+        if chainCache != None:
+            self.chain_cache = FlowGuardChainCache(chainCache, terms, binddict)
+            self.datadep_cache.persistent = self.chain_cache
         self.instrumented_name_cache = {}
-        self.instrumented_def_cache = {}
+        # When several flows are instrumented into the same design, every flow has
+        # a name which is appended to its flow-dependent signals, and all flows
+        # share the definitions and drivers of flow-independent signals.
+        if flowName != None:
+            assert(flowName.isidentifier())
+        self.flow_name = flowName
+        self.shared = shared if shared != None else FlowGuardSharedState()
+        self.instrumented_def_cache = self.shared.instrumented_def_cache
+        # termnames whose shadow signals are driven by blackbox models, never shared
+        self.flow_private_terms = set()
         self.blackbox_modules = {}
         self.filtered_set = set()
 
@@ -728,11 +942,56 @@ class FlowGuardInstrumentationPass:
 
         self.array_pointer_delay_cnt = 0
 
+        # If packArray is set, the shadow signals of an array accessed with a
+        # non-constant pointer are packed into one vector per signal type (one bit
+        # per element) and updated with a single vectorized assignment, instead
+        # of unrolling the instrumentation for every element.
+        self.pack_array = packArray
+
+        # If packSlices is set, the shadow signals of all the slices of one signal
+        # are packed into one vector per signal type (one bit per slice), driven by
+        # one assignment and, for registers, updated by one nonblocking assignment.
+        self.pack_slices = packSlices
+        # slice target => (bit index, number of slices)
+        self.slice_index = {}
+        # termname => (slice targets ordered by lsb, senslist or None)
+        self.slice_groups = {}
+
+        # If set, the propagation graph is written to this file (.graphml, .gexf
+        # or .json) in one batch at the end of the analysis.
+        self.graph_output = graphOutput
+
         if optimizeGen:
-            self.optimizer = SingleBitOptimizationVisitor()
+            self.optimizer = SingleBitOptimizationVisitor(
+                    SingleBitOptimizationVisitor.get_const_tbl(terms, binddict))
         else:
             self.optimizer = DoNothingVisitor()
 
+        # If cseGen is set, the generated expressions are hash-consed: identical
+        # subexpressions are shared, simplified only once, and the 1 bit ones used
+        # more than once are hoisted into their own wires.
+        if cseGen:
+            self.expr_builder = HashConsExprBuilder(self.optimizer, self.is_single_bit_signal,
+                    prefix="flowguard_cse_" + self.get_flow_suffix())
+        else:
+            self.expr_builder = None
+        self.merged_conds_cache = {}
+
+        # If set, the cost of the generated logic is reported to this CostEstimator
+        self.cost_estimator = costEstimator
+        # instrumented signal name => the target it belongs to, for cost reports
+        self.instrumented_name2target = {}
+
+        # If a budget (register bits and/or recorded trace bits) is given, only the
+        # highest ranked registers of the propagation chain that fit in the budget
+        # are checked for data loss. The tracking of the propagation (_av, _ai,
+        # _assign, _valid) is needed by the whole chain and always instrumented.
+        self.budget_reg_bits = budgetRegBits
+        self.budget_trace_bits = budgetTraceBits
+        self.budget_report = budgetReport
+        # dff targets whose _prop, _good and loss check are not instrumented
+        self.budget_dropped = set()
+
     def addBlackboxModule(self, modulename, model):
         self.blackbox_modules[modulename] = model
 
@@ -752,7 +1011,66 @@ class FlowGuardInstrumentationPass:
         if self.gephi:
             self.stream.add_edge(e)
 
+    def get_graph_node_id(self, target):
+        if target.termname == self.data_out:
+            return str(self.data_out)
+        if target.termname == self.data_in:
+            return str(self.data_in)
+        return target.toStr()
+
+    def export_graph(self, path, prop_chain, reverse_map, forward_map, dff_map, m_in, m_out):
+        exporter = GraphExporter()
+
+        def add_node(target):
+            nid = self.get_graph_node_id(target)
+            if nid in exporter.nodes:
+                return nid
+            term = self.terms[target.termname]
+            dims = None
+            if term.dims != None:
+                dims = ",".join(str(d[0].eval() - d[1].eval() + 1) for d in term.dims)
+            exporter.add_node(nid,
+                    label=nid,
+                    termname=str(target.termname),
+                    msb=target.msb.eval() if target.msb != None else None,
+                    lsb=target.lsb.eval() if target.lsb != None else None,
+                    ptr=str(target.ptr) if target.ptr != None else None,
+                    rd_ptr=str(target.rd_ptr) if target.rd_ptr != None else None,
+                    dims=dims,
+                    in_prop_chain=target in prop_chain,
+                    dff=target in dff_map,
+                    blackbox_in=target in m_in,
+                    blackbox_out=target in m_out,
+                    source=target.termname == self.data_in,
+                    sink=target.termname == self.data_out)
+            return nid
+
+        for target in prop_chain:
+            add_node(target)
+        for src, dsts in forward_map.items():
+            for dst, conds, assigntype, alwaysinfo in dsts:
+                exporter.add_edge(add_node(src), add_node(dst),
+                        assigntype=str(assigntype), cond_cnt=len(conds) if conds != None else 0)
+        for dst, srcs in reverse_map.items():
+            for src, conds, assigntype, alwaysinfo in srcs:
+                exporter.add_edge(add_node(src), add_node(dst),
+                        assigntype=str(assigntype), cond_cnt=len(conds) if conds != None else 0)
+
+        exporter.write(path)
+        print("Propagation graph ({} nodes, {} edges) written to {}".format(
+            len(exporter.nodes), len(exporter.edges), path))
+
+    def get_chain_cache_config(self):
+        return (str(self.data_in), str(self.data_in_valid), str(self.data_out),
+                str(self.reset), tuple(sorted(self.blackbox_modules.keys())))
+
     def find_prop_chain(self):
+        if self.chain_cache != None:
+            chain = self.chain_cache.load(self.get_chain_cache_config())
+            if chain != None:
+                print("Chain cache: reusing the propagation chain of the previous run")
+                return chain
+
         queue = []
         queue.append(self.data_out)
         visited = set()
@@ -806,6 +1124,8 @@ class FlowGuardInstrumentationPass:
         # generating gephi nodes
         gephi_node_map = {}
         def getNodeByTargetEntry(target):
+            if not self.gephi:
+                return None
             target_str = target.toStr()
             if target.termname == self.data_out:
                 target_str = str(self.data_out)
@@ -869,8 +1189,7 @@ class FlowGuardInstrumentationPass:
                 #print("dst:", itemfull.dst, itemfull.dst_msb, itemfull.dst_lsb, itemfull.dst_ptr)
                 #print("src:", itemfull.src, itemfull.src_msb, itemfull.src_lsb, itemfull.src_ptr)
 
-                v = DFPerciseDataDepVisitor(self.terms, self.binddict, target)
-                r = v.visit(itemfull.tree)
+                r = self.datadep_cache.visit(itemfull.tree, target)
                 r = list(r)
                 if r[0] != None and itemfull.dst_lsb != None:
                     r[0] += itemfull.dst_lsb.eval()
@@ -974,9 +1293,10 @@ class FlowGuardInstrumentationPass:
                             curr = curr.wr_subling
 
                     queue.append(dst_target)
-                    itemnode = getNodeByTargetEntry(dst_target)
-                    e = graph.Edge(termnode, itemnode)
-                    self.gephi_add_edge(e)
+                    if self.gephi:
+                        itemnode = getNodeByTargetEntry(dst_target)
+                        e = graph.Edge(termnode, itemnode)
+                        self.gephi_add_edge(e)
 
                     # We need the reverse_map to search the src for each dst
                     if not dst_target in reverse_map2:
@@ -1086,43 +1406,57 @@ class FlowGuardInstrumentationPass:
                     unassigned_map2[node.termname] = []
                 unassigned_map2[node.termname].append((bd, uav.unassigned_cond))
 
-        dff_map = {}
-        for n in prop_chain:
-            if not n in reverse_map2:
-                continue
-            for src, conds, assigntype, alwaysinfo in reverse_map2[n]:
-                if assigntype == "nonblocking":
-                    dff_map[n] = alwaysinfo
+        if self.gephi:
+            dff_map = {}
+            for n in prop_chain:
+                if not n in reverse_map2:
+                    continue
+                for src, conds, assigntype, alwaysinfo in reverse_map2[n]:
+                    if assigntype == "nonblocking":
+                        dff_map[n] = alwaysinfo
 
-        for node in prop_chain:
-            #print(node.toStr())
-            n = getNodeByTargetEntry(node)
-            n.color_hex(255, 0, 0)
-            self.gephi_change_node(n)
-
-        for node in dff_map:
-            n = getNodeByTargetEntry(node)
-            n.color_hex(0, 255, 255)
-            self.gephi_change_node(n)
-
-        for node in visited2:
-            if not node in prop_chain:
+            for node in prop_chain:
+                #print(node.toStr())
                 n = getNodeByTargetEntry(node)
-                self.gephi_delete_node(n)
+                n.color_hex(255, 0, 0)
+                self.gephi_change_node(n)
 
-        start = getNodeByTargetEntry(TargetEntry(self.data_in))
-        start.color_hex(0, 0, 255)
-        start.property["size"] = 25
-        self.gephi_change_node(start)
-        end = getNodeByTargetEntry(TargetEntry(self.data_out))
-        end.color_hex(0, 0, 255)
-        end.property["size"] = 25
-        self.gephi_change_node(end)
-
-
-        return (prop_chain, reverse_map2, forward_map2, unassigned_map2)
+            for node in dff_map:
+                n = getNodeByTargetEntry(node)
+                n.color_hex(0, 255, 255)
+                self.gephi_change_node(n)
+
+            for node in visited2:
+                if not node in prop_chain:
+                    n = getNodeByTargetEntry(node)
+                    self.gephi_delete_node(n)
+
+            start = getNodeByTargetEntry(TargetEntry(self.data_in))
+            start.color_hex(0, 0, 255)
+            start.property["size"] = 25
+            self.gephi_change_node(start)
+            end = getNodeByTargetEntry(TargetEntry(self.data_out))
+            end.color_hex(0, 0, 255)
+            end.property["size"] = 25
+            self.gephi_change_node(end)
+
+        print(self.datadep_cache.stats())
+
+        chain = (prop_chain, reverse_map2, forward_map2, unassigned_map2)
+        if self.chain_cache != None:
+            self.chain_cache.save(self.get_chain_cache_config(), sorted(visited, key=str), chain)
+        return chain
 
     def get_merged_conds(self, conds):
+        if self.expr_builder == None:
+            return self.build_merged_conds(conds)
+        # the conds come from the propagation chain, which outlives this cache
+        key = tuple((id(cond), b) for cond, b in conds)
+        if not key in self.merged_conds_cache:
+            self.merged_conds_cache[key] = (conds, self.expr_builder.intern(self.build_merged_conds(conds)))
+        return self.merged_conds_cache[key][1]
+
+    def build_merged_conds(self, conds):
         if len(conds) == 0:
             return vast.IntConst("1'b1")
         
@@ -1139,20 +1473,68 @@ class FlowGuardInstrumentationPass:
             i += 1
         return base
 
-    def get_instrumented_name(self, target, ntype):
-        if (target, ntype) in self.instrumented_name_cache:
-            return self.instrumented_name_cache[(target, ntype)]
+    def is_flow_shared(self, target, ntype):
+        # the slices packed together depend on the flow
+        return (ntype in self.FLOW_INDEPENDENT_TYPES and
+                not target.termname in self.flow_private_terms and
+                not target in self.slice_index)
 
-        term = self.terms[target.termname]
+    def get_flow_suffix(self):
+        if self.flow_name == None:
+            return ""
+        return self.flow_name + "__"
+
+    def get_instrumented_basename(self, target, ntype):
         name = str(target.termname[1])
+        if target in self.slice_index:
+            return name + "__SLICES____" + ntype.upper() + "__" + self.get_flow_suffix()
         if target.lsb != None:
             assert(target.msb != None)
             lsb = target.lsb.eval()
             msb = target.msb.eval()
             name += "__BRA__" + str(msb) + "__03A" + str(lsb) + "__KET__"
         name += "__" + ntype.upper() + "__"
+        if not self.is_flow_shared(target, ntype):
+            name += self.get_flow_suffix()
+        return name
+
+    # Return False if a flow-independent signal has already been driven by
+    # another flow, in which case the caller should not drive it again.
+    def claim_driver(self, target, ntype):
+        if not self.is_flow_shared(target, ntype):
+            return True
+        if self.pack_array and self.is_array_target(target):
+            # one assign drives the whole packed vector, whatever the write ptrs of the flow
+            key = (self.get_instrumented_basename(target, ntype), None)
+        else:
+            key = (self.get_instrumented_basename(target, ntype), str(target.ptr))
+        if key in self.shared.emitted:
+            return False
+        self.shared.emitted.add(key)
+        return True
+
+    def get_loss_prefix(self):
+        if self.flow_name == None:
+            return ""
+        return "(" + self.flow_name + ") "
+
+    def get_instrumented_inst_name(self, instname):
+        return instname + "__INSTM__" + self.get_flow_suffix()
+
+    def get_instrumented_name(self, target, ntype):
+        if (target, ntype) in self.instrumented_name_cache:
+            return self.instrumented_name_cache[(target, ntype)]
+
+        term = self.terms[target.termname]
+        name = self.get_instrumented_basename(target, ntype)
 
-        if target.ptr == None:
+        if target in self.slice_index:
+            # one bit of the packed vector of all slices
+            idx, cnt = self.slice_index[target]
+            r = vast.Pointer(vast.Identifier(name), vast.IntConst(str(idx)))
+            self.instrumented_name_cache[(target, ntype)] = r
+            return r
+        elif target.ptr == None:
             #assert(term.dims == None)
             r = vast.Identifier(name)
             self.instrumented_name_cache[(target, ntype)] = r
@@ -1166,19 +1548,20 @@ class FlowGuardInstrumentationPass:
 
     def get_instrumented_def(self, target, ntype):
         term = self.terms[target.termname]
-        name = str(target.termname[1])
-        if target.lsb != None:
-            assert(target.msb != None)
-            lsb = target.lsb.eval()
-            msb = target.msb.eval()
-            name += "__BRA__" + str(msb) + "__03A" + str(lsb) + "__KET__"
-        name += "__" + ntype.upper() + "__"
+        name = self.get_instrumented_basename(target, ntype)
+        self.instrumented_name2target[name] = target.toStr()
 
         if name in self.instrumented_def_cache:
             return None
 
-        if target.ptr == None:
+        if target in self.slice_index:
+            idx, cnt = self.slice_index[target]
+            r = vast.Logic(name, getWidthFromInt(cnt))
+        elif target.ptr == None:
             r = vast.Logic(name)
+        elif self.pack_array:
+            # one packed bit per array element, see get_packed_name
+            r = vast.Logic(name, getWidthFromInt(self.get_array_dim(target)))
         else:
             term = self.terms[target.termname]
             assert(len(term.dims) == 1)
@@ -1294,8 +1677,82 @@ class FlowGuardInstrumentationPass:
             else:
                 base = vast.Or(base, src_av)
 
-        self.av_cache[target] = base
-        return self.optimizer.visit(base)
+        return self.finish_expr(self.av_cache, target, base)
+
+    # Simplify a generated expression and remember it in cache
+    def finish_expr(self, cache, key, r):
+        if self.expr_builder != None:
+            r = self.expr_builder.simplify(r)
+        else:
+            r = self.optimizer.visit(r)
+        cache[key] = r
+        return r
+
+    def is_single_bit_signal(self, node):
+        if isinstance(node, vast.Identifier):
+            if node.name in self.instrumented_def_cache:
+                d = self.instrumented_def_cache[node.name]
+                return d.width == None and d.dimensions == None
+            termname = util.toTermname(str(self.data_in[0]) + "." + node.name)
+            if not termname in self.terms:
+                return False
+            term = self.terms[termname]
+            return (term.dims == None and term.msb != None and term.lsb != None and
+                    term.msb.eval() == term.lsb.eval())
+        if isinstance(node, vast.Pointer) and isinstance(node.var, vast.Identifier):
+            # one element of an instrumented array or one bit of a packed vector
+            if node.var.name in self.instrumented_def_cache:
+                return True
+        return False
+
+    # The width of a signal of the design, None if unknown
+    def get_signal_width(self, node):
+        if not isinstance(node, vast.Identifier):
+            return None
+        termname = util.toTermname(str(self.data_in[0]) + "." + node.name)
+        if not termname in self.terms:
+            return None
+        term = self.terms[termname]
+        if term.msb == None or term.lsb == None:
+            return None
+        return term.msb.eval() - term.lsb.eval() + 1
+
+    def report_cost(self, ldefs, lblocking, lnonblocking):
+        pass_name = self.__class__.__name__
+        if self.flow_name != None:
+            pass_name += "." + self.flow_name
+        def get_target(name):
+            if name in self.instrumented_name2target:
+                return self.instrumented_name2target[name]
+            if name != None and name.startswith("flowguard_cse_"):
+                return "(shared logic)"
+            return "(other)"
+        self.cost_estimator.add_items(pass_name, get_target, ldefs, self.get_signal_width)
+        self.cost_estimator.add_items(pass_name, get_target, lblocking, self.get_signal_width)
+        for senslist in lnonblocking:
+            self.cost_estimator.add_items(pass_name, get_target, lnonblocking[senslist], self.get_signal_width)
+
+    # Hoist the subexpressions shared by the generated assignments into wires and
+    # replace every assignment by a fresh tree.
+    def apply_cse(self, ldefs, lblocking, lnonblocking):
+        assignments = [a for a in lblocking if isinstance(a, vast.Assign)]
+        for senslist in lnonblocking:
+            assignments += [a for a in lnonblocking[senslist]
+                    if isinstance(a, vast.NonblockingSubstitution)]
+        roots = []
+        for a in assignments:
+            a.right.var = self.expr_builder.intern(a.right.var)
+            roots.append(a.right.var)
+
+        names, wires = self.expr_builder.hoist(roots)
+        for name, node in wires:
+            ldefs.append(vast.Logic(name))
+            lblocking.append(vast.Assign(
+                vast.Lvalue(vast.Identifier(name)),
+                vast.Rvalue(self.expr_builder.materialize(node, names, keep_root=True))))
+        for a in assignments:
+            a.right.var = self.expr_builder.materialize(a.right.var, names)
+        print(self.expr_builder.stats() + ", {} wires hoisted".format(len(wires)))
 
     def get_av_q(self, target):
         return self.get_av_name(target)
@@ -1313,8 +1770,7 @@ class FlowGuardInstrumentationPass:
                 self.get_assign_name(tgt),
                 vast.Unot(self.get_av_name(tgt)));
 
-        self.ai_cache[tgt] = r
-        return self.optimizer.visit(r)
+        return self.finish_expr(self.ai_cache, tgt, r)
 
     def get_ai_q(self, target):
         return self.get_ai_name(target)
@@ -1413,7 +1869,7 @@ class FlowGuardInstrumentationPass:
 
         if r == None:
             r = vast.IntConst("1'b1")
-        return self.optimizer.visit(r)
+        return self.finish_expr(self.assign_cache, target, r)
 
     def get_assign_q(self, target):
         return self.get_assign_name(target)
@@ -1438,8 +1894,7 @@ class FlowGuardInstrumentationPass:
             # return False if target not in prop_chain
             r = vast.IntConst("1'b0")
 
-        self.valid_cache[tgt] = r
-        return self.optimizer.visit(r)
+        return self.finish_expr(self.valid_cache, tgt, r)
 
     def get_valid_q(self, target):
         return self.get_valid_name(target)
@@ -1508,8 +1963,7 @@ class FlowGuardInstrumentationPass:
                 if base != conds:
                     base = vast.Or(base, conds)
 
-        self.prop_cache[target] = base
-        return self.optimizer.visit(base)
+        return self.finish_expr(self.prop_cache, target, base)
 
     def get_prop_q(self, target):
         return self.get_prop_name(target)
@@ -1527,12 +1981,210 @@ class FlowGuardInstrumentationPass:
                 vast.Cond(self.get_av_q_name(tgt), vast.IntConst("1'b0"),
                     vast.Or(self.get_good_q_name(tgt), self.get_prop_q_name(tgt))))
 
-        self.good_cache[tgt] = r
-        return self.optimizer.visit(r)
+        return self.finish_expr(self.good_cache, tgt, r)
+
+    def is_array_target(self, target):
+        return (target.ptr != None and target.ptr.__class__ != df.DFIntConst and
+                target.ptr.__class__ != df.DFEvalValue)
+
+    def get_array_dim(self, target):
+        term = self.terms[target.termname]
+        assert(len(term.dims) == 1)
+        return term.dims[0][0].eval() - term.dims[0][1].eval() + 1
+
+    # The whole packed shadow vector of an array. A single element is still
+    # referenced by get_*_name(), which becomes a bit-select on the vector.
+    def get_packed_name(self, target, ntype):
+        return vast.Identifier(self.get_instrumented_basename(target, ntype))
+
+    def get_packed_const(self, dim, value):
+        return vast.IntConst(str(dim) + "'h" + hex(value)[2:])
+
+    def get_packed_replicate(self, dim, node):
+        return vast.Repeat(vast.Concat([node]), vast.IntConst(str(dim)))
+
+    # A dim-bit vector whose only set bit is the one selected by ptr
+    def get_packed_onehot(self, dim, ptr):
+        builder = DFBuildAstVisitor(self.terms, self.binddict)
+        return vast.Sll(self.get_packed_const(dim, 1), builder.visit(ptr))
+
+    # Vectorized version of get_assign: bit i is get_assign() of element i
+    def get_packed_assign(self, target, unassigned_map, dim):
+        interested_lsb = None
+        interested_msb = None
+        if target.lsb == None:
+            interested_lsb = self.terms[target.termname].lsb.eval()
+        else:
+            interested_lsb = target.lsb.eval()
+        if target.msb == None:
+            interested_msb = self.terms[target.termname].msb.eval()
+        else:
+            interested_msb = target.msb.eval()
+
+        builder = DFBuildAstVisitor(self.terms, self.binddict)
+        full_mask = (1 << dim) - 1
+        # elements with at least one term, the others are always assigned
+        covered_mask = 0
+        l = []
+        for bd, unassigned_cond in unassigned_map[target.termname]:
+            bd_lsb = None
+            if bd.lsb == None:
+                bd_lsb = self.terms[target.termname].lsb.eval()
+            else:
+                bd_lsb = bd.lsb.eval()
+            bd_msb = None
+            if bd.msb == None:
+                bd_msb  = self.terms[target.termname].msb.eval()
+            else:
+                bd_msb = bd.msb.eval()
+
+            if bd_lsb > interested_msb:
+                continue
+            if bd_msb < interested_lsb:
+                continue
+            assert(bd.ptr != None)
+            if unassigned_cond == None:
+                continue
+
+            assigned = self.optimizer.visit(vast.Unot(builder.visit(unassigned_cond)))
+            if not isinstance(bd.ptr, df.DFIntConst) and not isinstance(bd.ptr, df.DFEvalValue):
+                tmp = vast.And(self.get_packed_replicate(dim, assigned),
+                        self.get_packed_onehot(dim, bd.ptr))
+                covered_mask = full_mask
+            else:
+                idx = bd.ptr.eval()
+                if idx < 0 or idx >= dim:
+                    continue
+                tmp = vast.And(self.get_packed_replicate(dim, assigned),
+                        self.get_packed_const(dim, 1 << idx))
+                covered_mask |= (1 << idx)
+            if not tmp in l:
+                l.append(tmp)
+
+        r = None
+        for ent in l:
+            if r == None:
+                r = ent
+            else:
+                r = vast.Or(r, ent)
+
+        if covered_mask != full_mask:
+            uncovered = self.get_packed_const(dim, full_mask & ~covered_mask)
+            r = uncovered if r == None else vast.Or(r, uncovered)
+        return r
+
+    # Vectorized _av/_ai/_assign/_valid assignments for an array target
+    def get_packed_array_assigns(self, n, prop_chain, reverse_map, unassigned_map, wire):
+        dim = self.get_array_dim(n)
+        idx_match = None
+        curr = n
+        while curr != None:
+            if idx_match == None:
+                idx_match = self.get_packed_onehot(dim, curr.ptr)
+            else:
+                idx_match = vast.Or(idx_match, self.get_packed_onehot(dim, curr.ptr))
+            curr = curr.wr_subling
+
+        av = vast.And(idx_match, self.get_packed_replicate(dim, self.get_av(n, reverse_map)))
+        ai = vast.And(self.get_packed_name(n, "assign"), vast.Unot(self.get_packed_name(n, "av")))
+        assign = self.get_packed_assign(n, unassigned_map, dim)
+        if wire:
+            valid = self.get_packed_name(n, "av")
+        else:
+            valid = vast.Or(self.get_packed_name(n, "av_q"),
+                    vast.And(vast.Unot(self.get_packed_name(n, "assign_q")),
+                        self.get_packed_name(n, "valid_q")))
+
+        r = []
+        for ntype, rvalue in (("av", av), ("ai", ai), ("assign", assign), ("valid", valid)):
+            if not self.claim_driver(n, ntype):
+                continue
+            r.append(vast.Assign(
+                vast.Lvalue(self.get_packed_name(n, ntype)),
+                vast.Rvalue(rvalue)))
+        return r
+
+    # Vectorized _prop/_good assignments for an array target
+    def get_packed_array_prop_good(self, n, prop_chain, forward_map, dff_map):
+        dim = self.get_array_dim(n)
+        prop = self.get_prop(n, prop_chain, forward_map, dff_map)
+        if n.rd_subling == None:
+            access_ptr = n.ptr if n.rd_ptr == None else n.rd_ptr
+            prop_val = vast.And(self.get_packed_onehot(dim, access_ptr),
+                    self.get_packed_replicate(dim, prop))
+        else:
+            # every element is read through its own constant pointer
+            prop_val = self.get_packed_replicate(dim, prop)
+
+        builder = DFBuildAstVisitor(self.terms, self.binddict)
+        good_val = vast.Or(
+                vast.Or(self.get_packed_replicate(dim, builder.visit(df.DFTerminal(self.reset))),
+                    self.get_packed_name(n, "ai_q")),
+                vast.And(vast.Unot(self.get_packed_name(n, "av_q")),
+                    vast.Or(self.get_packed_name(n, "good_q"), self.get_packed_name(n, "prop_q"))))
+
+        return [vast.Assign(vast.Lvalue(self.get_packed_name(n, "prop")), vast.Rvalue(prop_val)),
+                vast.Assign(vast.Lvalue(self.get_packed_name(n, "good")), vast.Rvalue(good_val))]
+
+    def group_slices(self, prop_chain, reverse_map, m_in, m_out):
+        """
+        Find the signals with several slices in the propagation chain whose shadow
+        signals can be packed: all slices are driven the same way (same clock for
+        registers), and none of them is connected to a blackbox module.
+        """
+        candidates = {}
+        excluded = set()
+        for n in prop_chain:
+            if not n in reverse_map:
+                continue
+            if n in m_in or n in m_out:
+                excluded.add(n.termname)
+                continue
+            if n.ptr != None or n.lsb == None:
+                continue
+            candidates.setdefault(n.termname, []).append(n)
+        for n in m_in:
+            excluded.add(n.termname)
+
+        for termname, slices in candidates.items():
+            if termname in excluded or termname in self.flow_private_terms or len(slices) < 2:
+                continue
+            drivers = set()
+            for n in slices:
+                src, conds, assigntype, alwaysinfo = reverse_map[n][0]
+                if assigntype == "nonblocking":
+                    drivers.add((alwaysinfo.original_senslist, alwaysinfo.clock_name, alwaysinfo.clock_edge))
+                else:
+                    drivers.add(None)
+            if len(drivers) != 1:
+                continue
+            slices.sort(key=lambda n: n.lsb.eval())
+            for idx, n in enumerate(slices):
+                self.slice_index[n] = (idx, len(slices))
+            self.slice_groups[termname] = (slices, drivers.pop())
+
+    # Drive the packed vectors of the slices of termname.
+    # values: ntype => {slice target => value of the bit}, default is used for the
+    # slices without a value
+    def get_packed_slices_items(self, termname, values, ntypes, lblocking, lnonblocking):
+        slices, senslist = self.slice_groups[termname]
+        for ntype, default in ntypes:
+            if not ntype in values:
+                continue
+            bits = [values[ntype].get(n, vast.IntConst(default)) for n in reversed(slices)]
+            name = self.get_instrumented_basename(slices[0], ntype)
+            lblocking.append(vast.Assign(
+                vast.Lvalue(vast.Identifier(name)),
+                vast.Rvalue(vast.Concat(bits))))
+            if senslist != None:
+                lnonblocking.setdefault(senslist, []).append(vast.NonblockingSubstitution(
+                    vast.Lvalue(vast.Identifier(self.get_instrumented_basename(slices[0], ntype + "_q"))),
+                    vast.Rvalue(vast.Identifier(name))))
 
     def get_pointer_delay_def_use(self, width):
-        d = vast.Logic("array_pointer_delay_"+str(self.array_pointer_delay_cnt), getWidthFromInt(width))
-        u = vast.Identifier("array_pointer_delay_"+str(self.array_pointer_delay_cnt))
+        name = "array_pointer_delay_" + self.get_flow_suffix() + str(self.array_pointer_delay_cnt)
+        d = vast.Logic(name, getWidthFromInt(width))
+        u = vast.Identifier(name)
         self.array_pointer_delay_cnt += 1
         return (d, u)
 
@@ -1552,7 +2204,7 @@ class FlowGuardInstrumentationPass:
                         vast.Unot(vast.Or(self.get_good_q_name(tgt), self.get_prop_q_name(tgt))),
                         self.get_assign_q_name(tgt)),
                     vast.SingleStatement(vast.SystemCall("display", [
-                        vast.StringConst("[%0t] %%loss: " + target.toStr()),
+                        vast.StringConst("[%0t] %%loss: " + self.get_loss_prefix() + target.toStr()),
                         vast.SystemCall("time", [])
                     ], anno=self.DISPLAY_TAG)),
                     None)
@@ -1562,7 +2214,7 @@ class FlowGuardInstrumentationPass:
                         vast.Unot(vast.Or(self.get_good_q_name(tgt), self.get_prop_q_name(tgt))),
                         self.get_assign_q_name(tgt)),
                     vast.SingleStatement(vast.SystemCall("display", [
-                        vast.StringConst("[%0t] %%loss: " + target.toStr() + " ptr=h%h"),
+                        vast.StringConst("[%0t] %%loss: " + self.get_loss_prefix() + target.toStr() + " ptr=h%h"),
                         vast.SystemCall("time", []),
                         builder.visit(tgt.ptr)
                     ], anno=self.DISPLAY_TAG)),
@@ -1573,8 +2225,14 @@ class FlowGuardInstrumentationPass:
     def get_good_q(self, target):
         return self.get_good_name(target)
 
-    def instrument(self):
-        prop_chain, reverse_map, forward_map, unassigned_map = self.find_prop_chain()
+    def instrument(self, chain=None):
+        """
+        chain: the result of find_prop_chain() if it has already been computed
+        (e.g. by find_prop_chains_parallel), otherwise it is computed here.
+        """
+        if chain == None:
+            chain = self.find_prop_chain()
+        prop_chain, reverse_map, forward_map, unassigned_map = chain
         print()
 
         ldefs = []
@@ -1605,6 +2263,7 @@ class FlowGuardInstrumentationPass:
                     # they don't have alwaysinfos
                     dff_map[n] = None
                     dff_map[src] = None
+                    self.flow_private_terms.add(n.termname)
 
         for n in prop_chain:
             if not n in reverse_map:
@@ -1614,6 +2273,15 @@ class FlowGuardInstrumentationPass:
             else:
                 print("-", n.toStr())
 
+        if self.graph_output != None:
+            self.export_graph(self.graph_output, prop_chain, reverse_map, forward_map,
+                    dff_map, m_in, m_out)
+
+        if self.pack_slices:
+            self.group_slices(prop_chain, reverse_map, m_in, m_out)
+        # termname => ntype => {slice target => value}, for the packed slices
+        slice_values = {}
+
         array_instrumented = set()
         for n in prop_chain:
             if not n in reverse_map:
@@ -1643,6 +2311,21 @@ class FlowGuardInstrumentationPass:
 
             src, conds, assigntype, alwaysinfo = reverse_map[n][0]
 
+            # the packed slices are driven together after this loop
+            if n in self.slice_index:
+                wire = not assigntype == "nonblocking"
+                if not wire:
+                    ldefs.append(self.get_av_q_def(n))
+                    ldefs.append(self.get_ai_q_def(n))
+                    ldefs.append(self.get_assign_q_def(n))
+                    ldefs.append(self.get_valid_q_def(n))
+                values = slice_values.setdefault(n.termname, {})
+                values.setdefault("av", {})[n] = self.get_av(n, reverse_map)
+                values.setdefault("ai", {})[n] = self.get_ai(n, reverse_map)
+                values.setdefault("assign", {})[n] = self.get_assign(n, unassigned_map)
+                values.setdefault("valid", {})[n] = self.get_valid(n, prop_chain, reverse_map, wire)
+                continue
+
             # for nonblocking assignments, we need to generate the _q signal
             if assigntype == "nonblocking":
                 senslist = (alwaysinfo.original_senslist, alwaysinfo.clock_name, alwaysinfo.clock_edge)
@@ -1656,7 +2339,14 @@ class FlowGuardInstrumentationPass:
                     lnonblocking[senslist] = []
 
 
-                if (n.ptr != None and n.ptr.__class__ != df.DFIntConst and n.ptr.__class__ != df.DFEvalValue):
+                if self.pack_array and self.is_array_target(n):
+                    for ntype in ("av", "ai", "assign", "valid"):
+                        if not self.claim_driver(n, ntype + "_q"):
+                            continue
+                        lnonblocking[senslist].append(vast.NonblockingSubstitution(
+                            vast.Lvalue(self.get_packed_name(n, ntype + "_q")),
+                            vast.Rvalue(self.get_packed_name(n, ntype))))
+                elif (n.ptr != None and n.ptr.__class__ != df.DFIntConst and n.ptr.__class__ != df.DFEvalValue):
                     term = self.terms[n.termname]
                     print("::::", n.toStr(), "::::", term.dims)
                     dim = term.dims[0][0].eval() - term.dims[0][1].eval() + 1
@@ -1673,9 +2363,10 @@ class FlowGuardInstrumentationPass:
                         lnonblocking[senslist].append(vast.NonblockingSubstitution(
                             vast.Lvalue(self.get_ai_q_name(tmpn)),
                             vast.Rvalue(self.get_ai_q(tmpn))))
-                        lnonblocking[senslist].append(vast.NonblockingSubstitution(
-                            vast.Lvalue(self.get_assign_q_name(tmpn)),
-                            vast.Rvalue(self.get_assign_q(tmpn))))
+                        if self.claim_driver(tmpn, "assign_q"):
+                            lnonblocking[senslist].append(vast.NonblockingSubstitution(
+                                vast.Lvalue(self.get_assign_q_name(tmpn)),
+                                vast.Rvalue(self.get_assign_q(tmpn))))
                         lnonblocking[senslist].append(vast.NonblockingSubstitution(
                             vast.Lvalue(self.get_valid_q_name(tmpn)),
                             vast.Rvalue(self.get_valid_q(tmpn))))
@@ -1686,16 +2377,19 @@ class FlowGuardInstrumentationPass:
                     lnonblocking[senslist].append(vast.NonblockingSubstitution(
                         vast.Lvalue(self.get_ai_q_name(n)),
                         vast.Rvalue(self.get_ai_q(n))))
-                    lnonblocking[senslist].append(vast.NonblockingSubstitution(
-                        vast.Lvalue(self.get_assign_q_name(n)),
-                        vast.Rvalue(self.get_assign_q(n))))
+                    if self.claim_driver(n, "assign_q"):
+                        lnonblocking[senslist].append(vast.NonblockingSubstitution(
+                            vast.Lvalue(self.get_assign_q_name(n)),
+                            vast.Rvalue(self.get_assign_q(n))))
                     lnonblocking[senslist].append(vast.NonblockingSubstitution(
                         vast.Lvalue(self.get_valid_q_name(n)),
                         vast.Rvalue(self.get_valid_q(n))))
 
             wire = not assigntype == "nonblocking"
 
-            if (n.ptr != None and n.ptr.__class__ != df.DFIntConst and n.ptr.__class__ != df.DFEvalValue):
+            if self.pack_array and self.is_array_target(n):
+                lblocking += self.get_packed_array_assigns(n, prop_chain, reverse_map, unassigned_map, wire)
+            elif (n.ptr != None and n.ptr.__class__ != df.DFIntConst and n.ptr.__class__ != df.DFEvalValue):
                 term = self.terms[n.termname]
                 print("::::", n.toStr(), "::::", term.dims)
                 dim = term.dims[0][0].eval() - term.dims[0][1].eval() + 1
@@ -1730,9 +2424,10 @@ class FlowGuardInstrumentationPass:
                     lblocking.append(vast.Assign(
                         vast.Lvalue(self.get_ai_name(tmpn)),
                         vast.Rvalue(self.get_ai(n, reverse_map, idx_override=tmpn.ptr))))
-                    lblocking.append(vast.Assign(
-                        vast.Lvalue(self.get_assign_name(tmpn)),
-                        vast.Rvalue(self.get_assign(tmpn, unassigned_map))))
+                    if self.claim_driver(tmpn, "assign"):
+                        lblocking.append(vast.Assign(
+                            vast.Lvalue(self.get_assign_name(tmpn)),
+                            vast.Rvalue(self.get_assign(tmpn, unassigned_map))))
                     lblocking.append(vast.Assign(
                         vast.Lvalue(self.get_valid_name(tmpn)),
                         vast.Rvalue(self.get_valid(n, prop_chain, reverse_map, wire, idx_override=tmpn.ptr))))
@@ -1744,15 +2439,33 @@ class FlowGuardInstrumentationPass:
                 lblocking.append(vast.Assign(
                     vast.Lvalue(self.get_ai_name(n)),
                     vast.Rvalue(self.get_ai(n, reverse_map))))
-                lblocking.append(vast.Assign(
-                    vast.Lvalue(self.get_assign_name(n)),
-                    vast.Rvalue(self.get_assign(n, unassigned_map))))
+                if self.claim_driver(n, "assign"):
+                    lblocking.append(vast.Assign(
+                        vast.Lvalue(self.get_assign_name(n)),
+                        vast.Rvalue(self.get_assign(n, unassigned_map))))
                 lblocking.append(vast.Assign(
                     vast.Lvalue(self.get_valid_name(n)),
                     vast.Rvalue(self.get_valid(n, prop_chain, reverse_map, wire))))
 
+        for termname in slice_values:
+            self.get_packed_slices_items(termname, slice_values[termname],
+                    (("av", "1'b0"), ("ai", "1'b0"), ("assign", "1'b0"), ("valid", "1'b0")),
+                    lblocking, lnonblocking)
+
+        if self.budget_reg_bits != None or self.budget_trace_bits != None:
+            report = self.select_budgeted_checks(prop_chain, reverse_map, forward_map,
+                    dff_map, m_in, m_out)
+            if self.budget_report != None:
+                with open(self.budget_report, "w") as f:
+                    json.dump(report, f, indent=1)
+
         array_instrumented = set()
+        packed_prop_good = set()
         for n in dff_map:
+            # not enough budget to check n
+            if n in self.budget_dropped:
+                continue
+
             ldefs.append(self.get_prop_def(n))
             ldefs.append(self.get_prop_q_def(n))
             ldefs.append(self.get_good_def(n))
@@ -1782,13 +2495,33 @@ class FlowGuardInstrumentationPass:
             if not senslist in lnonblocking:
                 lnonblocking[senslist] = []
 
+            # the _prop and _good of packed slices are driven together after this loop
+            if n in self.slice_index:
+                values = slice_values.setdefault(n.termname, {})
+                values.setdefault("prop", {})[n] = self.get_prop(n, prop_chain, forward_map, dff_map)
+                values.setdefault("good", {})[n] = self.get_good(n)
+                if not self.check_filtered(n.termname):
+                    check_logic = self.get_check(n, prop_chain, forward_map, dff_map)
+                    if check_logic:
+                        lnonblocking[senslist].append(check_logic)
+                continue
+
             if (n.ptr != None and n.ptr.__class__ != df.DFIntConst and n.ptr.__class__ != df.DFEvalValue):
                 term = self.terms[n.termname]
                 print("::::", n.toStr(), "::::", term.dims)
                 dim = term.dims[0][0].eval() - term.dims[0][1].eval() + 1
                 index_builder = DFBuildAstVisitor(self.terms, self.binddict)
 
-                if n.rd_subling == None:
+                if self.pack_array:
+                    # the packed vectors cover all elements, only emit them once per array
+                    if not n.termname in packed_prop_good:
+                        packed_prop_good.add(n.termname)
+                        for ntype in ("prop", "good"):
+                            lnonblocking[senslist].append(vast.NonblockingSubstitution(
+                                vast.Lvalue(self.get_packed_name(n, ntype + "_q")),
+                                vast.Rvalue(self.get_packed_name(n, ntype))))
+                        lblocking += self.get_packed_array_prop_good(n, prop_chain, forward_map, dff_map)
+                elif n.rd_subling == None:
                     access_ptr = n.ptr if n.rd_ptr == None else n.rd_ptr
                     access_ptr_width = DFDataWidthVisitor(self.terms, self.binddict).visit(access_ptr)
                     width_prefix = str(access_ptr_width) + "'h"
@@ -1900,6 +2633,11 @@ class FlowGuardInstrumentationPass:
                     if check_logic:
                         lnonblocking[senslist].append(check_logic)
 
+        for termname in slice_values:
+            # slices that are not checked never lose data
+            self.get_packed_slices_items(termname, slice_values[termname],
+                    (("prop", "1'b0"), ("good", "1'b1")), lblocking, lnonblocking)
+
         for n in m_in:
             for bbm in self.blackbox_modules:
                 r = None
@@ -1920,11 +2658,17 @@ class FlowGuardInstrumentationPass:
             vast.Lvalue(self.get_valid_name(TargetEntry(self.data_in))),
             vast.Rvalue(vast.Identifier(str(self.data_in_valid[1])))))
 
+        if self.expr_builder != None:
+            self.apply_cse(ldefs, lblocking, lnonblocking)
+
         ldefs_notnone = []
         for d in ldefs:
             if d != None:
                 ldefs_notnone.append(d)
 
+        if self.cost_estimator != None:
+            self.report_cost(ldefs_notnone, lblocking, lnonblocking)
+
         self.ast.items += ldefs_notnone
         self.ast.items += linsts
         self.ast.items += lblocking
@@ -1934,6 +2678,115 @@ class FlowGuardInstrumentationPass:
                     slist,
                     vast.Block(lnonblocking[senslist])))
 
+    def get_node_elements(self, n):
+        if self.is_array_target(n):
+            return self.get_array_dim(n)
+        return 1
+
+    # Cost of checking the dff n (and of its siblings of the same array), as
+    # (register bits, trace bits)
+    def get_check_cost(self, n):
+        elements = self.get_node_elements(n)
+        # _prop_q and _good_q
+        reg_bits = 2 * elements
+        trace_bits = 0
+        if self.check_filtered(n.termname):
+            return (reg_bits, trace_bits)
+        if self.is_array_target(n):
+            ptr_width = DFDataWidthVisitor(self.terms, self.binddict).visit(n.ptr)
+            curr = n
+            while curr != None:
+                # a pointer delay register, a recorded condition and the recorded pointer
+                reg_bits += ptr_width
+                trace_bits += 1 + ptr_width
+                curr = curr.wr_subling
+        else:
+            trace_bits += 1
+        return (reg_bits, trace_bits)
+
+    # Cost of tracking the propagation through n, which is always instrumented
+    def get_tracking_cost(self, n, reverse_map, m_out):
+        if n in m_out or not n in reverse_map:
+            return 0
+        src, conds, assigntype, alwaysinfo = reverse_map[n][0]
+        if assigntype != "nonblocking":
+            return 0
+        # _av_q, _ai_q, _assign_q and _valid_q
+        return 4 * self.get_node_elements(n)
+
+    def select_budgeted_checks(self, prop_chain, reverse_map, forward_map, dff_map, m_in, m_out):
+        """
+        Rank the dffs of the propagation chain and drop the checks of the lowest
+        ranked ones until the instrumentation fits in the budget. dffs are ranked
+        by the number of signals they are assigned from and propagate to, times
+        the number of elements for arrays. Blackbox ports are always kept since
+        their models need them.
+        Fill self.budget_dropped and return a report (dict).
+        """
+        mandatory_reg_bits = 0
+        tracked = set()
+        for n in prop_chain:
+            key = n.termname if self.is_array_target(n) else n
+            if key in tracked:
+                continue
+            tracked.add(key)
+            mandatory_reg_bits += self.get_tracking_cost(n, reverse_map, m_out)
+        # the cycle counter recorded with every loss message
+        mandatory_trace_bits = TaskSupportPass.CYCLE_COUNTER_WIDTH
+
+        # the dffs of an array are checked or dropped together
+        groups = {}
+        for n in dff_map:
+            if n in m_in or n in m_out:
+                continue
+            key = n.termname if self.is_array_target(n) else n
+            groups.setdefault(key, []).append(n)
+
+        candidates = []
+        for key, nodes in groups.items():
+            n = nodes[0]
+            fan_in = sum(len(reverse_map.get(t, [])) for t in nodes)
+            fan_out = sum(len(forward_map.get(t, [])) for t in nodes)
+            score = (fan_in + fan_out) * self.get_node_elements(n)
+            reg_bits, trace_bits = self.get_check_cost(n)
+            candidates.append((score, n.toStr(), nodes, reg_bits, trace_bits))
+        candidates.sort(key=lambda c: (-c[0], c[1]))
+
+        reg_left = None
+        trace_left = None
+        if self.budget_reg_bits != None:
+            reg_left = self.budget_reg_bits - mandatory_reg_bits
+        if self.budget_trace_bits != None:
+            trace_left = self.budget_trace_bits - mandatory_trace_bits
+
+        report = {
+            "flow": self.flow_name,
+            "budget": {"register_bits": self.budget_reg_bits, "trace_bits": self.budget_trace_bits},
+            "mandatory": {"register_bits": mandatory_reg_bits, "trace_bits": mandatory_trace_bits},
+            "selected": [],
+            "dropped": []
+        }
+        for score, name, nodes, reg_bits, trace_bits in candidates:
+            entry = {"target": name, "score": score, "register_bits": reg_bits, "trace_bits": trace_bits}
+            fits = ((reg_left == None or reg_bits <= reg_left) and
+                    (trace_left == None or trace_bits <= trace_left))
+            if fits:
+                if reg_left != None:
+                    reg_left -= reg_bits
+                if trace_left != None:
+                    trace_left -= trace_bits
+                report["selected"].append(entry)
+            else:
+                self.budget_dropped.update(nodes)
+                report["dropped"].append(entry)
+
+        if (reg_left != None and reg_left < 0) or (trace_left != None and trace_left < 0):
+            print("Warning: the propagation tracking alone exceeds the budget")
+        print("Budget: {} checked, {} dropped".format(len(report["selected"]), len(report["dropped"])))
+        for entry in report["dropped"]:
+            print("dropped", entry["target"])
+        return report
+
     def set_filtered(self, fl):
         with open(fl, "r") as f:
             log = f.read()
@@ -1948,3 +2801,35 @@ class FlowGuardInstrumentationPass:
     def check_filtered(self, node):
         assert(isinstance(node, ScopeChain))
         return node in self.filtered_set
+
+# The passes analyzed by find_prop_chains_parallel. Forked workers inherit them,
+# together with the terms and binddict they refer to, as a copy-on-write snapshot,
+# so only the index of a pass is sent to a worker and only the chain comes back.
+_parallel_passes = []
+
+def _find_prop_chain_worker(idx):
+    p = _parallel_passes[idx]
+    # the live gephi stream belongs to the parent process
+    p.gephi = False
+    return p.find_prop_chain()
+
+def find_prop_chains_parallel(passes, jobs):
+    """
+    Run find_prop_chain() of several FlowGuardInstrumentationPass in a pool of
+    jobs processes. find_prop_chain() only reads terms and binddict, so all passes
+    can be analyzed at the same time. The emission (instrument()) still has to be
+    done sequentially since all passes modify the same ast.
+    Return: the list of chains, in the same order as passes
+    """
+    global _parallel_passes
+    if jobs <= 1 or len(passes) <= 1 or \
+            "fork" not in multiprocessing.get_all_start_methods():
+        return [p.find_prop_chain() for p in passes]
+    _parallel_passes = passes
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(min(jobs, len(passes))) as pool:
+            chains = pool.map(_find_prop_chain_worker, range(len(passes)), chunksize=1)
+    finally:
+        _parallel_passes = []
+    return chains
@@ -78,6 +78,8 @@ class InsertCountingPass(PassBase):
             assert(v.name in self.state.identifierRef)
 
         self.state.generatedSignalsTransRecTarget = []
+        # optional CostEstimator, see utils/CostEstimator.py
+        self.cost_estimator = getattr(self.state, "cost_estimator", None)
 
     def get_counter_name(self, var):
         return var.getFormatStr() + "__COUNT__"
@@ -102,7 +104,8 @@ class InsertCountingPass(PassBase):
 
         for var in self.state.variablesToCount:
             sens = self.get_ref_clock(var)
-            ldefs.append(self.get_counter_def(var))
+            counter_def = self.get_counter_def(var)
+            ldefs.append(counter_def)
 
             self.state.generatedSignalsTransRecTarget.append(
                 TransRecTarget.fromStr("{name}:{msb}:{lsb}".format(
@@ -129,6 +132,9 @@ class InsertCountingPass(PassBase):
                             None)
                         )
                     )
+            if self.cost_estimator != None:
+                self.cost_estimator.add_items(self.__class__.__name__, var.getStr(),
+                        [counter_def, lalways[sens].statement.statements[-1]])
 
         node.items += ldefs
         for s in lalways:
@@ -129,6 +129,8 @@ class PrintTransitionPass(PassBase):
         #assert(hasattr(self.state, "enableData"))
         #assert(hasattr(self.state, "enableControl"))
         self.if_stack = []
+        # optional CostEstimator, see utils/CostEstimator.py
+        self.cost_estimator = getattr(self.state, "cost_estimator", None)
 
     def visit_ModuleDef(self, node):
         existing_targets = set()
@@ -169,13 +171,15 @@ class PrintTransitionPass(PassBase):
             target_width = getWidthFromInt(self.widthVisitor.getWidth(target_ast))
 
             def_annotation = "TransRecTarget={}".format(target_name)
-            ldefs.append(vast.Logic(target_name_delayed, target_width, annotation=def_annotation))
+            ldef = vast.Logic(target_name_delayed, target_width, annotation=def_annotation)
+            ldefs.append(ldef)
             always_to_instrument = lalways.setdefault(sens, vast.Always(sens, vast.Block([])))
-            always_to_instrument.statement.statements.append(
+            statements = always_to_instrument.statement.statements
+            statements.append(
                     vast.NonblockingSubstitution(
                         vast.Identifier(target_name_delayed),
                         target_ast))
-            always_to_instrument.statement.statements.append(
+            statements.append(
                 vast.IfStatement(
                     vast.NotEq(target_ast, vast.Identifier(target_name_delayed)),
                     vast.SingleStatement(vast.SystemCall("display", [
@@ -187,6 +191,9 @@ class PrintTransitionPass(PassBase):
                     None
                 )
             )
+            if self.cost_estimator != None:
+                self.cost_estimator.add_items(self.__class__.__name__, target.getStr(),
+                        [ldef] + statements[-2:], self.widthVisitor.getWidth)
 
         node.items += ldefs
         for s in lalways:
@@ -1,4 +1,6 @@
+import sympy
 import sympy.logic.boolalg as boolalg
+from sympy import Symbol
 import pyverilog.vparser.ast as vast
 from pyverilog.ast_code_generator.codegen import ASTCodeGenerator
 
@@ -8,10 +10,14 @@ from passes.WidthPass import WidthVisitor
 from utils.BitwiseToLogicalVisitor import BitwiseToLogicalVisitor
 from utils.SymPyUtils import CondASTToSymPyVisitor
 from utils.SymPyUtils import CondSymPyToASTVisitor
+from utils.BDD import BDD, CondASTToBDDVisitor, CondBDDToASTVisitor
 from utils.IntelSignalTapII import IntelSignalTapIIConfig, IntelSignalTapII
 from utils.XilinxILA import XilinxILA
+from utils.RecorderSizing import RecorderSizing, SweepCostModel, load_device_profile
 
 from functools import reduce
+import os
+import pickle
 
 
 class IfConditionStack(object):
@@ -20,11 +26,16 @@ class IfConditionStack(object):
     It maintains a stack-top condition (self.cond_top, a vast.Node) to represent the constraint of current path.
     self.cond_top is an unbalanced, left-hand-side recurrent vast.Land tree:
       e.g. `a && b && c && d` becomes `Land(Land(Land(a,b),c),d)`
+    It also keeps the simplified constraint of each prefix of the stack (self.simplified), so that the
+    simplification of a nested condition only extends the one of its parent.
     """
 
     def __init__(self):
         self.stack = []
         self.cond_top = None
+        # list of (key, simplified condition), the i-th element is the constraint of self.stack[:i+1]
+        # filled on demand by TaskSupportPass
+        self.simplified = []
 
     def push(self, cond):
         """
@@ -43,6 +54,7 @@ class IfConditionStack(object):
         """
 
         cond = self.stack.pop()
+        del self.simplified[len(self.stack):]
         if isinstance(self.cond_top, vast.Land):
             # Non-top-level condition, take the left-hand-side subtree
             self.cond_top = self.cond_top.left
@@ -65,6 +77,9 @@ class TaskSupportPass(PassBase):
     Will add the following vast node to pass_state:
     1. `cycle_cnt` (vast.Identifier), a cycle counter for $time
     2. `reset` (vast.Identifier), the reset signal
+    With MULTI_CLOCK, the recorder of every additional clock domain also adds its manifests
+    to `clock_domains` ({clock name => {"condname2display", "displayarg_width", "traceinfo"}}),
+    the ones of the main domain stay in `condname2display`, `displayarg_width` and `traceinfo`.
     """
 
     """
@@ -75,6 +90,13 @@ class TaskSupportPass(PassBase):
     INSTRUMENT_TYPE_SWEEPILA = 1
     INSTRUMENT_TYPE_INTELSTP = 2
     INSTRUMENT_TYPE_XILINXILA = 3
+    # Options for COND_BACKEND
+    COND_BACKEND_SYMPY = 0
+    COND_BACKEND_BDD = 1
+    # Options for COND_ENCODING
+    COND_ENCODING_ONEHOT = 0
+    COND_ENCODING_BINARY = 1
+    COND_ENCODING_MUX = 2
 
     """
     Configurations:
@@ -82,6 +104,27 @@ class TaskSupportPass(PassBase):
     2. CYCLE_COUNTER_NAME: the name of the cycle counter register
     3. INSTRUMENT_TYPE: STP (for intel), ILA (for Xilinx) or SWEEP (for width/depth space walking on intel)
     4. INSTRUMENT_TAGS: set of str. Instrument all display if empty, else only instrument display with given tags.
+    5. COND_BACKEND: how the path constraints of display tasks are canonicalized and simplified.
+       SymPy (simplify_logic, exponential in the worst case) or BDD (see utils/BDD.py)
+    6. COND_ENCODING: how the display conditions are recorded. One bit per condition (ONEHOT), or
+       COND_ID_SLOTS binary ID slots (BINARY). In the binary encoding, the conditions are distributed
+       round-robin over the slots, each slot records the ID (1-based, 0 if none) of its lowest-index
+       firing condition and an overflow bit, set when more than one of its conditions fire.
+       The layout is described in "<output>.traceinfo.txt" for the recording parsers.
+       MUX records one display per sample: the display arguments are grouped per condition and
+       captured into hold registers when the condition fires, the pending groups are then recorded
+       one per cycle in batches (lowest index first within a batch, so at most 2 * cond_num samples
+       out of $time order, reordered by the parsers) as a condition tag, a dropped bit (set if a pending group
+       was overwritten since the previous sample) and the group's arguments, see get_mux_encoding.
+    7. ARG_DELTA: only record a sample when the fired conditions or the display arguments differ from
+       the previous cycle. The consecutive identical cycles are counted in a DELTA_REPEAT_WIDTH-bit
+       repeat field of the next sample and replayed by the parsers, see get_delta_encoding.
+       Not used with the MUX encoding.
+    8. SIZING_*: if any of SIZING_PROFILE, SIZING_BUDGET_BLOCKS or SIZING_BUDGET_BITS is set, the
+       sample depth of every STP/ILA recorder is the largest legal depth fitting the memory budget
+       for its trace width instead of INSTRUMENT_SAMPLE_DEPTH, see utils/RecorderSizing.py.
+       SIZING_PROFILE is "M20K", "BRAM36" or a device profile file (default by INSTRUMENT_TYPE),
+       SIZING_COST_MODEL the path of collected SWEEP results.
     """
     CYCLE_COUNTER_WIDTH = 64
     CYCLE_COUNTER_NAME = "TASKPASS_cycle_counter"
@@ -93,6 +136,23 @@ class TaskSupportPass(PassBase):
     # configurations used in INSTRUMENT_TYPE_SWEEP mode
     INSTRUMENT_SWEEP_CFG_WIDTH = None  # should be int, Up to 2^12, 4096 bits
     INSTRUMENT_SWEEP_CFG_DEPTH = None  # should be int, Up to 2^17, 128K samples
+    COND_BACKEND = COND_BACKEND_SYMPY
+    # if set, the simplified path constraints (SymPy backend) are kept in this file across runs
+    COND_CACHE_PATH = None
+    COND_CACHE_VERSION = 1
+    COND_ENCODING = COND_ENCODING_ONEHOT
+    COND_ID_SLOTS = 1
+    # if set, one cycle counter and one recorder per clock domain with displays, see get_clock_domains
+    MULTI_CLOCK = False
+    ARG_DELTA = False
+    DELTA_REPEAT_WIDTH = 8
+    SIZING_PROFILE = None
+    SIZING_BUDGET_BLOCKS = None
+    SIZING_BUDGET_BITS = None
+    SIZING_COST_MODEL = None
+    # the legal sample depths of the recorders, powers of two
+    STP_DEPTH_RANGE = (64, 131072)
+    ILA_DEPTH_RANGE = (1024, 131072)
 
     """
     For emulated SignalTapII or ILA.
@@ -104,19 +164,35 @@ class TaskSupportPass(PassBase):
         # Allow fallback to visit_children
         super().__init__(pm, pass_state, True)
         self.bitwise2logical = BitwiseToLogicalVisitor(pass_state)
-        self.ast2sympy = CondASTToSymPyVisitor()
-        self.sympy2ast = CondSymPyToASTVisitor(self.ast2sympy.rsymbolmap)
+        if self.COND_BACKEND == self.COND_BACKEND_BDD:
+            self.bdd = BDD()
+            self.ast2cond = CondASTToBDDVisitor(self.bdd)
+            self.cond2ast = CondBDDToASTVisitor(self.bdd, self.ast2cond.rvarmap)
+        else:
+            self.ast2cond = CondASTToSymPyVisitor()
+            self.cond2ast = CondSymPyToASTVisitor(self.ast2cond.rsymbolmap)
         # display_arg2cond tracks a list of path constraint for each unique display argument.
         # e.g. if (A) display(x)
         #      if (B) ... else display(x)
         # then there should be x => [A, !B]
-        # x is sympy.Symbol and A, B are sympy expressions
-        # {sympy.Symbol => [SymPy expressions]}
+        # The keys are those of the condition backend (ast2cond): with the SymPy backend, x is
+        # sympy.Symbol and A, B are sympy expressions; with the BDD backend, x, A and B are
+        # canonical BDD nodes (int).
+        # {arg key => [cond keys]}
         self.display_arg2cond = {}
-        # display_cond2arg is a dict {sympy expressions => [sympy.Symbol]}
+        # display_cond2arg is a dict {cond key => [arg keys]}
         self.display_cond2arg = {}
-        # dict {sympy expressions => vast.Node (display expression)}
+        # dict {cond key => vast.Node (display expression)}
         self.display_cond2display = {}
+        # memo of simplified path constraints, shared by all displays
+        # {str (codegen of the converted condition) => simplified condition}
+        self.cond_memo = {}
+        self.cond_memo_hit = 0
+        self.cond_memo_miss = 0
+        # persistent cache of the previous run (SymPy backend only)
+        # {str => sympy expression using Symbol(codegen) as symbols}, see get_cached_cond
+        self.cond_cache = self.load_cond_cache()
+        self.cond_cache_dirty = False
         # instrumentation related
         self.cnt = vast.Identifier(cycle_cnt_name)
         self.cnt_name = cycle_cnt_name
@@ -127,46 +203,182 @@ class TaskSupportPass(PassBase):
         self.state.condname2display = {}
         self.astgen = ASTCodeGenerator()
         self.state.displayarg_width = {}
+        # list of str, the lines of "<output>.traceinfo.txt"
+        self.state.traceinfo = []
+        self.state.clock_domains = {}
+        # appended to the names of the signals generated for a clock domain other than the main one
+        self.domain_suffix = ""
+        # the buffer an emulated recorder of the clock domain dumps its samples to (without the
+        # extension), see recording/tracedecoder Recorder.get_recorders
+        self.buffer_name = "w_buffer"
+        # the recorders of the clock domains of the module, sized together, see add_recorders
+        # [(clock, trace enable signal, trace fields, buffer name)]
+        self.recorder_plans = []
+        # optional CostEstimator, see utils/CostEstimator.py
+        self.cost_estimator = getattr(self.state, "cost_estimator", None)
+        self.sizing = self.get_sizing()
+
+    def get_sizing(self):
+        """
+        Return: a RecorderSizing shared by the recorders of all clock domains, None if the
+        sample depth is fixed
+        """
+        if self.SIZING_PROFILE == None and self.SIZING_BUDGET_BLOCKS == None and \
+                self.SIZING_BUDGET_BITS == None:
+            return None
+        profile_name = self.SIZING_PROFILE
+        if profile_name == None:
+            profile_name = "BRAM36" if self.INSTRUMENT_TYPE == self.INSTRUMENT_TYPE_XILINXILA else "M20K"
+        cost_model = None
+        if self.SIZING_COST_MODEL != None:
+            cost_model = SweepCostModel(self.SIZING_COST_MODEL)
+        return RecorderSizing(load_device_profile(profile_name),
+                self.SIZING_BUDGET_BLOCKS, self.SIZING_BUDGET_BITS, cost_model)
+
+    def get_sample_depths(self, trace_widths, depth_range):
+        if self.sizing == None:
+            return [self.INSTRUMENT_SAMPLE_DEPTH for _ in trace_widths]
+        return self.sizing.get_depths([(width, depth_range[0], depth_range[1]) for width in trace_widths])
 
     def visit_ModuleDef(self, node):
         # self.inferred_clock contains all sens of all always to which display tasks belong
         # it is a dict {str(identifier name) => int (frequency)}
         self.inferred_clock = {}
+        # list of (names of the sens list, path constraint, [display args], display), one per display
+        self.display_records = []
         for c in node.items:
             # filter all variable items, since there will be no tasks
             if not isinstance(c, vast.Variable):
                 self.visit(c)
+        print("TaskSupportPass: {} path constraints simplified, {} reused".format(
+            self.cond_memo_miss, self.cond_memo_hit))
+        self.save_cond_cache()
         if len(self.inferred_clock) == 0:
             # early return if no clock-synced display tasks are found
             return
-        # choose the most frequently used clock signal
-        clock_name, freq = max(self.inferred_clock.items(), key=lambda x: x[1])
-        clock = vast.Identifier(clock_name)
+        if self.MULTI_CLOCK and self.INSTRUMENT_TYPE in (
+                self.INSTRUMENT_TYPE_INTELSTP, self.INSTRUMENT_TYPE_XILINXILA):
+            domains = self.get_clock_domains()
+        else:
+            # choose the most frequently used clock signal
+            clock_name, freq = max(self.inferred_clock.items(), key=lambda x: x[1])
+            domains = [(clock_name, self.display_records)]
+        main_manifests = {
+            "condname2display": self.state.condname2display,
+            "displayarg_width": self.state.displayarg_width,
+            "traceinfo": self.state.traceinfo
+        }
+        for i, (clock_name, records) in enumerate(domains):
+            if i == 0:
+                manifests = main_manifests
+                self.domain_suffix = ""
+                self.buffer_name = "w_buffer"
+            else:
+                manifests = self.state.clock_domains.setdefault(clock_name, {
+                    "condname2display": {}, "displayarg_width": {}, "traceinfo": []})
+                # the signals of the other domains are suffixed with their clock
+                self.domain_suffix = "_" + clock_name
+                self.buffer_name = "w_buffer." + clock_name
+            self.state.condname2display = manifests["condname2display"]
+            self.state.displayarg_width = manifests["displayarg_width"]
+            self.state.traceinfo = manifests["traceinfo"]
+            self.build_display_maps(records)
+            self.instrument_clock_domain(node, vast.Identifier(clock_name))
+            manifests["traceinfo"] = self.state.traceinfo
+        self.add_recorders(node)
+        self.domain_suffix = ""
+        self.buffer_name = "w_buffer"
+        self.state.condname2display = main_manifests["condname2display"]
+        self.state.displayarg_width = main_manifests["displayarg_width"]
+        self.state.traceinfo = main_manifests["traceinfo"]
+
+    def get_clock_domains(self):
+        """
+        Assign every display to the clock of its always block: the most frequently used
+        signal of its sens list which is not the reset.
+        Return: [(clock name, [display records])], the most frequently used clock first
+        """
+        reset = self.state.reset
+        while isinstance(reset, (vast.Ulnot, vast.Unot)):
+            reset = reset.right
+        reset_name = reset.name if isinstance(reset, vast.Identifier) else None
+        domains = {}
+        for record in self.display_records:
+            sens_names = record[0]
+            candidates = [name for name in sens_names if name != reset_name]
+            if len(candidates) == 0:
+                candidates = sens_names
+            clock_name = max(candidates, key=lambda name: self.inferred_clock[name])
+            domains.setdefault(clock_name, []).append(record)
+        return sorted(domains.items(), key=lambda x: -self.inferred_clock[x[0]])
+
+    def build_display_maps(self, records):
+        """
+        Fill display_cond2arg, display_arg2cond and display_cond2display with the given
+        display records, see visit_SystemCall
+        """
+        self.display_cond2arg = {}
+        self.display_arg2cond = {}
+        self.display_cond2display = {}
+        for sens_names, cond_key, arg_keys, node in records:
+            cond2arg = self.display_cond2arg.setdefault(cond_key, [])
+            self.display_cond2display[cond_key] = node
+            for arg_key in arg_keys:
+                cond2arg.append(arg_key)
+                self.display_arg2cond.setdefault(
+                    arg_key, []).append(cond_key)
+
+    def get_domain_name(self, name):
+        return name + self.domain_suffix
+
+    def instrument_clock_domain(self, node, clock):
+        """
+        Add the cycle counter and the recorder of the displays in display_cond2arg, in
+        the clock domain of clock
+        """
+        cnt = vast.Identifier(self.get_domain_name(self.cnt_name))
         new_cnt_def, new_cnt_always = self.create_cycle_counter_statements(
-            clock)
+            clock, cnt)
         node.items.insert(0, new_cnt_def)
         node.items.append(new_cnt_always)
+        self.report_cost(cnt.name, [new_cnt_def, new_cnt_always])
         if self.INSTRUMENT_TYPE == self.INSTRUMENT_TYPE_SWEEPSTP:
             instance = self.getFakeSTPInstrumentation(clock)
             node.items.append(instance)
         elif self.INSTRUMENT_TYPE == self.INSTRUMENT_TYPE_SWEEPILA:
             instance = self.getFakeILAInstrumentation(clock)
             node.items.append(instance)
-        elif self.INSTRUMENT_TYPE == self.INSTRUMENT_TYPE_INTELSTP:
-            cond_wire_defs, cond_wires, display_args, arg_widths = self.getInstrumentationPlan()
-            instance = self.getSTPInstrumentation(
-                clock, cond_wires, display_args, arg_widths)
-            node.items.extend(cond_wire_defs)
-            node.items.append(instance)
-        elif self.INSTRUMENT_TYPE == self.INSTRUMENT_TYPE_XILINXILA:
-            cond_wire_defs, cond_wires, display_args, arg_widths = self.getInstrumentationPlan()
-            instance = self.getILAInstrumentation(
-                clock, cond_wires, display_args, arg_widths)
+        elif self.INSTRUMENT_TYPE in (self.INSTRUMENT_TYPE_INTELSTP, self.INSTRUMENT_TYPE_XILINXILA):
+            cond_wire_defs, cond_wires, cond_fields, display_args, arg_widths = self.getInstrumentationPlan()
+            trace_defs, trace_enable_signal, trace_fields = self.getTracePlan(
+                clock, cond_wires, cond_fields, display_args, arg_widths)
+            # the recorder is added by add_recorders, once all the domains are planned
+            self.recorder_plans.append((clock, trace_enable_signal, trace_fields, self.buffer_name))
             node.items.extend(cond_wire_defs)
-            node.items.append(instance)
+            node.items.extend(trace_defs)
         else:
             raise NotImplementedError("Unknown instrumentation type")
 
+    def add_recorders(self, node):
+        """
+        Size the recorders of recorder_plans together and add their instances
+        """
+        if self.INSTRUMENT_TYPE == self.INSTRUMENT_TYPE_INTELSTP:
+            depth_range = self.STP_DEPTH_RANGE
+        else:
+            depth_range = self.ILA_DEPTH_RANGE
+        depths = self.get_sample_depths(
+            [sum(width for _, width in trace_fields) for _, _, trace_fields, _ in self.recorder_plans],
+            depth_range)
+        for (clock, trace_enable_signal, trace_fields, buffer_name), depth in zip(self.recorder_plans, depths):
+            self.buffer_name = buffer_name
+            if self.INSTRUMENT_TYPE == self.INSTRUMENT_TYPE_INTELSTP:
+                instance = self.getSTPInstrumentation(clock, trace_enable_signal, trace_fields, depth)
+            else:
+                instance = self.getILAInstrumentation(clock, trace_enable_signal, trace_fields, depth)
+            node.items.append(instance)
+        self.recorder_plans = []
+
     def visit_Always(self, node):
         # self.always is to track the senslist of always to which each display tasks belong
         self.always = node
@@ -191,29 +403,125 @@ class TaskSupportPass(PassBase):
         if self.always and node.syscall == "display" and \
                 (len(self.INSTRUMENT_TAGS) == 0 or (node.annotation and node.annotation in self.INSTRUMENT_TAGS)):
             # track sens list for clock inference
+            sens_names = []
             for sens in self.always.sens_list.list:
                 # display are assumed to only be sensitive to simple identifiers
                 assert(isinstance(sens.sig, vast.Identifier))
                 self.inferred_clock[sens.sig.name] = self.inferred_clock.get(
                     sens.sig.name, 0) + 1
+                sens_names.append(sens.sig.name)
+            if self.INSTRUMENT_TYPE in (self.INSTRUMENT_TYPE_SWEEPSTP, self.INSTRUMENT_TYPE_SWEEPILA):
+                # the fake recorders only need the clock, skip the path constraints and args
+                self.display_records.append((sens_names, None, [], node))
+                return
             # track path constraints
-            cond = self.if_cond_stack.getCond()
-            cond_converted = self.bitwise2logical.visit(cond)
-            # this simplify convert conditions to CNF
-            sympy_cond = boolalg.simplify_logic(
-                self.ast2sympy.visit(cond_converted))
-            cond2arg = self.display_cond2arg.setdefault(sympy_cond, [])
-            self.display_cond2display[sympy_cond] = node
+            cond_key = self.get_simplified_cond()
+            arg_keys = []
             for arg in node.args:
                 if isinstance(arg, vast.StringConst):
                     continue
                 elif isinstance(arg, vast.SystemCall) and arg.syscall == "time":
-                    sympy_arg = self.ast2sympy.visit(self.cnt)
+                    # replaced by the counter of the clock domain in getInstrumentationPlan
+                    arg_key = self.ast2cond.visit(self.cnt)
                 else:
-                    sympy_arg = self.ast2sympy.visit(arg)
-                cond2arg.append(sympy_arg)
-                self.display_arg2cond.setdefault(
-                    sympy_arg, []).append(sympy_cond)
+                    arg_key = self.ast2cond.visit(arg)
+                arg_keys.append(arg_key)
+            self.display_records.append((sens_names, cond_key, arg_keys, node))
+
+    def get_simplified_cond(self):
+        """
+        Return: the simplified path constraint of the current if-statement stack.
+        Each level is simplified once per distinct prefix (self.cond_memo), as the
+        conjunction of the simplified parent and the condition of the level.
+        """
+        stack = self.if_cond_stack
+        if len(stack.stack) == 0:
+            if self.COND_BACKEND == self.COND_BACKEND_BDD:
+                return BDD.TRUE
+            return boolalg.simplify_logic(
+                self.ast2cond.visit(self.bitwise2logical.visit(stack.getCond())))
+        for i in range(len(stack.simplified), len(stack.stack)):
+            cond_converted = self.bitwise2logical.visit(stack.stack[i])
+            key = "(" + self.astgen.visit(cond_converted) + ")"
+            if i > 0:
+                key = stack.simplified[i - 1][0] + " && " + key
+            if key in self.cond_memo:
+                self.cond_memo_hit += 1
+                stack.simplified.append((key, self.cond_memo[key]))
+                continue
+            self.cond_memo_miss += 1
+            # also registers the symbols of the condition
+            converted = self.ast2cond.visit(cond_converted)
+            if self.COND_BACKEND == self.COND_BACKEND_BDD:
+                # BDD nodes are canonical, the minimization happens when the
+                # condition wires are generated
+                r = converted if i == 0 else self.bdd.conj(stack.simplified[i - 1][1], converted)
+            else:
+                r = self.get_cached_cond(key)
+                if r is None:
+                    # this simplify convert conditions to CNF
+                    r = boolalg.simplify_logic(
+                        converted if i == 0 else boolalg.And(stack.simplified[i - 1][1], converted))
+                    self.put_cached_cond(key, r)
+            self.cond_memo[key] = r
+            stack.simplified.append((key, r))
+        return stack.simplified[-1][1]
+
+    def load_cond_cache(self):
+        if self.COND_CACHE_PATH is None or self.COND_BACKEND != self.COND_BACKEND_SYMPY:
+            return {}
+        if not os.path.exists(self.COND_CACHE_PATH):
+            return {}
+        # the cache is only an optimization, it is ignored if it cannot be loaded, e.g. it is
+        # truncated or pickled with another SymPy version
+        try:
+            with open(self.COND_CACHE_PATH, "rb") as f:
+                content = pickle.load(f)
+        except Exception as e:
+            print("TaskSupportPass: ignoring the condition cache {}: {}: {}".format(
+                self.COND_CACHE_PATH, e.__class__.__name__, e))
+            return {}
+        if not isinstance(content, dict) or content.get("version") != self.COND_CACHE_VERSION or \
+                content.get("sympy") != sympy.__version__ or not isinstance(content.get("conds"), dict):
+            print("TaskSupportPass: ignoring the condition cache {}: it was written by another version".format(
+                self.COND_CACHE_PATH))
+            return {}
+        return content["conds"]
+
+    def get_cached_cond(self, key):
+        """
+        The symbols of the persistent cache are named after the codegen of the vast
+        node they stand for, since the names of the non-boolean symbols depend on
+        the visiting order. Map them back to the symbols of this run.
+        Return: the simplified condition of the previous run, or None
+        """
+        if not key in self.cond_cache:
+            return None
+        cached = self.cond_cache[key]
+        mapping = {}
+        for symbol in cached.free_symbols:
+            if not symbol.name in self.ast2cond.symbolmap:
+                return None
+            mapping[symbol] = self.ast2cond.symbolmap[symbol.name]
+        return cached.xreplace(mapping)
+
+    def put_cached_cond(self, key, cond):
+        if self.COND_CACHE_PATH is None:
+            return
+        code2symbol = {symbol: Symbol(code) for code, symbol in self.ast2cond.symbolmap.items()}
+        self.cond_cache[key] = cond.xreplace(
+            {symbol: code2symbol[symbol] for symbol in cond.free_symbols})
+        self.cond_cache_dirty = True
+
+    def save_cond_cache(self):
+        if self.COND_CACHE_PATH is None or not self.cond_cache_dirty:
+            return
+        content = {"version": self.COND_CACHE_VERSION, "sympy": sympy.__version__, "conds": self.cond_cache}
+        tmp_path = self.COND_CACHE_PATH + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.COND_CACHE_PATH)
+        self.cond_cache_dirty = False
 
     def get_cond_wires(self, all_conds, id2display):
         """
@@ -224,21 +532,67 @@ class TaskSupportPass(PassBase):
         new_module_items = []
         all_cond_wire_identifiers = []
         for cid, cond in enumerate(all_conds):
-            wire_name = "display_cond_{}".format(cid)
+            wire_name = self.get_domain_name("display_cond_{}".format(cid))
             new_wire = vast.Wire(wire_name)
             identifier = vast.Identifier(wire_name)
             new_assign = vast.Assign(identifier, cond)
             new_module_items.append(new_wire)
             new_module_items.append(new_assign)
             all_cond_wire_identifiers.append(identifier)
+            self.report_cost(wire_name, [new_wire, new_assign])
             self.state.condname2display[wire_name] = self.astgen.visit(id2display[cid])
         return (new_module_items, all_cond_wire_identifiers)
 
+    def get_cond_encoding(self, cond_wires):
+        """
+        cond_wires are the vast.Identifier of all condition wires
+        Return: ([new Wire declarations and Assign statements], [(vast.Node, width) recorded for the conditions])
+        """
+        if self.COND_ENCODING == self.COND_ENCODING_ONEHOT:
+            self.state.traceinfo = ["encoding onehot"]
+            return ([], [(cond, 1) for cond in cond_wires])
+        if self.COND_ENCODING == self.COND_ENCODING_MUX:
+            # the conditions are encoded together with the arguments, see get_mux_encoding
+            return ([], [])
+
+        slot_num = max(1, min(self.COND_ID_SLOTS, len(cond_wires)))
+        self.state.traceinfo = ["encoding binary", "slots {}".format(slot_num)]
+        new_module_items = []
+        cond_fields = []
+        for slot in range(slot_num):
+            cids = list(range(slot, len(cond_wires), slot_num))
+            id_width = len(cids).bit_length()
+            id_prefix = "{}'d".format(id_width)
+            # priority encoder, the lowest-index firing condition wins
+            encoded = vast.IntConst(id_prefix + "0")
+            for i in reversed(range(len(cids))):
+                encoded = vast.Cond(cond_wires[cids[i]], vast.IntConst(id_prefix + str(i + 1)), encoded)
+            if len(cids) > 1:
+                overflow = vast.GreaterThan(
+                    reduce(vast.Plus, [cond_wires[cid] for cid in cids]), vast.IntConst("1"))
+            else:
+                overflow = vast.IntConst("1'b0")
+            for wire_name, width, value in (
+                    (self.get_domain_name("display_cond_slot{}".format(slot)), id_width, encoded),
+                    (self.get_domain_name("display_cond_slot{}_overflow".format(slot)), 1, overflow)):
+                new_wire = vast.Wire(wire_name, width=getWidthFromInt(width) if width > 1 else None)
+                identifier = vast.Identifier(wire_name)
+                new_assign = vast.Assign(identifier, value)
+                new_module_items.append(new_wire)
+                new_module_items.append(new_assign)
+                cond_fields.append((identifier, width))
+                self.report_cost(wire_name, [new_wire, new_assign])
+            # slot <index> <id width> <condition index of ID 1> <condition index of ID 2> ...
+            self.state.traceinfo.append("slot {} {} {}".format(
+                slot, id_width, " ".join(str(cid) for cid in cids)))
+        return (new_module_items, cond_fields)
+
     def getInstrumentationPlan(self):
         """
-        Return (cond_wire_defs, cond_wire_identifiers, display_args, arg_widths)
+        Return (cond_wire_defs, cond_wire_identifiers, cond_fields, display_args, arg_widths)
         cond_wire_defs: list of vast.Wire
         cond_wire_identifiers: list of vast.Identifier
+        cond_fields: list of (vast.Node, int), the recorded encoding of the conditions
         display_args: list of vast.Node
         arg_widths: list of int
         """
@@ -247,35 +601,217 @@ class TaskSupportPass(PassBase):
         id2display = {}
         all_conds = []
         for cid, cond in enumerate(self.display_cond2arg.keys()):
-            all_conds.append(self.sympy2ast.visit(cond))
+            all_conds.append(self.cond2ast.visit(cond))
             cond2id[cond] = cid
             id2display[cid] = self.display_cond2display[cond]
         display_args = []
         arg_widths = []
         width_visitor = WidthVisitor(self.state)
         for arg in self.display_arg2cond.keys():
-            ast_arg = self.sympy2ast.visit(arg)
+            ast_arg = self.cond2ast.visit(arg)
+            if isinstance(ast_arg, vast.Identifier) and ast_arg.name == self.cnt_name:
+                # $time, the cycle counter of the clock domain
+                ast_arg = vast.Identifier(self.get_domain_name(self.cnt_name))
             arg_width = width_visitor.getWidth(ast_arg)
             display_args.append(ast_arg)
             arg_widths.append(arg_width)
         cond_wire_defs, cond_wire_identifiers = self.get_cond_wires(all_conds, id2display)
-        return (cond_wire_defs, cond_wire_identifiers, display_args, arg_widths)
+        encoding_defs, cond_fields = self.get_cond_encoding(cond_wire_identifiers)
+        cond_wire_defs.extend(encoding_defs)
+        return (cond_wire_defs, cond_wire_identifiers, cond_fields, display_args, arg_widths)
 
-    def getSTPInstrumentation(self, clk, cond_wires, display_args, arg_widths):
+    def getTracePlan(self, clk, cond_wires, cond_fields, display_args, arg_widths):
+        """
+        Return (trace_defs, trace_enable_signal, trace_fields)
+        trace_defs: list of new module items used by the recording
+        trace_enable_signal: vast.Node, when to record a sample
+        trace_fields: list of (vast.Node, int), the recorded signals and their widths, MSB first
+        The display args are decoded with "<output>.widthinfo.txt" and "<output>.traceinfo.txt".
+        """
         assert(len(display_args) == len(arg_widths))
-        trace_enable_signal = reduce(vast.Lor, cond_wires)
-        # encode display args
-        # arg2range is {sympy.Symbol => (start_index, end_index)}
-        # arg2range is used to decode each display args from the recorded waveform.
-        # But the decoding part is not implemented yet.
-        arg2range = {}
-        args_width_accu = 0
         for arg, arg_width in zip(display_args, arg_widths):
-            arg2range[arg] = (args_width_accu, args_width_accu + arg_width - 1)
-            args_width_accu += arg_width
             self.state.displayarg_width[self.astgen.visit(arg)] = arg_width
-        total_trace_width = len(cond_wires) + args_width_accu
-        trace_data = vast.Concat(cond_wires + display_args)
+        if self.COND_ENCODING == self.COND_ENCODING_MUX:
+            trace_defs, trace_enable_signal, trace_fields = self.get_mux_encoding(
+                clk, cond_wires, display_args, arg_widths)
+        else:
+            trace_defs = []
+            trace_enable_signal = reduce(vast.Lor, cond_wires)
+            trace_fields = cond_fields + list(zip(display_args, arg_widths))
+        cnt_name = self.get_domain_name(self.cnt_name)
+        if self.ARG_DELTA and self.COND_ENCODING != self.COND_ENCODING_MUX:
+            # the cycle counter changes every cycle, it is replayed by the parsers instead
+            compared_fields = [(field, width) for field, width in trace_fields
+                    if not (isinstance(field, vast.Identifier) and field.name == cnt_name)]
+            delta_defs, trace_enable_signal, repeat_field = self.get_delta_encoding(
+                clk, trace_enable_signal, compared_fields)
+            trace_defs = trace_defs + delta_defs
+        else:
+            repeat_field = None
+        if self.MULTI_CLOCK:
+            # the counter of every sample is recorded last, to merge the traces of the clock domains
+            trace_fields = trace_fields + [(vast.Identifier(cnt_name), self.cnt_width)]
+            self.state.traceinfo.append("counter {} {}".format(cnt_name, self.cnt_width))
+        if repeat_field != None:
+            # after the counter, so the fields before keep their layout
+            trace_fields = trace_fields + [repeat_field]
+            self.state.traceinfo.append("delta {}".format(self.DELTA_REPEAT_WIDTH))
+        return (trace_defs, trace_enable_signal, trace_fields)
+
+    def get_delta_encoding(self, clk, fire, compared_fields):
+        """
+        Skip the samples identical to the one of the previous cycle.
+        The recorded fields of the last cycle any condition fired are kept in a shadow register.
+        A cycle is repeated if a condition also fired in the previous cycle and none of the
+        compared fields changed. Repeated cycles are not recorded but counted, the next recorded
+        sample carries the count of repeats of the sample before it. The counter saturates by
+        forcing a sample.
+        fire: vast.Node, any display condition fires
+        compared_fields: list of (vast.Node, int), the recorded fields (except the cycle counter)
+        Return: (new module items, trace enable signal, (repeat field, width))
+        """
+        width = self.DELTA_REPEAT_WIDTH
+        state_width = sum(w for _, w in compared_fields)
+        new_module_items = []
+        def add_variable(var_type, name, width):
+            var = var_type(name, width=getWidthFromInt(width) if width > 1 else None)
+            self.notify_new_Variable(var)
+            new_module_items.append(var)
+            return vast.Identifier(name)
+
+        shadow = add_variable(vast.Logic, self.get_domain_name("display_delta_shadow"), state_width)
+        last_fire = add_variable(vast.Logic, self.get_domain_name("display_delta_last_fire"), 1)
+        repeat = add_variable(vast.Logic, self.get_domain_name("display_delta_repeat"), width)
+        same = add_variable(vast.Wire, self.get_domain_name("display_delta_same"), 1)
+        fire_wire = add_variable(vast.Wire, self.get_domain_name("display_delta_fire"), 1)
+        state = vast.Concat([field for field, _ in compared_fields])
+        new_module_items.append(vast.Assign(fire_wire, fire))
+        new_module_items.append(vast.Assign(same, vast.Land(vast.Land(vast.Land(fire_wire, last_fire),
+            vast.Eq(state, shadow)),
+            vast.NotEq(repeat, vast.IntConst("{}'d{}".format(width, 2**width - 1))))))
+        always_statement = vast.Block([
+            vast.IfStatement(self.state.reset,
+                vast.Block([
+                    vast.NonblockingSubstitution(last_fire, vast.IntConst("1'b0")),
+                    vast.NonblockingSubstitution(repeat, vast.IntConst("{}'d0".format(width)))]),
+                vast.Block([
+                    vast.NonblockingSubstitution(last_fire, fire_wire),
+                    vast.IfStatement(fire_wire,
+                        vast.Block([
+                            vast.NonblockingSubstitution(shadow, state),
+                            vast.NonblockingSubstitution(repeat, vast.Cond(same,
+                                vast.Plus(repeat, vast.IntConst("{}'d1".format(width))),
+                                vast.IntConst("{}'d0".format(width))))]),
+                        None)]))])
+        new_module_items.append(vast.Always(vast.SensList([vast.Sens(clk)]), always_statement))
+        self.report_cost(self.get_domain_name("display_delta"), new_module_items)
+        return (new_module_items, vast.Land(fire_wire, vast.Ulnot(same)), (repeat, width))
+
+    def get_mux_encoding(self, clk, cond_wires, display_args, arg_widths):
+        """
+        Time-multiplex the arguments of the displays into one trace word, so the
+        trace width is the widest argument group instead of all arguments.
+        Return: see getTracePlan
+        """
+        arg_ids = {arg: i for i, arg in enumerate(self.display_arg2cond.keys())}
+        # the indices of the display args of each condition, in the order of cond_wires
+        cond_args = []
+        for cond in self.display_cond2arg.keys():
+            ids = []
+            for arg in self.display_cond2arg[cond]:
+                if not arg_ids[arg] in ids:
+                    ids.append(arg_ids[arg])
+            cond_args.append(ids)
+        assert(len(cond_args) == len(cond_wires))
+        cond_num = len(cond_wires)
+        group_widths = [sum(arg_widths[i] for i in ids) for ids in cond_args]
+        payload_width = max(group_widths)
+        tag_width = max(1, (cond_num - 1).bit_length())
+
+        new_module_items = []
+        def add_variable(var_type, name, width):
+            var = var_type(name, width=getWidthFromInt(width))
+            self.notify_new_Variable(var)
+            new_module_items.append(var)
+            return vast.Identifier(name)
+
+        # The groups are recorded in batches, so a group waits for at most two batches and
+        # the groups come out of $time order by at most 2 * cond_num samples (see
+        # tracedecoder.reorder_displays). pending[i]: condition i fired and waits for the next
+        # batch, current[i]: condition i is in the batch being recorded.
+        pending = add_variable(vast.Logic, self.get_domain_name("display_mux_pending"), cond_num)
+        current = add_variable(vast.Logic, self.get_domain_name("display_mux_current"), cond_num)
+        dropped = add_variable(vast.Logic, self.get_domain_name("display_mux_dropped"), 1)
+        # the lowest condition of the current batch, recorded in this cycle
+        grant = add_variable(vast.Wire, self.get_domain_name("display_mux_grant"), cond_num)
+        new_module_items.append(vast.Assign(grant, vast.And(current,
+            vast.Plus(vast.Unot(current), vast.IntConst("{}'d1".format(cond_num))))))
+        # the conditions of the current batch still waiting after this cycle
+        remaining = add_variable(vast.Wire, self.get_domain_name("display_mux_remaining"), cond_num)
+        new_module_items.append(vast.Assign(remaining, vast.And(current, vast.Unot(grant))))
+        fired = vast.Concat(list(reversed(cond_wires)))
+
+        hold_statements = []
+        tag = vast.IntConst("{}'d0".format(tag_width))
+        payload = vast.IntConst("{}'d0".format(max(1, payload_width)))
+        for cid in reversed(range(cond_num)):
+            bit = vast.Pointer(current, vast.IntConst(str(cid)))
+            tag = vast.Cond(bit, vast.IntConst("{}'d{}".format(tag_width, cid)), tag)
+            if group_widths[cid] == 0:
+                continue
+            hold = add_variable(vast.Logic, self.get_domain_name("display_mux_hold_{}".format(cid)), group_widths[cid])
+            hold_statements.append(vast.IfStatement(cond_wires[cid],
+                vast.NonblockingSubstitution(hold, vast.Concat([display_args[i] for i in cond_args[cid]])),
+                None))
+            # the args of a group start at the MSB of the payload
+            value = hold
+            if group_widths[cid] < payload_width:
+                value = vast.Concat([hold, vast.IntConst("{}'d0".format(payload_width - group_widths[cid]))])
+            payload = vast.Cond(vast.Pointer(grant, vast.IntConst(str(cid))), value, payload)
+
+        # a group fired again before it was recorded, its hold register is overwritten
+        overwritten = vast.Uor(vast.And(fired, vast.Or(pending, remaining)))
+        # the groups that fired are queued once, in the batch they already wait in if any
+        queued = vast.Or(pending, vast.And(fired, vast.Unot(remaining)))
+        always_statement = vast.Block([
+            vast.IfStatement(self.state.reset,
+                vast.Block([
+                    vast.NonblockingSubstitution(pending, vast.IntConst("{}'d0".format(cond_num))),
+                    vast.NonblockingSubstitution(current, vast.IntConst("{}'d0".format(cond_num))),
+                    vast.NonblockingSubstitution(dropped, vast.IntConst("1'b0"))]),
+                vast.Block([
+                    # the next batch starts when the current one is recorded
+                    vast.IfStatement(vast.Uor(remaining),
+                        vast.Block([
+                            vast.NonblockingSubstitution(current, remaining),
+                            vast.NonblockingSubstitution(pending, queued)]),
+                        vast.Block([
+                            vast.NonblockingSubstitution(current, queued),
+                            vast.NonblockingSubstitution(pending, vast.IntConst("{}'d0".format(cond_num)))])),
+                    vast.NonblockingSubstitution(dropped, vast.Or(overwritten,
+                        vast.And(dropped, vast.Ulnot(vast.Uor(current)))))]))
+            ] + hold_statements)
+        new_module_items.append(vast.Always(vast.SensList([vast.Sens(clk)]), always_statement))
+        trace_fields = [
+            (add_variable(vast.Wire, self.get_domain_name("display_mux_tag"), tag_width), tag_width),
+            (dropped, 1)]
+        new_module_items.append(vast.Assign(trace_fields[0][0], tag))
+        if payload_width > 0:
+            trace_fields.append((add_variable(vast.Wire, self.get_domain_name("display_mux_payload"), payload_width), payload_width))
+            new_module_items.append(vast.Assign(trace_fields[-1][0], payload))
+        self.report_cost(self.get_domain_name("display_mux"), new_module_items)
+
+        self.state.traceinfo = ["encoding mux", "tag_width {}".format(tag_width)]
+        for cid, ids in enumerate(cond_args):
+            # group <condition index> <display args in the payload, from the MSB>
+            self.state.traceinfo.append("group {} {}".format(
+                cid, " ".join(self.astgen.visit(display_args[i]) for i in ids)))
+        return (new_module_items, vast.Uor(current), trace_fields)
+
+    def getSTPInstrumentation(self, clk, trace_enable_signal, trace_fields, depth):
+        total_trace_width = sum(width for _, width in trace_fields)
+        trace_data = vast.Concat([field for field, _ in trace_fields])
+        self.report_recorder_cost(trace_fields, trace_enable_signal, depth)
         stp_port_config = {
             "acq_data_in": trace_data,
             "acq_trigger_in": vast.Ulnot(self.state.reset),
@@ -284,24 +820,21 @@ class TaskSupportPass(PassBase):
         }
         stp_config = IntelSignalTapIIConfig(stp_port_config)
         stp_config.param_config["SLD_DATA_BITS"] = total_trace_width
-        stp_config.param_config["SLD_SAMPLE_DEPTH"] = self.INSTRUMENT_SAMPLE_DEPTH
+        stp_config.param_config["SLD_SAMPLE_DEPTH"] = depth
         stpinstance = IntelSignalTapII(stp_config, self.RECORDING_EMULATED)
         return stpinstance.getInstance()
 
-    def getILAInstrumentation(self, clk, cond_wires, display_args, arg_widths):
+    def getILAInstrumentation(self, clk, trace_enable_signal, trace_fields, depth):
         """
         Encoding:
-        make all cond_wires and display_args as data-only probes
-        make the OR of all cond_wires as a trigger-only probe
+        make all trace_fields (see getTracePlan) as data-only probes
+        make the trace enable signal as a trigger-only probe
         """
-        cond_data_list = [(cond, 1) for cond in cond_wires]
-        display_args_list = list(zip(display_args, arg_widths))
-        trace_enable_signal = reduce(vast.Lor, cond_wires)
-        for arg, arg_width in display_args_list:
-            self.state.displayarg_width[self.astgen.visit(arg)] = arg_width
-        trace_data = vast.Concat(cond_wires + display_args)
-        trace_data_width = sum(arg_widths) + len(cond_wires)
-        ila_inst = XilinxILA(clk, [], [(trace_data, trace_data_width)], [(trace_enable_signal, 1)], self.INSTRUMENT_SAMPLE_DEPTH)
+        trace_data = vast.Concat([field for field, _ in trace_fields])
+        trace_data_width = sum(width for _, width in trace_fields)
+        self.report_recorder_cost(trace_fields, trace_enable_signal, depth)
+        ila_inst = XilinxILA(clk, [], [(trace_data, trace_data_width)], [(trace_enable_signal, 1)], depth,
+                             self.RECORDING_EMULATED, self.buffer_name)
         return ila_inst.getInstance()
 
     def getFakeSTPInstrumentation(self, clk):
@@ -326,6 +859,9 @@ class TaskSupportPass(PassBase):
         stp_config = IntelSignalTapIIConfig(stp_port_config)
         stp_config.param_config["SLD_DATA_BITS"] = self.INSTRUMENT_SWEEP_CFG_WIDTH
         stp_config.param_config["SLD_SAMPLE_DEPTH"] = self.INSTRUMENT_SWEEP_CFG_DEPTH
+        if self.cost_estimator != None:
+            self.cost_estimator.add_recorder(self.__class__.__name__, "(sweep data)",
+                    self.INSTRUMENT_SWEEP_CFG_WIDTH, self.INSTRUMENT_SWEEP_CFG_DEPTH)
         stpinstance = IntelSignalTapII(stp_config, self.RECORDING_EMULATED)
         return stpinstance.getInstance()
 
@@ -342,26 +878,58 @@ class TaskSupportPass(PassBase):
             w = getWidthFromInt(remain_width)
             probe_list.append(vast.Partselect(self.cnt, w.msb, w.lsb))
         fake_data = vast.Concat(probe_list)
+        if self.cost_estimator != None:
+            self.cost_estimator.add_recorder(self.__class__.__name__, "(sweep data)",
+                    self.INSTRUMENT_SWEEP_CFG_WIDTH, self.INSTRUMENT_SWEEP_CFG_DEPTH)
         ila_inst = XilinxILA(clk, [], [(fake_data, self.INSTRUMENT_SWEEP_CFG_WIDTH)], [(vast.IntConst("1"), 1)], self.INSTRUMENT_SWEEP_CFG_DEPTH)
         return ila_inst.getInstance()
 
-    def create_cycle_counter_statements(self, clk):
+    def report_cost(self, target, items):
+        """
+        Report the generated items of target to the cost estimator, if any
+        """
+        if self.cost_estimator == None:
+            return
+        if not hasattr(self, "cost_width_visitor"):
+            self.cost_width_visitor = WidthVisitor(self.state)
+            # do not pollute the shared width table with the generated nodes
+            self.cost_width_visitor.widthtbl = dict(self.cost_width_visitor.widthtbl)
+        self.cost_estimator.add_items(self.__class__.__name__, target, items,
+                self.cost_width_visitor.getWidth)
+
+    def report_recorder_cost(self, trace_fields, trace_enable_signal, depth):
+        """
+        Report the trace width and memory used by every recorded field (condition or
+        display argument), and the logic of the storage enable signal
+        """
+        if self.cost_estimator == None:
+            return
+        pass_name = self.__class__.__name__
+        for field, width in trace_fields:
+            name = field.name if isinstance(field, vast.Identifier) else self.astgen.visit(field)
+            self.cost_estimator.add_recorder(pass_name, name, width, depth)
+        self.cost_estimator.count_expr(pass_name, "(storage enable)", trace_enable_signal)
+
+    def create_cycle_counter_statements(self, clk, cnt=None):
         """
+        cnt: the vast.Identifier of the counter, self.cnt by default
         Return: [logic declaration, always_block]
         Which first declare the cycle counter logic, then instrument an always block to reset and increment it.
         """
 
-        new_logic = vast.Logic(self.cnt_name, getWidthFromInt(self.cnt_width))
+        if cnt is None:
+            cnt = self.cnt
+        new_logic = vast.Logic(cnt.name, getWidthFromInt(self.cnt_width))
         self.notify_new_Variable(new_logic)
         sens_list = vast.SensList([vast.Sens(clk)])
         always_statement = vast.Block([
             vast.IfStatement(self.state.reset,
                              # cnt <= 64'h0
                              vast.NonblockingSubstitution(
-                                 self.cnt, vast.IntConst("{}'h0".format(self.cnt_width))),
+                                 cnt, vast.IntConst("{}'h0".format(self.cnt_width))),
                              # cnt <= cnt + 64'h1
-                             vast.NonblockingSubstitution(self.cnt,
-                                                          vast.Plus(self.cnt,
+                             vast.NonblockingSubstitution(cnt,
+                                                          vast.Plus(cnt,
                                                                     vast.IntConst(
                                                                         "{}'h1".format(self.cnt_width))
                                                                     )
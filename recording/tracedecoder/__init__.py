@@ -0,0 +1,9 @@
+"""
+Streaming decoder of the traces recorded by the SignalTapII/ILA instances of TaskSupportPass.
+Samples are read and decoded one at a time, so the memory does not grow with the capture.
+"""
+from .buffer import TraceBuffer, BinaryTraceBuffer, open_buffer
+from .layout import TraceLayout, get_manifest_hash
+from .render import DisplayRenderer
+from .decoder import SampleDecoder, Recorder, merge_displays, reorder_displays
+from .vectorized import VectorizedDecoder, VectorizedRenderer, iter_sample_chunks, NUMPY_AVAILABLE
@@ -0,0 +1,189 @@
+import mmap
+import os
+import struct
+from collections import deque
+
+"""
+Streaming readers of the sample buffer dumped from a SignalTapII/ILA recorder, either in text
+("w_buffer.txt"):
+    <data bits> <depth>
+    <trigger> <data in hex>
+    ...
+or in binary ("w_buffer.bin", see BinaryTraceBuffer).
+"""
+
+def iter_tokens(f, block_size=1 << 20):
+    """
+    Yield the whitespace separated tokens of f, reading block_size characters at a time
+    """
+    rest = ''
+    while True:
+        block = f.read(block_size)
+        if len(block) == 0:
+            break
+        tokens = (rest + block).split()
+        # the last token may continue in the next block
+        if block[-1].isspace():
+            rest = ''
+        else:
+            rest = tokens.pop() if len(tokens) > 0 else ''
+        for token in tokens:
+            yield token
+    if len(rest) > 0:
+        yield rest
+
+
+def open_buffer(stem):
+    """
+    Return: the buffer of <stem>.bin or <stem>.txt, the most recently written one if both exist
+    """
+    paths = [p for p in (stem + '.bin', stem + '.txt') if os.path.exists(p)]
+    if len(paths) == 0:
+        return TraceBuffer(stem + '.txt')
+    path = max(paths, key=os.path.getmtime)
+    if path.endswith('.bin'):
+        return BinaryTraceBuffer(path)
+    return TraceBuffer(path)
+
+
+class TraceBuffer(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path) as f:
+            tokens = iter_tokens(f)
+            self.data_bits = int(next(tokens))
+            self.depth = int(next(tokens))
+        self.nbytes = (self.data_bits + 7) // 8
+        # the hash of the manifests the samples were recorded with, None if unknown
+        self.manifest_hash = None
+
+    def iter_hex(self):
+        """
+        Yield: (triggered, data), data is the sample in hex
+        """
+        with open(self.path) as f:
+            tokens = iter_tokens(f)
+            next(tokens)
+            next(tokens)
+            for trigger in tokens:
+                data = next(tokens, None)
+                if data == None:
+                    # the buffer ends with a partial record
+                    return
+                yield (trigger == '1', data)
+
+    def __iter__(self):
+        """
+        Yield: (triggered, data), data is the sample as an int, its MSB is the first recorded field
+        """
+        for triggered, data in self.iter_hex():
+            yield (triggered, int(data, 16))
+
+    def iter_raw(self):
+        """
+        Yield: (triggered, data), data is the sample as nbytes big-endian bytes, padded at the MSB
+        """
+        width = self.nbytes * 2
+        for triggered, data in self.iter_hex():
+            yield (triggered, bytes.fromhex(data.zfill(width)))
+
+    def iter_samples(self, count=None, raw=False):
+        """
+        Yield the data of the samples of the capture window (see iter_window), or of all
+        samples if count is None. data is in bytes (see iter_raw) if raw is set, otherwise an int.
+        """
+        samples = self.iter_raw() if raw else iter(self)
+        if count == None:
+            return (data for _, data in samples)
+        return self.iter_window(count, samples)
+
+    def iter_window(self, count, samples=None):
+        """
+        Yield the data of the samples of the capture window, which starts count samples
+        before the first triggered sample and is depth samples long.
+        At most count samples are kept in memory.
+        samples: the (triggered, data) to select from, all samples of the buffer by default
+        """
+        if samples == None:
+            samples = iter(self)
+        # (index, data) of the last count samples before the trigger
+        pending = deque()
+        trigger = None
+        index = 0
+        for triggered, data in samples:
+            if trigger == None:
+                if not triggered:
+                    pending.append((index, data))
+                    if len(pending) > count:
+                        pending.popleft()
+                    index += 1
+                    continue
+                trigger = index
+                for _, d in pending:
+                    yield d
+                pending.clear()
+            if index >= trigger + self.depth - count:
+                break
+            yield data
+            index += 1
+        if trigger == None:
+            # never triggered, the window ends at depth
+            for i, d in pending:
+                if i >= self.depth - count:
+                    yield d
+
+
+class BinaryTraceBuffer(TraceBuffer):
+    """
+    The packed binary buffer written by the emulated recorders (see recording/xilinx/create_ila.py),
+    all little-endian:
+        header: "VPTB", version (u32), data bits (u32), depth (u32), manifest hash (u64, 0 if unknown)
+        records: {trigger, data} in 32-bit words, as written by $fwrite("%u")
+    The file is read through mmap.
+    """
+    MAGIC = b'VPTB'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIIIQ')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(self.HEADER.size)
+        if len(header) < self.HEADER.size or header[:4] != self.MAGIC:
+            raise ValueError('{} is not a binary trace buffer'.format(path))
+        _, version, self.data_bits, self.depth, manifest_hash = self.HEADER.unpack(header)
+        if version != self.VERSION:
+            raise ValueError('{}: unsupported binary trace buffer version {}'.format(path, version))
+        self.nbytes = (self.data_bits + 7) // 8
+        self.manifest_hash = manifest_hash if manifest_hash != 0 else None
+        # the trigger bit is recorded above the data
+        self.record_size = 4 * ((self.data_bits + 1 + 31) // 32)
+
+    def iter_records(self):
+        """
+        Yield: the records in bytes, a partial record at the end (an interrupted simulation) is ignored
+        """
+        size = self.record_size
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == self.HEADER.size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = self.HEADER.size + (len(mm) - self.HEADER.size) // size * size
+                for pos in range(self.HEADER.size, end, size):
+                    yield mm[pos:pos + size]
+
+    def __iter__(self):
+        mask = (1 << self.data_bits) - 1
+        for record in self.iter_records():
+            value = int.from_bytes(record, 'little')
+            yield ((value >> self.data_bits) & 1 == 1, value & mask)
+
+    def iter_raw(self):
+        """
+        The bits above the data in the first byte are not cleared, they may hold the trigger
+        """
+        trigger_byte = self.data_bits // 8
+        trigger_bit = self.data_bits % 8
+        last = self.nbytes - 1
+        for record in self.iter_records():
+            yield ((record[trigger_byte] >> trigger_bit) & 1 == 1, record[last::-1])
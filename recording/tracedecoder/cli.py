@@ -0,0 +1,169 @@
+import contextlib
+import os
+import subprocess
+import sys
+
+# the repository root, for utils/Format.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from utils.Format import beautify_string
+
+from .decoder import Recorder, merge_displays
+from .vectorized import NUMPY_AVAILABLE
+
+
+def reconstruct_main(argv):
+    """
+    usage: parser.py [--numpy|--no-numpy] <count> <name> [clock ...]
+    Write the displays of the capture window (count samples before the trigger) to reconstruct.txt
+    """
+    argv = parse_options(argv)
+    count = int(argv[0])
+    name = argv[1]
+    clocks = argv[2:]
+    recorders = Recorder.get_recorders(name, clocks)
+    with open('reconstruct.txt', 'w') as fp_write:
+        if len(recorders) == 1 and recorders[0].can_render():
+            # a single recorder is rendered in bulk, without a merge
+            for lines in recorders[0].iter_rendered(count):
+                fp_write.write(lines)
+        else:
+            for counter, recorder, cond_index, args in merge_displays(recorders, count):
+                fp_write.write(recorder.layout.renderers[cond_index].render(args) + '\n')
+    print('Done reconstructing displays! The result is in "reconstruct.txt"')
+
+
+# the VCD to FST converter of GTKWave, see open_waveform
+VCD2FST = 'vcd2fst'
+
+@contextlib.contextmanager
+def open_waveform(path, fst):
+    """
+    Return: the file to write the VCD to. With fst, the VCD is streamed through vcd2fst and
+    only the FST is written to path.
+    """
+    if not fst:
+        with open(path, 'w') as f:
+            yield f
+        return
+    try:
+        proc = subprocess.Popen([VCD2FST, '-v', '-', '-f', path], stdin=subprocess.PIPE,
+                                universal_newlines=True)
+    except FileNotFoundError:
+        raise RuntimeError("--fst requires {} (GTKWave) in PATH".format(VCD2FST))
+    # vcd2fst exited before reading the whole VCD, e.g. path is not writable
+    broken_pipe = False
+    try:
+        yield proc.stdin
+    except BrokenPipeError:
+        broken_pipe = True
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            broken_pipe = True
+        returncode = proc.wait()
+    if broken_pipe:
+        raise RuntimeError("{} exited with code {} before reading the whole VCD".format(VCD2FST, returncode))
+    if returncode != 0:
+        raise RuntimeError("{} failed with exit code {}".format(VCD2FST, returncode))
+
+
+def rebuild_vcd_main(argv):
+    """
+    usage: vcd_rebuilder.py [--numpy|--no-numpy] [--skip-idle] [--fst] <name> [clock ...]
+    Write the signal updates ("%%UPDATE:" displays, whose args are the cycle counter and the
+    signal) of all samples to rebuild.vcd
+    --skip-idle: only toggle the virtual clock in the cycles with updates
+    --fst: write rebuild.fst instead, converted by vcd2fst while the VCD is written
+    """
+    argv = parse_options(argv)
+    skip_idle = '--skip-idle' in argv
+    fst = '--fst' in argv
+    argv = [arg for arg in argv if not arg in ('--skip-idle', '--fst')]
+    from vcd import VCDWriter
+    name = argv[0]
+    clocks = argv[1:]
+    recorders = Recorder.get_recorders(name, clocks)
+
+    output = 'rebuild.fst' if fst else 'rebuild.vcd'
+    with open_waveform(output, fst) as vcd_write, \
+            VCDWriter(vcd_write, timescale='1 ns', date='today') as writer:
+        clk = writer.register_var("TOP", "virtual_clk", "wire", size=1)
+        # the signals of all the updates are registered from the manifests, before the first sample
+        # (recorder, condition index) => VCD variable
+        cond2var = {}
+        name2var = {}
+        for recorder in recorders:
+            layout = recorder.layout
+            for cond_index in layout.update_conds:
+                assert(len(layout.displays[cond_index][1]) == 2)
+                assert(layout.displays[cond_index][1][0] == layout.counter_name)
+                signal = layout.displays[cond_index][1][1]
+                if not signal in name2var:
+                    bname = beautify_string(signal)
+                    hier = ""
+                    pname = bname
+                    if "." in bname:
+                        hier = bname[:bname.rfind(".")]
+                        pname = bname[bname.rfind(".")+1:]
+                    name2var[signal] = writer.register_var("TOP."+hier, pname, 'wire', size=layout.args[signal][0])
+                cond2var[(recorder, cond_index)] = name2var[signal]
+
+        # the first cycle without a virtual clock edge
+        current_timestamp = 0
+        # the last cycle with updates
+        last_timestamp = None
+        for counter, recorder, cond_index, args in merge_displays(recorders, updates_only=True):
+            timestamp, val = args
+            if timestamp > current_timestamp:
+                if not skip_idle:
+                    while current_timestamp < timestamp:
+                        writer.change(clk, current_timestamp * 1000, 1)
+                        writer.change(clk, current_timestamp * 1000 + 500, 0)
+                        current_timestamp += 1
+                else:
+                    if last_timestamp != None and last_timestamp >= current_timestamp:
+                        writer.change(clk, last_timestamp * 1000, 1)
+                        writer.change(clk, last_timestamp * 1000 + 500, 0)
+                    current_timestamp = timestamp
+            last_timestamp = timestamp
+            writer.change(cond2var[(recorder, cond_index)], timestamp * 1000, val)
+
+    print('Done reconstructing displays! The result is in "{}"'.format(output))
+
+
+def parse_options(argv):
+    """
+    Remove the options from argv
+    --numpy: decode with NumPy (default if it is installed)
+    --no-numpy: decode in pure Python
+    Return: the remaining args
+    """
+    args = []
+    for arg in argv:
+        if arg == '--numpy':
+            if not NUMPY_AVAILABLE:
+                raise ImportError("--numpy requires NumPy")
+            Recorder.VECTORIZED = True
+        elif arg == '--no-numpy':
+            Recorder.VECTORIZED = False
+        else:
+            args.append(arg)
+    return args
+
+
+def main(argv=None):
+    """
+    usage: python3 -m tracedecoder displays [--numpy|--no-numpy] <count> <name> [clock ...]
+           python3 -m tracedecoder vcd [--numpy|--no-numpy] [--skip-idle] [--fst] <name> [clock ...]
+    """
+    if argv == None:
+        argv = sys.argv[1:]
+    if len(argv) < 2 or not argv[0] in ('displays', 'vcd'):
+        print(main.__doc__.strip())
+        return 1
+    if argv[0] == 'displays':
+        reconstruct_main(argv[1:])
+    else:
+        rebuild_vcd_main(argv[1:])
+    return 0
@@ -0,0 +1,210 @@
+import heapq
+
+from .buffer import open_buffer
+from .layout import TraceLayout
+from .vectorized import VectorizedDecoder, VectorizedRenderer, iter_sample_chunks, NUMPY_AVAILABLE
+
+"""
+Decode the samples of a recorder into displays, one at a time.
+"""
+
+class SampleDecoder(object):
+    def __init__(self, layout, data_bits):
+        self.layout = layout
+        # the repeat field of the delta encoding is stripped before decoding a sample
+        self.bits = data_bits - (layout.delta_width or 0)
+
+    def get_field(self, data, start, width):
+        """
+        Return: the width bits of data starting at start, counted from the MSB
+        """
+        return (data >> (self.bits - start - width)) & ((1 << width) - 1)
+
+    def iter_samples(self, values):
+        """
+        values: the recorded samples (int)
+        Yield: (data, cycles after the recorded sample), including the repeated samples
+        that were skipped by the delta encoding
+        """
+        delta_width = self.layout.delta_width
+        previous = None
+        for value in values:
+            if delta_width == None:
+                yield (value, 0)
+                continue
+            # the number of cycles the previous sample was repeated in
+            repeat = value & ((1 << delta_width) - 1)
+            data = value >> delta_width
+            if previous != None:
+                for offset in range(1, repeat + 1):
+                    yield (previous, offset)
+            yield (data, 0)
+            previous = data
+
+    def get_fired_conds(self, data):
+        """
+        Return: the indices of the display conditions recorded in the sample data, in increasing order
+        """
+        layout = self.layout
+        if layout.cond_groups != None:
+            if self.get_field(data, layout.cond_tag_width, 1):
+                print('Warning: some displays were dropped before this sample')
+            return [self.get_field(data, 0, layout.cond_tag_width)]
+        if layout.cond_slots == None:
+            return [cond_index for cond_index in range(layout.cond_num)
+                    if self.get_field(data, cond_index, 1)]
+        fired = []
+        pos = 0
+        for slot, (id_width, cids) in enumerate(layout.cond_slots):
+            cond_id = self.get_field(data, pos, id_width)
+            if cond_id != 0:
+                fired.append(cids[cond_id-1])
+            if self.get_field(data, pos + id_width, 1):
+                print('Warning: more than one display condition fired in slot {}, only condition {} is recorded'.format(slot, cids[cond_id-1]))
+            pos += id_width + 1
+        return sorted(fired)
+
+    def get_counter(self, data):
+        """
+        Return: the cycle counter recorded last in the sample data, None if it is not recorded
+        """
+        if self.layout.counter_width == None:
+            return None
+        return data & ((1 << self.layout.counter_width) - 1)
+
+    def iter_displays(self, values, conds=None):
+        """
+        conds: the indices of the display conditions to decode, all of them if None
+        Yield: (cycle counter or None, condition index, (display arg values))
+        """
+        layout = self.layout
+        if conds != None:
+            conds = set(conds)
+        # (start, width, is the cycle counter) of the display args of every condition
+        fields = []
+        for cond_index, (_, names) in enumerate(layout.displays):
+            fields.append([layout.get_arg_field(cond_index, name)[::-1] + (name == layout.counter_name,)
+                           for name in names])
+        for data, offset in self.iter_samples(values):
+            counter = self.get_counter(data)
+            if counter != None:
+                counter += offset
+            for cond_index in self.get_fired_conds(data):
+                if conds != None and not cond_index in conds:
+                    continue
+                args = []
+                for start, width, is_counter in fields[cond_index]:
+                    value = self.get_field(data, start, width)
+                    if is_counter:
+                        value += offset
+                    args.append(value)
+                yield (counter, cond_index, tuple(args))
+
+
+class Recorder(object):
+    """
+    The buffer and the manifests of one recorder
+    """
+    # decode with VectorizedDecoder, if NumPy is available
+    VECTORIZED = NUMPY_AVAILABLE
+
+    def __init__(self, buffer_stem, prefix):
+        self.buffer = open_buffer(buffer_stem)
+        self.layout = TraceLayout(prefix)
+        if self.buffer.manifest_hash != None and self.buffer.manifest_hash != self.layout.manifest_hash:
+            raise ValueError('{} was not recorded with the manifests {}.*info.txt'.format(
+                self.buffer.path, prefix))
+        if self.VECTORIZED:
+            self.decoder = VectorizedDecoder(self.layout, self.buffer.data_bits)
+            self.renderers = [VectorizedRenderer(r) for r in self.layout.renderers]
+        else:
+            self.decoder = SampleDecoder(self.layout, self.buffer.data_bits)
+
+    @staticmethod
+    def get_recorders(name, clocks):
+        """
+        The main recorder is decoded from w_buffer.{bin,txt} and <name>.v.*info.txt. With
+        TaskSupportPass.MULTI_CLOCK, the recorder of every other clock domain is decoded
+        from w_buffer.<clock>.{bin,txt} and <name>.v.<clock>.*info.txt.
+        """
+        recorders = [Recorder('w_buffer', name + '.v')]
+        for clock in clocks:
+            recorders.append(Recorder('w_buffer.' + clock, name + '.v.' + clock))
+        return recorders
+
+    def iter_displays(self, count=None, conds=None):
+        """
+        count: the samples before the trigger to decode, all samples if None
+        conds: the indices of the display conditions to decode, all of them if None
+        Yield: (cycle counter or None, recorder, condition index, (display arg values))
+        """
+        if self.VECTORIZED:
+            chunks = iter_sample_chunks(self.buffer, count, self.decoder.CHUNK_SIZE)
+            displays = self.decoder.iter_displays(None, conds, chunks)
+        else:
+            displays = self.decoder.iter_displays(self.buffer.iter_samples(count), conds)
+        layout = self.layout
+        if layout.cond_groups != None:
+            # the mux encoding records the groups out of $time order, see
+            # TaskSupportPass.get_mux_encoding
+            displays = reorder_displays(self.iter_fire_times(displays), 2 * layout.cond_num)
+        for counter, cond_index, args in displays:
+            yield (counter, self, cond_index, args)
+
+    def can_render(self):
+        """
+        Return: whether iter_rendered can format all the displays: VectorizedRenderer supports
+        their formats, and the samples are in $time order (not the mux encoding)
+        """
+        return (self.VECTORIZED and self.layout.cond_groups == None and
+                all(r.supported for r in self.renderers))
+
+    def iter_rendered(self, count=None):
+        """
+        count: see iter_displays
+        Yield: the displayed lines in blocks, one per chunk of samples, see can_render
+        """
+        chunks = iter_sample_chunks(self.buffer, count, self.decoder.CHUNK_SIZE)
+        return self.decoder.iter_rendered(chunks, self.renderers)
+
+    def iter_fire_times(self, displays):
+        """
+        Yield the displays with the cycle counter replaced by their $time arg, the cycle they
+        fired in, when they have one
+        """
+        time_args = [names.index(self.layout.counter_name) if self.layout.counter_name in names else None
+                     for _, names in self.layout.displays]
+        for counter, cond_index, args in displays:
+            i = time_args[cond_index]
+            if i != None:
+                counter = args[i]
+            yield (counter, cond_index, args)
+
+
+def reorder_displays(displays, window):
+    """
+    Sort the displays by their cycle counter, when every display is at most window displays
+    away from its sorted position. Displays with the same counter keep their order.
+    """
+    heap = []
+    for seq, display in enumerate(displays):
+        counter = display[0] if display[0] != None else 0
+        heapq.heappush(heap, (counter, seq, display))
+        if len(heap) > window:
+            yield heapq.heappop(heap)[2]
+    while len(heap) > 0:
+        yield heapq.heappop(heap)[2]
+
+
+def merge_displays(recorders, count=None, updates_only=False):
+    """
+    Merge the displays of several recorders by their cycle counter. The counter of every
+    recorder is increasing, so the merge only keeps one display per recorder in memory.
+    Displays with the same counter keep the order of the recorders.
+    updates_only: only decode the "%%UPDATE:" displays (TraceLayout.update_conds)
+    """
+    streams = [r.iter_displays(count, r.layout.update_conds if updates_only else None)
+               for r in recorders]
+    if len(streams) == 1:
+        return streams[0]
+    return heapq.merge(*streams, key=lambda x: x[0] if x[0] != None else 0)
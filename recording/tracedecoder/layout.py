@@ -0,0 +1,141 @@
+import hashlib
+import os
+
+from .render import DisplayRenderer
+
+"""
+The layout of the samples of one recorder, described by the manifests written by
+TaskSupportPass: "<prefix>.displayinfo.txt", "<prefix>.widthinfo.txt" and the optional
+"<prefix>.traceinfo.txt", where prefix is "<output>.v" or "<output>.v.<clock>".
+"""
+
+DEFAULT_COUNTER_NAME = 'TASKPASS_cycle_counter'
+
+def parse_display(line):
+    """
+    line: "<condition name> $display("<format>", <arg> , <arg> ) ;"
+    Return: (format string, [arg names])
+    """
+    parts = line.split('"')[1:]
+    fmt = parts[0]
+    args = parts[1]
+    args = args.split(' ')
+    args.pop()
+    names = [arg for arg in args if arg != ',']
+    names[-1] = names[-1][:-1]
+    if len(names[-1]) == 0:
+        names.pop()
+    return (fmt, names)
+
+
+def get_manifest_hash(prefix):
+    """
+    Return: the 64-bit hash of the manifests <prefix>.*info.txt, recorded in the header of the
+    binary buffers (see buffer.BinaryTraceBuffer)
+    """
+    h = hashlib.sha256()
+    for suffix in ('.displayinfo.txt', '.widthinfo.txt', '.traceinfo.txt'):
+        if os.path.exists(prefix + suffix):
+            with open(prefix + suffix, 'rb') as f:
+                h.update(f.read())
+        h.update(b'\0')
+    return int.from_bytes(h.digest()[:8], 'little')
+
+
+class TraceLayout(object):
+    def __init__(self, prefix):
+        self.manifest_hash = get_manifest_hash(prefix)
+        # the layout of the recorded display conditions, see TaskSupportPass.get_cond_encoding
+        # cond_slots is None for the one-hot encoding (one bit per condition),
+        # otherwise a list of (id width, [condition index of ID 1, condition index of ID 2, ...])
+        self.cond_slots = None
+        # for the mux encoding, every sample is one display: the condition tag, the dropped bit
+        # and the display args of that condition (cond_groups: condition index => [arg names])
+        self.cond_tag_width = None
+        self.cond_groups = None
+        # the cycle counter of the recorder, its width is not None if it is recorded in every sample
+        self.counter_name = DEFAULT_COUNTER_NAME
+        self.counter_width = None
+        # the width of the repeat field recorded last in every sample with TaskSupportPass.ARG_DELTA
+        self.delta_width = None
+        if os.path.exists(prefix + '.traceinfo.txt'):
+            with open(prefix + '.traceinfo.txt') as f:
+                for line in f:
+                    self.parse_traceinfo(line.split())
+
+        # [(format, [arg names])], one per display condition, $time is named after the cycle counter
+        self.displays = []
+        with open(prefix + '.displayinfo.txt') as f:
+            for line in f:
+                line = line.rstrip('\r\n')
+                if len(line) == 0:
+                    continue
+                fmt, names = parse_display(line)
+                names = [self.counter_name if name == '$time' else name for name in names]
+                self.displays.append((fmt, names))
+        self.cond_num = len(self.displays)
+
+        if self.cond_groups != None:
+            self.cond_bits = self.cond_tag_width + 1
+        elif self.cond_slots == None:
+            self.cond_bits = self.cond_num
+        else:
+            self.cond_bits = sum(id_width + 1 for id_width, _ in self.cond_slots)
+
+        # arg name => (width, start index from the MSB of a sample)
+        self.args = {}
+        with open(prefix + '.widthinfo.txt') as f:
+            tokens = f.read().split()
+        start = self.cond_bits
+        for name, width in zip(tokens[0::2], tokens[1::2]):
+            self.args[name] = (int(width), start)
+            start += int(width)
+        if self.cond_groups != None:
+            # the args of a group start at the beginning of the payload
+            self.group_args = {}
+            for cond_index, names in self.cond_groups.items():
+                start = self.cond_bits
+                for name in names:
+                    self.group_args[(cond_index, name)] = (self.args[name][0], start)
+                    start += self.args[name][0]
+
+        # the indices of the "%%UPDATE:" displays, see is_update
+        self.update_conds = [cond_index for cond_index in range(self.cond_num) if self.is_update(cond_index)]
+
+        # one compiled renderer per display condition
+        self.renderers = []
+        for fmt, names in self.displays:
+            widths = [self.args[name][0] if name in self.args else None for name in names]
+            self.renderers.append(DisplayRenderer(fmt, widths))
+
+    def parse_traceinfo(self, fields):
+        if len(fields) == 0:
+            return
+        if fields[0] == 'encoding' and fields[1] == 'binary':
+            self.cond_slots = []
+        elif fields[0] == 'slot':
+            self.cond_slots.append((int(fields[2]), [int(x) for x in fields[3:]]))
+        elif fields[0] == 'tag_width':
+            self.cond_tag_width = int(fields[1])
+            self.cond_groups = {}
+        elif fields[0] == 'group':
+            self.cond_groups[int(fields[1])] = fields[2:]
+        elif fields[0] == 'counter':
+            self.counter_name = fields[1]
+            self.counter_width = int(fields[2])
+        elif fields[0] == 'delta':
+            self.delta_width = int(fields[1])
+
+    def get_arg_field(self, cond_index, name):
+        """
+        Return: (width, start index) of the display arg name of the condition cond_index
+        """
+        if self.cond_groups != None:
+            return self.group_args[(cond_index, name)]
+        return self.args[name]
+
+    def is_update(self, cond_index):
+        """
+        Return: if the display of cond_index is a "%%UPDATE:" display, a signal update for the VCD
+        """
+        return "%%UPDATE:" in self.displays[cond_index][0]
@@ -0,0 +1,151 @@
+import re
+
+"""
+Renderers of the $display format strings of "<prefix>.displayinfo.txt". Every format is
+compiled once into a printf-style template carrying the radix and the padding of the Verilog
+format specifiers, so rendering a display is a single % operation.
+"""
+
+# %[-]<size>[.<precision>]<specifier>, %% included
+FORMAT_SPEC = re.compile(r'%(-?)(\d*)(?:\.(\d*))?([a-zA-Z%])')
+# the specifiers without an arg, kept as is
+NO_ARG_SPECIFIERS = ('m', 'l')
+ESCAPE = re.compile(r'\\([0-7]{1,3}|.)')
+ESCAPES = {'n': '\n', 't': '\t', '\\': '\\', '"': '"'}
+
+def unescape(s):
+    """
+    Return: s with the escape sequences of Verilog strings replaced
+    """
+    def replace(m):
+        c = m.group(1)
+        if c[0] in '01234567':
+            return chr(int(c, 8))
+        return ESCAPES.get(c, c)
+    return ESCAPE.sub(replace, s)
+
+
+def get_string(value, width):
+    """
+    Return: the value of a %s arg, 8 bits per character, the leading NUL characters are dropped
+    """
+    nbytes = (width + 7) // 8 if width != None else (value.bit_length() + 7) // 8
+    return value.to_bytes(nbytes, 'big').lstrip(b'\0').decode('latin-1')
+
+
+class DisplayRenderer(object):
+    # the minimum width of %t, the default of $timeformat
+    TIME_WIDTH = 20
+    # specifier => (printf type, fill of the default size, digits of the default size for a width)
+    SPECIFIERS = {
+        'b': ('b', '0', lambda width: width),
+        'o': ('o', '0', lambda width: (width + 2) // 3),
+        'h': ('x', '0', lambda width: (width + 3) // 4),
+        'x': ('x', '0', lambda width: (width + 3) // 4),
+        'd': ('d', ' ', lambda width: len(str((1 << width) - 1))),
+        't': ('d', ' ', lambda width: DisplayRenderer.TIME_WIDTH),
+        'c': ('c', ' ', lambda width: 1),
+        's': ('s', ' ', lambda width: (width + 7) // 8),
+        # the value is converted to a real, there is no default size
+        'e': ('e', ' ', lambda width: 0),
+        'f': ('f', ' ', lambda width: 0),
+        'g': ('g', ' ', lambda width: 0),
+    }
+
+    def __init__(self, fmt, widths):
+        """
+        fmt: the format string of the $display, as written in the source
+        widths: the width of every display arg, None if unknown
+        """
+        self.fmt = fmt
+        # the conversions of the args that printf cannot do, None if there is none
+        self.converters = None
+        # the parsed format: literal text (str) or (specifier, minimum width, left-justified,
+        # arg width, precision) for every arg, see VectorizedRenderer
+        self.specs = []
+        converters = []
+        pieces = []
+        text = unescape(fmt)
+        pos = 0
+        arg = 0
+        for m in FORMAT_SPEC.finditer(text):
+            pieces.append(text[pos:m.start()].replace('%', '%%'))
+            self.specs.append(text[pos:m.start()])
+            pos = m.end()
+            left, size, precision, spec = m.group(1), m.group(2), m.group(3), m.group(4).lower()
+            if spec == '%':
+                pieces.append('%%')
+                self.specs.append('%')
+                continue
+            if spec in NO_ARG_SPECIFIERS:
+                pieces.append(m.group(0).replace('%', '%%'))
+                self.specs.append(m.group(0))
+                continue
+            if not spec in self.SPECIFIERS:
+                # e.g. %u, %z or %v, every later arg would be misaligned
+                raise ValueError('unsupported format specifier "{}" in "{}"'.format(m.group(0), fmt))
+            if arg >= len(widths):
+                raise ValueError('too few display args for "{}"'.format(fmt))
+            pieces.append(self.compile_spec(spec, size, widths[arg], converters, left == '-', precision))
+            self.specs.append((spec, self.get_min_width(spec, size, widths[arg]), left == '-',
+                               widths[arg], precision))
+            arg += 1
+        pieces.append(text[pos:].replace('%', '%%'))
+        self.specs.append(text[pos:])
+        # the args without a specifier are printed in decimal, as $display does
+        for width in widths[arg:]:
+            pieces.append(self.compile_spec('d', '', width, converters))
+            self.specs.append(('d', self.get_min_width('d', '', width), False, width, None))
+        self.template = ''.join(pieces)
+        if any(c != None for c in converters):
+            self.converters = converters
+
+    def get_min_width(self, spec, size, width):
+        """
+        Return: the minimum width of the value of a format specifier, it is padded to it
+        size: the digits between % and the specifier, "" for the default size
+        """
+        if size == '':
+            # the default size fits the widest value, except %t which has a minimum width
+            return self.SPECIFIERS[spec][2](width) if width != None or spec == 't' else 0
+        # %0<specifier> is not padded, otherwise size is the minimum width
+        return int(size)
+
+    def compile_spec(self, spec, size, width, converters, left=False, precision=None):
+        """
+        Return: the printf conversion of one format specifier
+        size: the digits between % and the specifier, "" for the default size
+        left: the value is left-justified (%-<size>), padded with spaces
+        precision: the digits after the "." of %e, %f and %g, None for the default
+        """
+        ptype, fill, _ = self.SPECIFIERS[spec]
+        digits = self.get_min_width(spec, size, width)
+        padding = ''
+        if digits > 1:
+            if left:
+                padding = '-' + str(digits)
+            else:
+                padding = ('0' if fill == '0' else '') + str(digits)
+        if precision != None and spec in ('e', 'f', 'g'):
+            padding += '.' + (precision if precision != '' else '0')
+        if spec == 'b':
+            # printf has no binary conversion
+            binary = padding.replace('-', '<') + 'b'
+            converters.append(lambda value: format(value, binary))
+            return '%s'
+        if spec == 'c':
+            converters.append(lambda value: value & 0xff)
+        elif spec == 's':
+            converters.append(lambda value: get_string(value, width))
+        else:
+            converters.append(None)
+        return '%' + padding + ptype
+
+    def render(self, args):
+        """
+        args: the values of the display args (int), a tuple
+        Return: the displayed string
+        """
+        if self.converters != None:
+            args = tuple(value if c == None else c(value) for c, value in zip(self.converters, args))
+        return self.template % args
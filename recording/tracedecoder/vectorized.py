@@ -0,0 +1,751 @@
+import os
+import re
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+"""
+A NumPy version of SampleDecoder. Samples are decoded in chunks: every chunk is loaded into
+a uint8 matrix (one row per sample, the MSB first) and every field (condition bits, condition
+IDs, display args, counter, delta repeat) is extracted as a column for all the samples of the
+chunk at once. iter_displays then builds the displays that fired in Python, while
+render_chunk formats them in bulk: the lines of every condition are built as a character
+matrix, see VectorizedRenderer.
+"""
+
+# the widest piece of a field extracted into a uint64 column, any bit offset of such a
+# piece spans at most 8 bytes
+PIECE_BITS = 56
+# the bits of the limbs the display args are formatted from, a multiple of 1, 3, 4 and 8
+# (binary, octal, hex and string digits), and small enough to divide by 10**4 in uint64
+LIMB_BITS = 48
+# the decimal digits of every division by 10**DECIMAL_GROUP
+DECIMAL_GROUP = 4
+# the samples of the text buffers are read in blocks of that many characters
+TEXT_BLOCK_SIZE = 1 << 22
+
+if NUMPY_AVAILABLE:
+    # ASCII => hex digit value, 255 for the other characters
+    HEX_VALUES = np.full(256, 255, dtype=np.uint16)
+    for i, c in enumerate(b'0123456789abcdef'):
+        HEX_VALUES[c] = i
+        HEX_VALUES[ord(chr(c).upper())] = i
+    # two ASCII characters read as a little-endian uint16 => the byte of the two hex digits,
+    # 0xffff if one of them is not a hex digit
+    _high = HEX_VALUES[np.arange(1 << 16) & 0xff]
+    _low = HEX_VALUES[np.arange(1 << 16) >> 8]
+    HEX_PAIRS = np.where((_high > 15) | (_low > 15), 0xffff, (_high << 4) | _low).astype(np.uint16)
+
+# the header of a text buffer: data bits and depth
+TEXT_HEADER = re.compile(rb'\s*\S+\s+\S+\s+')
+# a record of a text buffer: trigger, separators, data in hex, separators
+TEXT_RECORD = re.compile(rb'(\S+)(\s+)(\S+)(\s+)')
+
+
+def get_digit_table(base, digits):
+    """
+    Return: the uint8 matrix of the characters of every value of digits digits in base,
+    the most significant first
+    """
+    values = np.arange(base ** digits)
+    powers = base ** np.arange(digits - 1, -1, -1)
+    return np.frombuffer(b'0123456789abcdef', dtype=np.uint8)[(values[:, np.newaxis] // powers) % base]
+
+
+def get_hex_pairs(chars, width):
+    """
+    chars: the uint8 matrix of the hex digits of the samples, at most width (even) digits
+    per row, each row contiguous
+    Return: the uint16 matrix of the bytes of the samples (padded with zeros at the MSB),
+    0xffff for the digits that are not hex
+    """
+    if chars.shape[1] < width:
+        chars = np.hstack([np.full((chars.shape[0], width - chars.shape[1]), ord('0'), dtype=np.uint8), chars])
+    # the digits are read in pairs in place
+    return HEX_PAIRS[chars.view('<u2')]
+
+
+def get_hex_chars(block, starts, ends, width):
+    """
+    Return: the uint8 matrix of the hex digits of the data tokens of block (starts and ends,
+    one per record), padded with zeros at the MSB to width digits
+    """
+    lengths = ends - starts
+    if lengths.max() > width:
+        raise ValueError('a sample is wider than {} hex digits'.format(width))
+    columns = np.arange(width) - width
+    index = ends[:, np.newaxis] + columns
+    return np.where(columns >= -lengths[:, np.newaxis], block[np.maximum(index, 0)], ord('0')).astype(np.uint8)
+
+
+def is_space(chars):
+    """
+    Return: whether the characters are separators of bytes.split: space and \\t to \\r
+    """
+    return (chars == ord(' ')) | (chars - np.uint8(9) <= 4)
+
+
+def iter_regular_records(text, pos, width, chunk_size):
+    """
+    Read the records of the same layout from pos, e.g. written by $fdisplay("%b %h"), as the
+    rows of a strided view of text.
+    Yield: (triggered, m), see iter_text_chunks
+    Return: the position of the first record of another layout, the end of the records if
+    there is none
+    """
+    first = TEXT_RECORD.match(bytes(text[pos:pos + 2 * (width + 64)]))
+    if first == None:
+        return pos
+    stride = first.end()
+    digits = first.end(3) - first.start(3)
+    n = (len(text) - pos) // stride
+    if digits > width or n == 0:
+        return pos
+    rows = np.lib.stride_tricks.as_strided(np.asarray(text[pos:]), shape=(n, stride),
+                                           strides=(stride, 1), writeable=False)
+    trigger = slice(0, first.end(1))
+    data = slice(first.start(3), first.end(3))
+    separators = np.r_[first.start(2):first.end(2), first.start(4):first.end(4)]
+    for i in range(0, n, chunk_size):
+        r = rows[i:i + chunk_size]
+        values = get_hex_pairs(r[:, data], width)
+        irregular = (values > 0xff).any(axis=1) | ~is_space(r[:, separators]).all(axis=1) | \
+            is_space(r[:, trigger]).any(axis=1)
+        if irregular.any():
+            k = int(np.argmax(irregular))
+            if k > 0:
+                yield (get_triggered(r[:k, trigger]), values[:k].astype(np.uint8))
+            return pos + (i + k) * stride
+        yield (get_triggered(r[:, trigger]), values.astype(np.uint8))
+    return pos + n * stride
+
+
+def get_triggered(triggers):
+    """
+    Return: whether the trigger tokens (a uint8 matrix) are "1"
+    """
+    if triggers.shape[1] != 1:
+        return np.zeros(triggers.shape[0], dtype=bool)
+    return triggers[:, 0] == ord('1')
+
+
+def iter_text_chunks(buffer, chunk_size):
+    """
+    Yield: (triggered, m) of a text TraceBuffer, chunk_size records or about TEXT_BLOCK_SIZE
+    characters at a time. The tokens are found with NumPy, the file is mapped in memory.
+    """
+    width = buffer.nbytes * 2
+    if os.path.getsize(buffer.path) == 0:
+        return
+    text = np.memmap(buffer.path, dtype=np.uint8, mode='r')
+    header = TEXT_HEADER.match(bytes(text[:256]))
+    if header != None:
+        # the records are usually of the same layout, the others are tokenized
+        pos = yield from iter_regular_records(text, header.end(), width, chunk_size)
+        skip = 0
+    else:
+        pos = 0
+        skip = 2
+    size = TEXT_BLOCK_SIZE
+    while pos < len(text):
+        end = min(pos + size, len(text))
+        block = np.asarray(text[pos:end])
+        space = is_space(block)
+        if end < len(text):
+            # the block ends after its last separator, the token after it may continue
+            if space.any():
+                end -= int(np.argmax(space[::-1]))
+                block = block[:end - pos]
+                space = space[:end - pos]
+            else:
+                end = len(text)
+                block = np.asarray(text[pos:end])
+                space = is_space(block)
+        # the tokens start and end where the separators do
+        padded = np.concatenate(([True], space, [True]))
+        edges = np.flatnonzero(padded[1:] != padded[:-1])
+        starts = edges[0::2][skip:]
+        ends = edges[1::2][skip:]
+        if len(starts) % 2 == 1:
+            if end < len(text):
+                if len(starts) == 1 and skip == 0:
+                    # a record larger than the block
+                    size *= 2
+                    continue
+                # the last record continues in the next block
+                end = pos + int(starts[-1])
+            # otherwise the buffer ends with a partial record, see TraceBuffer.iter_hex
+            starts = starts[:-1]
+            ends = ends[:-1]
+        if len(starts) > 0:
+            triggered = (block[starts[0::2]] == ord('1')) & (ends[0::2] - starts[0::2] == 1)
+            values = get_hex_pairs(get_hex_chars(block, starts[1::2], ends[1::2], width), width)
+            if values.max() > 0xff:
+                raise ValueError('invalid hex sample in the trace buffer')
+            yield (triggered, values.astype(np.uint8))
+        skip = 0
+        pos = end
+
+
+def iter_binary_chunks(buffer, chunk_size):
+    """
+    Yield: (triggered, m) of a BinaryTraceBuffer, chunk_size records at a time
+    """
+    size = buffer.record_size
+    header = buffer.HEADER.size
+    n = (os.path.getsize(buffer.path) - header) // size
+    if n <= 0:
+        return
+    records = np.memmap(buffer.path, dtype=np.uint8, mode='r', offset=header, shape=(n, size))
+    trigger_byte = buffer.data_bits // 8
+    trigger_bit = buffer.data_bits % 8
+    last = buffer.nbytes - 1
+    for i in range(0, n, chunk_size):
+        r = records[i:i + chunk_size]
+        triggered = (r[:, trigger_byte] >> trigger_bit) & 1 == 1
+        # little-endian records, the bits above the data in the first byte are never read
+        yield (triggered, np.ascontiguousarray(r[:, last::-1]))
+
+
+def iter_window_chunks(chunks, count, depth):
+    """
+    Yield the sample matrices of the capture window, see TraceBuffer.iter_window
+    chunks: (triggered, m), see iter_text_chunks and iter_binary_chunks
+    """
+    # the matrices of the last count samples before the trigger
+    pending = []
+    pending_rows = 0
+    # the samples before the current chunk
+    index = 0
+    trigger = None
+    for triggered, m in chunks:
+        start = 0
+        if trigger == None:
+            hits = np.nonzero(triggered)[0]
+            if len(hits) == 0:
+                pending.append(m)
+                pending_rows += m.shape[0]
+                while len(pending) > 0 and pending_rows - pending[0].shape[0] >= count:
+                    pending_rows -= pending.pop(0).shape[0]
+                index += m.shape[0]
+                continue
+            start = int(hits[0])
+            trigger = index + start
+            before = np.vstack(pending + [m[:start]])
+            if count > 0 and before.shape[0] > 0:
+                yield before[-count:]
+            pending = []
+        end = trigger + depth - count - index
+        if end > start:
+            yield m[start:end]
+        if end < m.shape[0]:
+            return
+        index += m.shape[0]
+    if trigger == None and len(pending) > 0:
+        # never triggered, the window ends at depth
+        before = np.vstack(pending)
+        before = before[max(before.shape[0] - count, 0):]
+        first = index - before.shape[0]
+        if before.shape[0] > 0:
+            yield before[max(depth - count - first, 0):]
+
+
+def iter_sample_chunks(buffer, count=None, chunk_size=65536):
+    """
+    Yield the sample matrices of the capture window of buffer (see TraceBuffer.iter_window),
+    or of all samples if count is None
+    """
+    if hasattr(buffer, 'record_size'):
+        chunks = iter_binary_chunks(buffer, chunk_size)
+    else:
+        chunks = iter_text_chunks(buffer, chunk_size)
+    if count == None:
+        return (m for _, m in chunks)
+    return iter_window_chunks(chunks, count, buffer.depth)
+
+
+class VectorizedRenderer(object):
+    """
+    The bulk version of a DisplayRenderer: the lines of all the displays of a condition are
+    built as one character matrix, one row per display, with a mask of the characters kept
+    (the padding of the args is variable).
+    """
+    # specifier => (base of the digits, fill of the padding)
+    SPECIFIERS = {
+        'b': (2, '0'), 'o': (8, '0'), 'h': (16, '0'), 'x': (16, '0'),
+        'd': (10, ' '), 't': (10, ' '), 'c': (256, ' '), 's': (256, ' '),
+    }
+    # base => the bits of the chunks of the limbs formatted at once, and their digits
+    CHUNK_BITS = {2: 8, 8: 12, 16: 16, 256: 8}
+    CHUNK_DIGITS = {2: 8, 8: 4, 10: DECIMAL_GROUP, 16: 4, 256: 1}
+    # base => the digit tables of the chunks, see get_digit_tables
+    DIGIT_TABLES = {}
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        # %e, %f and %g, the args of unknown width and the text that is not latin-1 are
+        # only rendered by DisplayRenderer
+        self.supported = True
+        for piece in renderer.specs:
+            if isinstance(piece, str):
+                try:
+                    piece.encode('latin-1')
+                except UnicodeEncodeError:
+                    self.supported = False
+            elif not piece[0] in self.SPECIFIERS or piece[3] == None:
+                self.supported = False
+
+    @classmethod
+    def get_digit_tables(cls, base):
+        """
+        Return: (characters, lengths). characters holds the digits of every chunk value packed
+        in one uint32 (uint64 for 8 digits) in three variants: the digits, the digits with
+        the leading zeros replaced by spaces, and only spaces. lengths is the number of
+        significant digits of every chunk value, 1 for 0.
+        """
+        if not base in cls.DIGIT_TABLES:
+            digits = cls.CHUNK_DIGITS[base]
+            table = get_digit_table(base, digits)
+            values = np.arange(len(table))
+            lengths = (values[:, np.newaxis] >= base ** np.arange(1, digits)).sum(axis=1) + 1
+            leading = np.where(np.arange(digits) < digits - lengths[:, np.newaxis], ord(' '), table)
+            spaces = np.full(table.shape, ord(' '))
+            characters = np.vstack([table, leading, spaces]).astype(np.uint8)
+            packed = characters.view(np.uint32 if digits == 4 else np.uint64).ravel()
+            cls.DIGIT_TABLES[base] = (packed, lengths)
+        return cls.DIGIT_TABLES[base]
+
+    @staticmethod
+    def get_decimal_chunks(limbs, bits, nchunks):
+        """
+        Return: the uint16 matrix of the nchunks groups of DECIMAL_GROUP decimal digits of the
+        values, the most significant first
+        """
+        n = limbs.shape[0]
+        chunks = np.empty((n, nchunks), dtype=np.uint16)
+        divisor = np.uint64(10 ** DECIMAL_GROUP)
+        k = nchunks
+        quotients = limbs
+        while bits > 64 and k > 0:
+            # long division of the limbs, until the quotients fit in uint64
+            quotients = quotients.copy()
+            rem = np.zeros(n, dtype=np.uint64)
+            for i in range(limbs.shape[1]):
+                cur = (rem << np.uint64(LIMB_BITS)) | quotients[:, i]
+                quotients[:, i] = cur // divisor
+                rem = cur - quotients[:, i] * divisor
+            k -= 1
+            chunks[:, k] = rem
+            # 10**4 > 2**13
+            bits -= 13
+        value = np.zeros(n, dtype=np.uint64)
+        for i in range(quotients.shape[1]):
+            value = (value << np.uint64(LIMB_BITS)) | quotients[:, i]
+        # two groups per uint64 division, split in uint32
+        pair = np.uint64(10 ** (2 * DECIMAL_GROUP))
+        while k >= 2:
+            q = value // pair
+            r = (value - q * pair).astype(np.uint32)
+            high = r // np.uint32(10 ** DECIMAL_GROUP)
+            chunks[:, k - 1] = r - high * np.uint32(10 ** DECIMAL_GROUP)
+            chunks[:, k - 2] = high
+            value = q
+            k -= 2
+        if k == 1:
+            chunks[:, 0] = value
+        return chunks
+
+    @classmethod
+    def get_ndigits(cls, base, bits):
+        """
+        Return: the digits in base of the widest value of bits bits
+        """
+        if base == 10:
+            return len(str((1 << bits) - 1))
+        digit_bits = cls.CHUNK_BITS[base] // cls.CHUNK_DIGITS[base]
+        return (bits + digit_bits - 1) // digit_bits
+
+    @classmethod
+    def get_digits(cls, limbs, base, bits, spaces, significant):
+        """
+        limbs: the uint64 matrix of the values in LIMB_BITS-bit limbs, the most significant first
+        bits: the width of the values
+        spaces: the leading zeros (NUL characters for base 256) are replaced by spaces
+        significant: count the significant characters
+        Return: (chars, significant), the uint8 matrix of the characters of the values in base
+        (the bytes for 256), the most significant first, get_ndigits of them, and the number of
+        their significant characters (at least 1, except for 256), None if not counted
+        """
+        n = limbs.shape[0]
+        ndigits = cls.get_ndigits(base, bits)
+        nchunks = (ndigits + cls.CHUNK_DIGITS[base] - 1) // cls.CHUNK_DIGITS[base]
+        if base == 10:
+            chunks = cls.get_decimal_chunks(limbs, bits, nchunks)
+        else:
+            chunk_bits = cls.CHUNK_BITS[base]
+            # the limb and the shift of every chunk, the most significant first
+            positions = np.arange(nchunks - 1, -1, -1) * chunk_bits
+            columns = limbs.shape[1] - 1 - positions // LIMB_BITS
+            shifts = (positions % LIMB_BITS).astype(np.uint64)
+            chunks = (limbs[:, columns] >> shifts) & np.uint64((1 << chunk_bits) - 1)
+        if base == 256:
+            chars = chunks.astype(np.uint8)
+            nonzero = chars != 0
+            count = nchunks - np.where(nonzero.any(axis=1), nonzero.argmax(axis=1), nchunks)
+            if spaces:
+                chars = np.where(np.arange(nchunks) < (nchunks - count)[:, np.newaxis], np.uint8(ord(' ')), chars)
+            return (chars, count)
+        digits = cls.CHUNK_DIGITS[base]
+        table, lengths = cls.get_digit_tables(base)
+        chunks = chunks.astype(np.intp)
+        count = None
+        if spaces or significant:
+            # the first significant chunk, the last one for 0
+            nonzero = chunks != 0
+            nonzero[:, -1] = True
+            first = nonzero.argmax(axis=1)
+        if significant:
+            count = (nchunks - 1 - first) * digits + lengths[chunks[np.arange(n), first]]
+        if spaces:
+            column = np.arange(nchunks)
+            variant = (column < first[:, np.newaxis]) * 2 + (column == first[:, np.newaxis])
+            chunks = chunks + variant * len(lengths)
+        chars = np.ascontiguousarray(table[chunks]).view(np.uint8).reshape(n, nchunks * digits)
+        return (chars[:, nchunks * digits - ndigits:], count)
+
+    def render_arg(self, spec, min_width, left, limbs, bits):
+        """
+        Return: (chars, keep), the uint8 matrix of the characters of the arg and the bool matrix
+        of the characters kept, None if all of them are
+        """
+        base, fill = self.SPECIFIERS[spec]
+        n = limbs.shape[0]
+        if min_width <= 1:
+            # not padded, see DisplayRenderer.compile_spec
+            min_width = 0
+        if spec == 'c':
+            chars = (limbs[:, -1:] & np.uint64(0xff)).astype(np.uint8)
+            significant = np.ones(n, dtype=np.int64)
+        else:
+            # the width of the values only varies when they are narrower than min_width
+            chars, significant = self.get_digits(limbs, base, bits, fill == ' ' and not left,
+                                                 left or min_width < self.get_ndigits(base, bits))
+        width = chars.shape[1]
+        if left:
+            significant = significant[:, np.newaxis]
+            # the significant characters, then spaces up to min_width
+            visible = np.maximum(significant, min_width)
+            pad = np.full((n, min_width), ord(' '), dtype=np.uint8)
+            keep = np.hstack([np.arange(width) >= width - significant,
+                              np.arange(min_width) < visible - significant])
+            return (np.hstack([chars, pad]), keep)
+        total = max(width, min_width)
+        if total > width:
+            chars = np.hstack([np.full((n, total - width), ord(fill), dtype=np.uint8), chars])
+        if min_width >= width:
+            return (chars, None)
+        return (chars, np.arange(total) >= total - np.maximum(significant[:, np.newaxis], min_width))
+
+    def render(self, columns):
+        """
+        columns: (limbs, width) of every display arg, see VectorizedDecoder.get_limbs
+        Return: the pieces of the lines, every line ends with a newline. A piece is (chars, keep),
+        the characters (a vector for the text, the same in every line, otherwise a uint8 matrix
+        with one row per line), and the bool matrix of the characters kept (None if all of
+        them are).
+        """
+        pieces = []
+        arg = 0
+        for piece in self.renderer.specs + ['\n']:
+            if isinstance(piece, str):
+                if len(piece) > 0:
+                    pieces.append((np.frombuffer(piece.encode('latin-1'), dtype=np.uint8), None))
+                continue
+            spec, min_width, left, _, _ = piece
+            limbs, bits = columns[arg]
+            pieces.append(self.render_arg(spec, min_width, left, limbs, bits))
+            arg += 1
+        return pieces
+
+
+class VectorizedDecoder(object):
+    CHUNK_SIZE = 65536
+
+    def __init__(self, layout, data_bits):
+        self.layout = layout
+        self.data_bits = data_bits
+        self.nbytes = (data_bits + 7) // 8
+        # the samples are padded to whole bytes at the MSB, the padding is never read
+        self.pad = self.nbytes * 8 - data_bits
+        # the repeat field of the delta encoding is the last one of the sample
+        self.delta_width = layout.delta_width or 0
+        self.bits = data_bits - self.delta_width
+
+    def load(self, raw_values):
+        """
+        Return: the uint8 matrix of the samples, one row per sample
+        """
+        return np.frombuffer(b"".join(raw_values), dtype=np.uint8).reshape(-1, self.nbytes)
+
+    def get_piece(self, m, start, width):
+        """
+        Return: the uint64 column of the width (<= PIECE_BITS) bits starting at start (from the MSB)
+        """
+        start += self.pad
+        first = start // 8
+        last = (start + width - 1) // 8
+        acc = np.zeros(m.shape[0], dtype=np.uint64)
+        for b in range(first, last + 1):
+            acc = (acc << np.uint64(8)) | m[:, b].astype(np.uint64)
+        acc >>= np.uint64((last + 1) * 8 - start - width)
+        return acc & np.uint64((1 << width) - 1)
+
+    def get_values(self, m, start, width, offsets=None):
+        """
+        Return: the field of every sample of m as a list of python ints, plus offsets if given
+        """
+        column = self.get_piece(m, start, min(width, PIECE_BITS))
+        if width <= PIECE_BITS:
+            if offsets is not None:
+                column = column + offsets
+            return column.tolist()
+        # wider fields are assembled from pieces
+        values = column.tolist()
+        pos = start + PIECE_BITS
+        while pos < start + width:
+            w = min(PIECE_BITS, start + width - pos)
+            values = [(v << w) | p for v, p in zip(values, self.get_piece(m, pos, w).tolist())]
+            pos += w
+        if offsets is not None:
+            values = [v + o for v, o in zip(values, offsets.tolist())]
+        return values
+
+    def get_limbs(self, m, start, width, offsets=None):
+        """
+        Return: (limbs, bits), the field of every sample of m plus offsets if given, as the uint64
+        matrix of its LIMB_BITS-bit limbs (the most significant first), and the bits of the values
+        """
+        limbs = []
+        pos = start + width
+        while pos > start:
+            w = min(LIMB_BITS, pos - start)
+            limbs.append(self.get_piece(m, pos - w, w))
+            pos -= w
+        if len(limbs) == 0:
+            limbs.append(np.zeros(m.shape[0], dtype=np.uint64))
+        bits = width
+        if offsets is not None and len(offsets) > 0 and offsets.max() > 0:
+            # the carries of the offsets may need one more limb
+            bits = max(width, int(offsets.max()).bit_length()) + 1
+            limbs.append(np.zeros(m.shape[0], dtype=np.uint64))
+            mask = np.uint64((1 << LIMB_BITS) - 1)
+            carry = offsets
+            for k in range(len(limbs)):
+                total = limbs[k] + carry
+                limbs[k] = total & mask
+                carry = total >> np.uint64(LIMB_BITS)
+        return (np.stack(limbs[::-1], axis=1), bits)
+
+    def expand_repeats(self, m, previous):
+        """
+        Replay the samples skipped by the delta encoding.
+        previous: the last row of the previous chunk, or None
+        Return: (matrix of all samples, uint64 column of the cycles after the recorded sample)
+        """
+        n = m.shape[0]
+        repeat = self.get_piece(m, self.bits, self.delta_width).astype(np.int64)
+        if previous is None:
+            repeat[0] = 0
+        else:
+            m = np.vstack([previous[np.newaxis, :], m])
+        # sample j of the chunk is preceded by repeat[j] copies of the row before it
+        sizes = repeat + 1
+        starts = np.cumsum(sizes) - sizes
+        pos = np.arange(int(sizes.sum())) - np.repeat(starts, sizes)
+        sample = np.repeat(np.arange(n), sizes)
+        is_repeat = pos < np.repeat(repeat, sizes)
+        rows = sample + (0 if previous is None else 1) - is_repeat
+        offsets = np.where(is_repeat, pos + 1, 0).astype(np.uint64)
+        return (m[rows], offsets)
+
+    def get_fired(self, m):
+        """
+        Return: (sample indices, condition indices) of the recorded displays, ordered by
+        sample then by condition
+        """
+        layout = self.layout
+        n = m.shape[0]
+        if layout.cond_groups != None:
+            dropped = self.get_piece(m, layout.cond_tag_width, 1)
+            for i in np.nonzero(dropped)[0]:
+                print('Warning: some displays were dropped before this sample')
+            return (np.arange(n), self.get_piece(m, 0, layout.cond_tag_width).astype(np.int64))
+        if layout.cond_slots == None:
+            # all the condition bits at once
+            cond_bytes = (self.pad + layout.cond_num + 7) // 8
+            bits = np.unpackbits(m[:, :cond_bytes], axis=1)[:, self.pad:self.pad + layout.cond_num]
+            return np.nonzero(bits)
+        samples = []
+        conds = []
+        overflows = []
+        pos = 0
+        for slot, (id_width, cids) in enumerate(layout.cond_slots):
+            cond_id = self.get_piece(m, pos, id_width).astype(np.int64)
+            fired = np.nonzero(cond_id)[0]
+            samples.append(fired)
+            conds.append(np.array(cids, dtype=np.int64)[cond_id[fired] - 1])
+            overflows.append((slot, self.get_piece(m, pos + id_width, 1), cond_id))
+            pos += id_width + 1
+        for i in np.nonzero(np.any([o for _, o, _ in overflows], axis=0))[0]:
+            for slot, overflow, cond_id in overflows:
+                if overflow[i]:
+                    print('Warning: more than one display condition fired in slot {}, only condition {} is recorded'.format(
+                        slot, layout.cond_slots[slot][1][cond_id[i]-1]))
+        samples = np.concatenate(samples)
+        conds = np.concatenate(conds)
+        order = np.lexsort((conds, samples))
+        return (samples[order], conds[order])
+
+    def decode_chunk(self, m, offsets, selected_conds=None):
+        """
+        selected_conds: the uint array of the condition indices to decode, all of them if None
+        Return: the displays of the samples of m as ([cycle counter or None], [condition index],
+        [(display arg values)]), see SampleDecoder.iter_displays
+        """
+        layout = self.layout
+        samples, conds = self.get_fired(m)
+        if selected_conds is not None:
+            keep = np.isin(conds, selected_conds)
+            samples = samples[keep]
+            conds = conds[keep]
+        counters = [None] * len(samples)
+        if layout.counter_width != None:
+            counters = self.get_values(m[samples], self.bits - layout.counter_width,
+                    layout.counter_width, offsets[samples])
+        args = [None] * len(samples)
+        # the args of every condition are extracted from the samples it fired in
+        for cond_index in np.unique(conds).tolist():
+            selected = np.nonzero(conds == cond_index)[0]
+            rows = samples[selected]
+            sub = m[rows]
+            columns = []
+            for name in layout.displays[cond_index][1]:
+                width, start = layout.get_arg_field(cond_index, name)
+                columns.append(self.get_values(sub, start, width,
+                        offsets[rows] if name == layout.counter_name else None))
+            if len(columns) == 0:
+                values = [()] * len(selected)
+            else:
+                values = zip(*columns)
+            for k, v in zip(selected.tolist(), values):
+                args[k] = v
+        return (counters, conds.tolist(), args)
+
+    def render_chunk(self, m, offsets, renderers, selected_conds=None):
+        """
+        renderers: the VectorizedRenderer of every condition
+        Return: the displayed lines of the samples of m, in the order of decode_chunk
+        """
+        layout = self.layout
+        samples, conds = self.get_fired(m)
+        if selected_conds is not None:
+            keep = np.isin(conds, selected_conds)
+            samples = samples[keep]
+            conds = conds[keep]
+        if len(samples) == 0:
+            return ''
+        # the lines of every condition are built as one matrix, padded to the longest line of
+        # the chunk (the padding is not kept), then the rows are put in the order of the displays
+        lines = []
+        for cond_index in np.flatnonzero(np.bincount(conds)).tolist():
+            selected = np.nonzero(conds == cond_index)[0]
+            rows = samples[selected]
+            sub = m[rows]
+            columns = []
+            for name in layout.displays[cond_index][1]:
+                width, start = layout.get_arg_field(cond_index, name)
+                columns.append(self.get_limbs(sub, start, width,
+                        offsets[rows] if name == layout.counter_name else None))
+            pieces = renderers[cond_index].render(columns)
+            lines.append((selected, pieces, sum(chars.shape[-1] for chars, _ in pieces)))
+        width = max(line_width for _, _, line_width in lines)
+        masked = any(line_width < width or any(keep is not None for _, keep in pieces)
+                     for _, pieces, line_width in lines)
+        matrices = []
+        masks = []
+        for selected, pieces, line_width in lines:
+            chars = np.zeros((len(selected), width), dtype=np.uint8)
+            kept = np.ones(chars.shape, dtype=bool) if masked else None
+            pos = 0
+            for piece, keep in pieces:
+                chars[:, pos:pos + piece.shape[-1]] = piece
+                if keep is not None:
+                    kept[:, pos:pos + piece.shape[-1]] = keep
+                pos += piece.shape[-1]
+            if masked:
+                kept[:, line_width:] = False
+            matrices.append(chars)
+            masks.append(kept)
+        if len(lines) == 1:
+            out, kept = matrices[0], masks[0]
+        else:
+            # the row of every display in the stacked matrices
+            order = np.empty(len(samples), dtype=np.intp)
+            order[np.concatenate([selected for selected, _, _ in lines])] = np.arange(len(samples))
+            out = np.vstack(matrices).take(order, axis=0)
+            kept = np.vstack(masks).take(order, axis=0) if masked else None
+        out = out.ravel() if kept is None else out[kept]
+        return out.tobytes().decode('latin-1')
+
+    def iter_chunks(self, raw_values):
+        chunk = []
+        for data in raw_values:
+            chunk.append(data)
+            if len(chunk) == self.CHUNK_SIZE:
+                yield self.load(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            yield self.load(chunk)
+
+    def iter_expanded(self, chunks):
+        """
+        chunks: the sample matrices, see iter_chunks and iter_sample_chunks
+        Yield: (m, offsets) with the samples skipped by the delta encoding, see expand_repeats
+        """
+        previous = None
+        for m in chunks:
+            if self.delta_width > 0:
+                last = m[-1]
+                m, offsets = self.expand_repeats(m, previous)
+                previous = last
+            else:
+                offsets = np.zeros(m.shape[0], dtype=np.uint64)
+            yield (m, offsets)
+
+    def iter_displays(self, raw_values, conds=None, chunks=None):
+        """
+        raw_values: the recorded samples in big-endian bytes, see TraceBuffer.iter_raw
+        chunks: the sample matrices instead of raw_values, see iter_sample_chunks
+        Yield: see SampleDecoder.iter_displays
+        """
+        if conds != None:
+            conds = np.array(sorted(conds), dtype=np.int64)
+        if chunks == None:
+            chunks = self.iter_chunks(raw_values)
+        for m, offsets in self.iter_expanded(chunks):
+            counters, cond_indices, args = self.decode_chunk(m, offsets, conds)
+            for display in zip(counters, cond_indices, args):
+                yield display
+
+    def iter_rendered(self, chunks, renderers, conds=None):
+        """
+        chunks: the sample matrices, see iter_sample_chunks
+        Yield: the displayed lines of every chunk, see render_chunk
+        """
+        if conds != None:
+            conds = np.array(sorted(conds), dtype=np.int64)
+        for m, offsets in self.iter_expanded(chunks):
+            yield self.render_chunk(m, offsets, renderers, conds)
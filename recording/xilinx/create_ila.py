@@ -5,71 +5,128 @@ Created on Wed May  5 17:17:09 2021
 @author: Haoyang Zhang
 """
 
+import os
+import re
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tracedecoder.buffer import BinaryTraceBuffer
+from tracedecoder.layout import get_manifest_hash
+
+# usage: create_ila.py <tcl> <depth> [text|binary] [manifest prefix]
+# One emulated module "<ila name>_emulated" is generated per ILA of the tcl script (one per clock
+# domain with --tasksupport-multi-clock). It records the data probes in the cycles where all the
+# trigger probes (the storage enable) are set, to the buffer named by the "# buffer:" comment of
+# the ILA (w_buffer by default):
+# text: the samples are written to <buffer>.txt with $fdisplay
+# binary: the samples are written to <buffer>.bin with $fwrite, see tracedecoder.BinaryTraceBuffer.
+#   The header records the hash of the manifests <manifest prefix>[.<clock>].*info.txt if it is given.
+# depth is used when the tcl script does not set CONFIG.C_DATA_DEPTH.
 name = sys.argv[1]
 depth = int(sys.argv[2])
+buffer_format = sys.argv[3] if len(sys.argv) > 3 else 'text'
+manifest_prefix = sys.argv[4] if len(sys.argv) > 4 else None
+assert(buffer_format in ('text', 'binary'))
+
+PROPERTY = re.compile(r'CONFIG\.(\w+) \{([^}]*)\}')
+# the probes of this type only trigger (capture control), see utils/XilinxILA.py
+PROBE_TYPE_TRIGGER = 2
+DEFAULT_BUFFER = 'w_buffer'
+
+
+def parse_tcl(path):
+    """
+    Return: [(ila name, {property => value}, buffer name)], one per ILA
+    """
+    instances = []
+    with open(path) as fp_tcl:
+        for line in fp_tcl:
+            line = line.strip()
+            if line.startswith('set_property'):
+                ila_name = line.split('[get_ips ')[1].split(']')[0]
+                instances.append([ila_name, dict(PROPERTY.findall(line)), DEFAULT_BUFFER])
+            elif line.startswith('# buffer:') and len(instances) > 0:
+                instances[-1][2] = line.split(':', 1)[1].strip()
+    return instances
+
+
+def write_emulated_ila(ila_name, props, buffer_name):
+    """
+    Write <ila name>_emulated.v
+    Return: the file name
+    """
+    probe_num = int(props['C_NUM_OF_PROBES'])
+    probe_width_list = [int(props['C_PROBE{}_WIDTH'.format(i)]) for i in range(probe_num)]
+    probe_type_list = [int(props.get('C_PROBE{}_TYPE'.format(i), 0)) for i in range(probe_num)]
+    data_probes = ['probe' + str(i) for i in range(probe_num) if probe_type_list[i] != PROBE_TYPE_TRIGGER]
+    trigger_probes = ['probe' + str(i) for i in range(probe_num) if probe_type_list[i] == PROBE_TYPE_TRIGGER]
+    data_in_bits = sum(probe_width_list[i] for i in range(probe_num) if probe_type_list[i] != PROBE_TYPE_TRIGGER)
+    sample_depth = int(props.get('C_DATA_DEPTH', depth))
+    mod_name = ila_name + '_emulated'
+    file_name = mod_name + '.v'
+
+    fp_write = open(file_name, 'w')
+    fp_write.write('module ' + mod_name + ' (\n')
+    fp_write.write('    input clk\n')
+
+    for i in range(probe_num):
+        if probe_width_list[i]==1:
+            line = '  , input ' + 'probe' + str(i) + '\n'
+        else:
+            line = '  , input [' + str(probe_width_list[i]-1) + ':' + str(0) +'] probe' + str(i) + '\n'
+        fp_write.write(line)
+
+    fp_write.write(');\n')
+    fp_write.write('\n')
+    fp_write.write('    integer buffer;\n')
+    fp_write.write('    initial begin\n')
+    if buffer_format == 'binary':
+        manifest_hash = 0
+        if manifest_prefix != None:
+            # w_buffer.<clock> is recorded with the manifests <prefix>.<clock>
+            prefix = manifest_prefix + buffer_name[len(DEFAULT_BUFFER):]
+            if os.path.exists(prefix + '.displayinfo.txt'):
+                manifest_hash = get_manifest_hash(prefix)
+        # the header words, the first one is written first
+        header = [int.from_bytes(BinaryTraceBuffer.MAGIC, 'little'), BinaryTraceBuffer.VERSION,
+                  data_in_bits, sample_depth, manifest_hash & 0xffffffff, manifest_hash >> 32]
+        header = ', '.join(["32'h{:08x}".format(word) for word in reversed(header)])
+        fp_write.write('        buffer = $fopen("' + buffer_name + '.bin", "wb");\n')
+        fp_write.write('        $fwrite(buffer, "%u", {' + header + '});\n')
+    else:
+        fp_write.write('        buffer = $fopen("' + buffer_name + '.txt");\n')
+        fp_write.write('        $fdisplay(buffer, "%d %d", ' + str(data_in_bits) + ', ' + str(sample_depth) +');\n')
+    fp_write.write('    end\n')
+    fp_write.write('\n')
+
+    fp_write.write('    always @(negedge clk) begin\n')
+    data_in = '{' + ', '.join(data_probes) + '}'
+    enable = ' && '.join(trigger_probes) if len(trigger_probes) > 0 else "1'b1"
+    fp_write.write('        if (' + enable + ') begin\n')
+    if buffer_format == 'binary':
+        # {trigger, data} in little-endian 32-bit words
+        fp_write.write('            $fwrite(buffer, "%u", {1\'b1, '+ data_in +'});\n')
+    else:
+        fp_write.write('            $fdisplay(buffer, "%b %h", 1\'b1, '+ data_in +');\n')
+    fp_write.write('        end\n')
+    fp_write.write('    end\n')
+    fp_write.write('\n')
+    fp_write.write('\n')
+    fp_write.write('endmodule\n')
+    fp_write.close()
+    return file_name
 
 
 fp_instru = open('instrumented.txt')
-fp_tcl = open(name)
-fp_write = open('ila_0_emulated.v', 'w')
-
-
-tclfile = fp_tcl.readline()
-tclfile = fp_tcl.read()
-tclfile = tclfile.split('[')[1]
-tclfile = tclfile.split(']')[0]
-tclfile = tclfile.split('CONFIG.C_NUM_OF_PROBES {')[1]
-probe_num_str = tclfile.split('}')[0]
-probe_num = int(probe_num_str)
-tclfile = tclfile.split(probe_num_str+'} ')[1]
-tcl_list = tclfile.split(' ')
-
-
-probe_width_list = []
-data_in_bits = 0
-for i in range(probe_num):
-    width = int(tcl_list[6*i+1][1:len(tcl_list[6*i+1])-1])
-    data_in_bits += width
-    probe_width_list.append(width)
-
-
-fp_write.write('module ila_0_emulated (\n')
-fp_write.write('    input clk\n')
-
-for i in range(probe_num):
-    if probe_width_list[i]==1:
-        line = '  , input ' + 'probe' + str(i) + '\n'
-    else:
-        line = '  , input [' + str(probe_width_list[i]-1) + ':' + str(0) +'] probe' + str(i) + '\n'
-    fp_write.write(line)
-
-fp_write.write(');\n')
-fp_write.write('\n')
-fp_write.write('    integer buffer;\n')
-fp_write.write('    initial begin\n')
-fp_write.write('        buffer = $fopen("w_buffer.txt");\n')
-fp_write.write('        $fdisplay(buffer, "%d %d", ' + str(data_in_bits) + ', ' + str(depth) +');\n')
-fp_write.write('    end\n')
-fp_write.write('\n')
-
-fp_write.write('    always @(negedge clk) begin\n')
-data_in = '{'
-for i in range(probe_num-1):
-    data_in += 'probe' + str(i) +', '
-data_in += 'probe' + str(probe_num-1) + '}'
-fp_write.write('        $fdisplay(buffer, "%b %h", 1\'b1, '+ data_in +');\n')
-fp_write.write('    end\n')
-fp_write.write('\n')
-fp_write.write('\n')
-fp_write.write('endmodule\n')
-
-instru = ''
 instru = fp_instru.read()
-instru_w = instru + 'ila_0_emulated.v\n'
 fp_instru.close()
+sources = instru.split()
+instru_w = instru
+for ila_name, props, buffer_name in parse_tcl(name):
+    file_name = write_emulated_ila(ila_name, props, buffer_name)
+    if not file_name in sources:
+        instru_w += file_name + '\n'
 print('The verilog file for ila generated successfully!')
 
 fp_instru_w = open('instrumented.txt','w')
-fp_instru_w.write(instru_w)
\ No newline at end of file
+fp_instru_w.write(instru_w)
@@ -9,8 +9,10 @@ from dbgtools.sv2v import sv2v_regParser
 from dbgtools.fsm_detect import fsm_detect_regParser
 from dbgtools.deps import deps_regParser
 from dbgtools.autocnt import autocnt_regParser
+from dbgtools.sweep import sweep_regParser
 from passes.common import PassManager
 from passes.VerilatorReTagPass import VerilatorReTagPass
+from utils.CostEstimator import CostEstimator
 from jinja2 import Environment, FileSystemLoader
 
 def output_regParser(subparsers):
@@ -44,6 +46,21 @@ def output_entry(args, ast):
         with open(args.output+".widthinfo.txt", 'w+') as f:
             for varname in ast.displayarg_width:
                 f.write("{} {}\n".format(varname, ast.displayarg_width[varname]))
+    if hasattr(ast, "traceinfo"):
+        with open(args.output+".traceinfo.txt", 'w+') as f:
+            for line in ast.traceinfo:
+                f.write("{}\n".format(line))
+    if hasattr(ast, "clock_domains"):
+        for clock, manifests in ast.clock_domains.items():
+            with open(args.output+"."+clock+".displayinfo.txt", 'w+') as f:
+                for condname in manifests["condname2display"]:
+                    f.write("{} {}\n".format(condname, manifests["condname2display"][condname]))
+            with open(args.output+"."+clock+".widthinfo.txt", 'w+') as f:
+                for varname in manifests["displayarg_width"]:
+                    f.write("{} {}\n".format(varname, manifests["displayarg_width"][varname]))
+            with open(args.output+"."+clock+".traceinfo.txt", 'w+') as f:
+                for line in manifests["traceinfo"]:
+                    f.write("{}\n".format(line))
 
 parser = argparse.ArgumentParser(description="A collection of tools for FPGA debugging")
 parser.add_argument("--top", dest="top_module", help="top module name")
@@ -58,17 +75,23 @@ parser.add_argument("--config-override", type=str, default="{}", help="A json st
 parser.add_argument("--reset", default=None, type=str, help="Specify the reset identifier (e.g. RESET or !RESETN)")
 parser.add_argument("--recording-emulated", default=False, action="store_true", help="Use the emulated data recording implementation. (default=False)")
 parser.add_argument("--not-retag-synthesis", action="store_true", help="Do not retag \"synthesis\" metacommands. Should be used to generate synthesizable code. (default=False)")
+parser.add_argument("--cost-report", type=str, default=None, help="Write the estimated hardware cost of the instrumentation to this json file")
 subparsers = parser.add_subparsers(title="Available FPGA debugging tools")
 sv2v_regParser(subparsers)
 fsm_detect_regParser(subparsers)
 deps_regParser(subparsers)
 autocnt_regParser(subparsers)
+sweep_regParser(subparsers)
 output_regParser(subparsers)
 args = parser.parse_args()
 print("Top Module: {}".format(args.top_module))
 print("Desc File: {}".format(args.desc_file))
 print("Output Path: {}".format(args.output))
 
+# shared by all tool subcommands, including the ones from the config file
+cost_estimator = CostEstimator() if args.cost_report else None
+args.cost_estimator = cost_estimator
+
 v = Verilator(top_module_name=args.top_module, desc_file=args.desc_file, files=args.files)
 ast = v.get_ast()
 
@@ -83,7 +106,13 @@ if args.config:
             continue
         conf_args = copy.deepcopy(args)
         parser.parse_args(shlex.split(cmdline), namespace=conf_args)
+        conf_args.cost_estimator = cost_estimator
         conf_args.toolEntry(conf_args, ast)
 else:
     args.toolEntry(args, ast)
-    output_entry(args, ast)
+    # sweep writes its own outputs
+    if args.output:
+        output_entry(args, ast)
+
+if cost_estimator != None:
+    cost_estimator.write(args.cost_report)
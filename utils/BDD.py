@@ -0,0 +1,216 @@
+import pyverilog.vparser.ast as vast
+from pyverilog.ast_code_generator.codegen import ASTCodeGenerator
+
+from utils.common import ASTNodeVisitor
+from functools import reduce
+
+import sys
+
+"""
+A small reduced ordered binary decision diagram (ROBDD) package in pure Python.
+Used by TaskSupportPass to canonicalize and simplify the path constraints of
+display tasks, instead of SymPy.
+
+BDD nodes are integers, 0 is false and 1 is true. Nodes are hash-consed in a
+unique table, so two boolean functions are equivalent if and only if they are
+the same node. Variables are ordered by creation order.
+"""
+
+class BDD(object):
+    FALSE = 0
+    TRUE = 1
+
+    def __init__(self):
+        # node => (variable level, low child, high child)
+        # the terminals are below all variables
+        self.nodes = [(sys.maxsize, None, None), (sys.maxsize, None, None)]
+        # (variable level, low, high) => node
+        self.unique = {}
+        # variable level => name
+        self.var_names = []
+        # name => variable node
+        self.vars = {}
+        # (f, g, h) => node
+        self.ite_cache = {}
+        # (L, U) => (cover, node)
+        self.isop_cache = {}
+
+    def level(self, u):
+        return self.nodes[u][0]
+
+    def mk(self, level, low, high):
+        if low == high:
+            return low
+        key = (level, low, high)
+        if key in self.unique:
+            return self.unique[key]
+        u = len(self.nodes)
+        self.nodes.append(key)
+        self.unique[key] = u
+        return u
+
+    def var(self, name):
+        """
+        Return: the node of variable name, created (as the last one in the
+        variable order) if it does not exist yet
+        """
+        if not name in self.vars:
+            level = len(self.var_names)
+            self.var_names.append(name)
+            self.vars[name] = self.mk(level, self.FALSE, self.TRUE)
+        return self.vars[name]
+
+    def cofactors(self, u, level):
+        if self.level(u) != level:
+            return (u, u)
+        l, low, high = self.nodes[u]
+        return (low, high)
+
+    def ite(self, f, g, h):
+        """
+        Return: the node of (f ? g : h)
+        """
+        if f == self.TRUE:
+            return g
+        if f == self.FALSE:
+            return h
+        if g == h:
+            return g
+        if g == self.TRUE and h == self.FALSE:
+            return f
+        key = (f, g, h)
+        if key in self.ite_cache:
+            return self.ite_cache[key]
+        level = min(self.level(f), self.level(g), self.level(h))
+        f0, f1 = self.cofactors(f, level)
+        g0, g1 = self.cofactors(g, level)
+        h0, h1 = self.cofactors(h, level)
+        r = self.mk(level, self.ite(f0, g0, h0), self.ite(f1, g1, h1))
+        self.ite_cache[key] = r
+        return r
+
+    def neg(self, f):
+        return self.ite(f, self.FALSE, self.TRUE)
+
+    def conj(self, f, g):
+        return self.ite(f, g, self.FALSE)
+
+    def disj(self, f, g):
+        return self.ite(f, self.TRUE, g)
+
+    def isop(self, L, U):
+        """
+        Minato-Morreale irredundant sum-of-products of a function f, L <= f <= U.
+        Return: (cover, node)
+            cover: list of cubes, a cube is a tuple of (variable level, polarity)
+            node: the node of the function described by cover
+        """
+        if L == self.FALSE:
+            return ([], self.FALSE)
+        if U == self.TRUE:
+            return ([()], self.TRUE)
+        key = (L, U)
+        if key in self.isop_cache:
+            return self.isop_cache[key]
+        level = min(self.level(L), self.level(U))
+        L0, L1 = self.cofactors(L, level)
+        U0, U1 = self.cofactors(U, level)
+        # the cubes that need the variable to be 0, or 1
+        c0, f0 = self.isop(self.conj(L0, self.neg(U1)), U0)
+        c1, f1 = self.isop(self.conj(L1, self.neg(U0)), U1)
+        # the rest is covered by cubes without the variable
+        Ld = self.disj(self.conj(L0, self.neg(f0)), self.conj(L1, self.neg(f1)))
+        cd, fd = self.isop(Ld, self.conj(U0, U1))
+        cover = ([((level, False),) + c for c in c0] +
+                [((level, True),) + c for c in c1] + cd)
+        x = self.mk(level, self.FALSE, self.TRUE)
+        r = (cover, self.disj(self.ite(x, f1, f0), fd))
+        self.isop_cache[key] = r
+        return r
+
+    def get_cover(self, u):
+        """
+        Return: an irredundant sum-of-products of u, see isop()
+        """
+        return self.isop(u, u)[0]
+
+    def stats(self):
+        return "BDD: {} variables, {} nodes".format(len(self.var_names), len(self.nodes))
+
+
+class CondASTToBDDVisitor(ASTNodeVisitor):
+    """
+    CondASTToBDDVisitor converts a pyverilog boolean condition (in if-statements) to a BDD node.
+    Like CondASTToSymPyVisitor, pyverilog identifiers and non-boolean expressions are mapped to
+    unique BDD variables, and the reverse mapping is available as "self.rvarmap".
+    .visit(node) returns the BDD node
+    """
+
+    def __init__(self, bdd):
+        super().__init__(self.visit_generic)
+        self.bdd = bdd
+        # str => BDD variable name for vast.Identifier and non-boolean expressions (using codegen for expression equalitiy)
+        self.varmap = {}
+        # BDD variable level => vast.Node
+        self.rvarmap = {}
+        self.allowed_nonboolean = set([
+            vast.Pointer, vast.Cond, vast.Operator, vast.Partselect
+        ])
+        self.codegen = ASTCodeGenerator()
+        self.nonboolean_cnt = 0
+
+    def get_var(self, key, name, node):
+        name = self.varmap.setdefault(key, name)
+        u = self.bdd.var(name)
+        self.rvarmap.setdefault(self.bdd.level(u), node)
+        return u
+
+    def visit_Land(self, node):
+        return self.bdd.conj(self.visit(node.left), self.visit(node.right))
+
+    def visit_Lor(self, node):
+        return self.bdd.disj(self.visit(node.left), self.visit(node.right))
+
+    def visit_Ulnot(self, node):
+        return self.bdd.neg(self.visit(node.right))
+
+    def visit_Identifier(self, node):
+        return self.get_var(node.name, node.name, node)
+
+    def get_nonboolean_varname(self):
+        self.nonboolean_cnt += 1
+        return "nonboolean_{}".format(self.nonboolean_cnt)
+
+    def visit_generic(self, node):
+        for cl in node.__class__.mro():
+            if cl in self.allowed_nonboolean:
+                code = self.codegen.visit(node)
+                if code in self.varmap:
+                    return self.get_var(code, None, node)
+                return self.get_var(code, self.get_nonboolean_varname(), node)
+        raise NotImplementedError("Cannot find a fallback function")
+
+
+class CondBDDToASTVisitor(object):
+    """
+    CondBDDToASTVisitor converts a BDD node back to a pyverilog AST, as an irredundant
+    sum-of-products. It requires the reverse variable map generated by CondASTToBDDVisitor.
+    """
+
+    def __init__(self, bdd, rvarmap):
+        self.bdd = bdd
+        self.rvarmap = rvarmap
+
+    def visit(self, u):
+        if u == BDD.FALSE:
+            return vast.IntConst("1'b0")
+        if u == BDD.TRUE:
+            return vast.IntConst("1'b1")
+        products = []
+        for cube in self.bdd.get_cover(u):
+            literals = []
+            for level, polarity in cube:
+                var = self.rvarmap[level]
+                literals.append(var if polarity else vast.Ulnot(var))
+            products.append(reduce(vast.Land, literals))
+        return reduce(vast.Lor, products)
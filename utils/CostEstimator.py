@@ -0,0 +1,228 @@
+import pyverilog.vparser.ast as vast
+from passes.common import getWidth, getDimensions, getConstantWidth
+
+import json
+
+"""
+Estimate the hardware cost of the instrumentation before it is synthesized.
+
+Instrumentation passes report the module items they generate, grouped by the
+target signal they instrument. The estimator counts:
+1. register_bits: bits of the registers assigned by nonblocking assignments
+2. gates: LUT-ish 2-input gate equivalents, one per result bit of every logic,
+   arithmetic or mux operator. Inverters are considered free.
+3. comparators: the number of comparison operators (==, !=, <, ...)
+4. trace_bits: the width recorded by the SignalTapII or ILA instance
+5. bram_bits: the on-chip memory used to store the trace (trace_bits * depth)
+These are rough numbers meant to compare instrumentation options, not a
+replacement for the synthesis report.
+"""
+
+class CostEstimator(object):
+    COUNTERS = ("register_bits", "gates", "comparators", "trace_bits", "bram_bits")
+    # the operators whose result is 1 bit and counted as comparators
+    COMPARATORS = (vast.Eq, vast.NotEq, vast.Eql, vast.NotEql, vast.LessThan,
+            vast.GreaterThan, vast.LessEq, vast.GreaterEq)
+    # the operators whose result is 1 bit, the gates are counted on the operands
+    REDUCTIONS = (vast.Uand, vast.Unand, vast.Uor, vast.Unor, vast.Uxor, vast.Uxnor, vast.Ulnot)
+
+    def __init__(self):
+        # pass name => {target name => {counter => int}}
+        self.passes = {}
+        # pass name => set of register names already counted
+        self.registers = {}
+        # signal name => (width, number of elements), from the reported definitions
+        self.declared = {}
+
+    def get_target(self, pass_name, target):
+        targets = self.passes.setdefault(pass_name, {})
+        if not target in targets:
+            targets[target] = {c: 0 for c in self.COUNTERS}
+        return targets[target]
+
+    def add(self, pass_name, target, counter, value):
+        assert(counter in self.COUNTERS)
+        self.get_target(pass_name, target)[counter] += value
+
+    def add_recorder(self, pass_name, target, trace_bits, depth):
+        """
+        target records trace_bits bits in a recorder instance of the given depth
+        """
+        self.add(pass_name, target, "trace_bits", trace_bits)
+        self.add(pass_name, target, "bram_bits", trace_bits * depth)
+
+    def declare(self, node):
+        """
+        node is a vast.Variable, remember its width
+        """
+        width = 1
+        if node.width != None:
+            try:
+                width = getWidth(node.width)
+            except NotImplementedError:
+                pass
+        elements = 1
+        if node.dimensions != None:
+            try:
+                for d in getDimensions(node.dimensions):
+                    elements *= d
+            except NotImplementedError:
+                pass
+        self.declared[node.name] = (width, elements)
+
+    def get_width(self, node, width_fn=None):
+        """
+        Return: the estimated width of an expression, 1 if unknown
+        """
+        if width_fn != None:
+            try:
+                w = width_fn(node)
+                if w != None:
+                    return w
+            except (NotImplementedError, KeyError):
+                # WidthVisitor has no rule for the node, or no width for a generated signal
+                pass
+        if isinstance(node, vast.Identifier):
+            if node.name in self.declared:
+                width, elements = self.declared[node.name]
+                return width * elements
+            return 1
+        if isinstance(node, vast.Pointer):
+            if isinstance(node.var, vast.Identifier) and node.var.name in self.declared:
+                width, elements = self.declared[node.var.name]
+                # a bit-select on a vector, or an element of an array
+                return 1 if elements == 1 else width
+            return 1
+        if isinstance(node, vast.Partselect):
+            try:
+                return getWidth(node)
+            except NotImplementedError:
+                return 1
+        if isinstance(node, vast.Constant):
+            w = getConstantWidth(node)
+            return w if w != None else 1
+        if isinstance(node, self.COMPARATORS + self.REDUCTIONS + (vast.Land, vast.Lor)):
+            return 1
+        if isinstance(node, vast.Concat):
+            return sum(self.get_width(c, width_fn) for c in node.list)
+        if isinstance(node, vast.Repeat):
+            try:
+                times = int(node.times.value)
+            except (AttributeError, ValueError):
+                times = 1
+            return times * self.get_width(node.value, width_fn)
+        if isinstance(node, vast.Cond):
+            return max(self.get_width(node.true_value, width_fn), self.get_width(node.false_value, width_fn))
+        if isinstance(node, (vast.Sll, vast.Srl, vast.Sla, vast.Sra)):
+            return self.get_width(node.left, width_fn)
+        widths = [self.get_width(c, width_fn) for c in node.children()]
+        return max(widths) if len(widths) > 0 else 1
+
+    def count_expr(self, pass_name, target, node, width_fn=None):
+        """
+        Count the gates and comparators of an expression
+        """
+        if node == None or isinstance(node, (vast.Identifier, vast.Constant)):
+            return
+        if isinstance(node, self.COMPARATORS):
+            self.add(pass_name, target, "comparators", 1)
+            self.add(pass_name, target, "gates", max(
+                self.get_width(node.left, width_fn), self.get_width(node.right, width_fn)))
+        elif isinstance(node, self.REDUCTIONS):
+            self.add(pass_name, target, "gates", self.get_width(node.right, width_fn))
+        elif isinstance(node, vast.Operator) and not isinstance(node, (vast.Unot, vast.Uplus)):
+            self.add(pass_name, target, "gates", self.get_width(node, width_fn))
+        elif isinstance(node, vast.Pointer) and not isinstance(node.ptr, vast.Constant):
+            # a mux selecting one element
+            self.add(pass_name, target, "gates", self.get_width(node, width_fn))
+        for c in node.children():
+            self.count_expr(pass_name, target, c, width_fn)
+
+    @staticmethod
+    def unwrap(node):
+        """
+        Return: the expression of a parsed vast.Lvalue/vast.Rvalue, generated items use bare nodes
+        """
+        if isinstance(node, (vast.Lvalue, vast.Rvalue)):
+            return node.var
+        return node
+
+    def get_lvalue_name(self, node):
+        while isinstance(node, (vast.Lvalue, vast.Pointer, vast.Partselect)):
+            node = node.var
+        if isinstance(node, vast.Identifier):
+            return node.name
+        return None
+
+    def add_items(self, pass_name, target, items, width_fn=None):
+        """
+        Count the cost of generated module items or statements.
+        target: the name of the instrumented target the items belong to, or a
+            function mapping the name of an assigned signal to such a name
+        width_fn: optional function returning the width of a vast.Node or None
+        """
+        def get_target(lvalue):
+            if callable(target):
+                return target(self.get_lvalue_name(lvalue))
+            return target
+
+        for item in items:
+            if item == None:
+                continue
+            if isinstance(item, vast.Variable):
+                self.declare(item)
+            elif isinstance(item, vast.Assign):
+                self.count_expr(pass_name, get_target(item.left), self.unwrap(item.right), width_fn)
+            elif isinstance(item, vast.NonblockingSubstitution):
+                t = get_target(item.left)
+                name = self.get_lvalue_name(item.left)
+                counted = self.registers.setdefault(pass_name, set())
+                if name != None and not name in counted:
+                    counted.add(name)
+                    if name in self.declared:
+                        width, elements = self.declared[name]
+                        bits = width * elements
+                    else:
+                        bits = self.get_width(self.unwrap(item.left), width_fn)
+                    self.add(pass_name, t, "register_bits", bits)
+                self.count_expr(pass_name, t, self.unwrap(item.right), width_fn)
+            elif isinstance(item, vast.IfStatement):
+                statements = [s for s in (item.true_statement, item.false_statement) if s != None]
+                self.add_items(pass_name, target, statements, width_fn)
+                t = target
+                if callable(target):
+                    names = [self.get_lvalue_name(s.left) for s in statements
+                            if isinstance(s, vast.NonblockingSubstitution)]
+                    t = target(names[0] if len(names) > 0 else None)
+                self.count_expr(pass_name, t, item.cond, width_fn)
+            elif isinstance(item, vast.Block):
+                self.add_items(pass_name, target, item.statements, width_fn)
+            elif isinstance(item, vast.Always):
+                self.add_items(pass_name, target, [item.statement], width_fn)
+
+    def get_total(self, targets):
+        total = {c: 0 for c in self.COUNTERS}
+        for counters in targets.values():
+            for c in self.COUNTERS:
+                total[c] += counters[c]
+        return total
+
+    def get_report(self):
+        report = {"passes": {}}
+        all_targets = {}
+        for pass_name, targets in self.passes.items():
+            report["passes"][pass_name] = {
+                "total": self.get_total(targets),
+                "targets": targets
+            }
+            for t, counters in targets.items():
+                all_targets[(pass_name, t)] = counters
+        report["total"] = self.get_total(all_targets)
+        return report
+
+    def write(self, path):
+        report = self.get_report()
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+        print("Estimated instrumentation cost: {}".format(
+            ", ".join("{} {}".format(c, report["total"][c]) for c in self.COUNTERS)))
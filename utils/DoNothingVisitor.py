@@ -7,7 +7,7 @@ A visitor that does nothing on the AST.
 
 class DoNothingVisitor(ASTNodeVisitor):
     def __init__(self, const_tbl=None):
-        super().__init__(pass_state, False)
+        super().__init__(None)
 
     def visit(self, node):
         return node
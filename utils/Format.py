@@ -1,5 +1,3 @@
-import pyverilog.vparser.ast as vast
-
 # a list of tuples, (to_escape, escaped), to_escape should not duplicate
 escaping_rules = [
     (".", "__DOT__"),
@@ -0,0 +1,154 @@
+import json
+import os
+import xml.etree.ElementTree as ET
+
+"""
+Offline export of a directed graph with node/edge attributes.
+The output format is chosen by the file extension: .graphml, .gexf or .json
+"""
+
+class GraphExporter(object):
+    GRAPHML_NS = "http://graphml.graphdrawing.org/xmlns"
+    GEXF_NS = "http://gexf.net/1.2"
+    FORMATS = (".graphml", ".gexf", ".json")
+
+    def __init__(self):
+        # node id => {attribute name => value}
+        self.nodes = {}
+        # list of (source id, target id, {attribute name => value})
+        self.edges = []
+        self.edge_set = set()
+
+    def add_node(self, nid, **attrs):
+        node_attrs = self.nodes.setdefault(nid, {})
+        node_attrs.update(attrs)
+
+    def add_edge(self, src, dst, **attrs):
+        key = (src, dst, tuple(sorted(attrs.items())))
+        if key in self.edge_set:
+            return
+        self.edge_set.add(key)
+        self.edges.append((src, dst, attrs))
+
+    @staticmethod
+    def get_attr_type(values):
+        """
+        values: list of python values of one attribute
+        Return: (graphml type, gexf type)
+        """
+        if all(isinstance(v, bool) for v in values):
+            return ("boolean", "boolean")
+        if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            return ("long", "long")
+        return ("string", "string")
+
+    def collect_attrs(self, attr_dicts):
+        """
+        Return: [(attribute name, graphml type, gexf type)] for a list of attribute dicts
+        """
+        values = {}
+        for attrs in attr_dicts:
+            for k, v in attrs.items():
+                if v is None:
+                    continue
+                values.setdefault(k, []).append(v)
+        return [(k,) + self.get_attr_type(v) for k, v in sorted(values.items())]
+
+    @staticmethod
+    def format_value(v):
+        if isinstance(v, bool):
+            return "true" if v else "false"
+        return str(v)
+
+    @classmethod
+    def check_path(cls, path):
+        """
+        Raise ValueError if the format of path is unknown, so it can be checked before the analysis
+        Return: the extension of path
+        """
+        ext = os.path.splitext(path)[1].lower()
+        if not ext in cls.FORMATS:
+            raise ValueError("Unknown graph format \"{}\" of {}, use .graphml, .gexf or .json".format(ext, path))
+        return ext
+
+    def write(self, path):
+        ext = self.check_path(path)
+        if ext == ".graphml":
+            self.write_graphml(path)
+        elif ext == ".gexf":
+            self.write_gexf(path)
+        else:
+            self.write_json(path)
+
+    def write_json(self, path):
+        nodes = []
+        for nid, attrs in self.nodes.items():
+            n = {"id": nid}
+            n.update(attrs)
+            nodes.append(n)
+        edges = []
+        for src, dst, attrs in self.edges:
+            e = {"source": src, "target": dst}
+            e.update(attrs)
+            edges.append(e)
+        with open(path, "w") as f:
+            json.dump({"directed": True, "nodes": nodes, "edges": edges}, f, indent=1)
+
+    def write_graphml(self, path):
+        root = ET.Element("graphml", xmlns=self.GRAPHML_NS)
+        key_ids = {}
+        for domain, attr_list in (
+                ("node", self.collect_attrs(self.nodes.values())),
+                ("edge", self.collect_attrs([e[2] for e in self.edges]))):
+            for name, graphml_type, _ in attr_list:
+                kid = "d{}".format(len(key_ids))
+                key_ids[(domain, name)] = kid
+                ET.SubElement(root, "key", {"id": kid, "for": domain,
+                    "attr.name": name, "attr.type": graphml_type})
+        graph = ET.SubElement(root, "graph", id="G", edgedefault="directed")
+        for nid, attrs in self.nodes.items():
+            n = ET.SubElement(graph, "node", id=nid)
+            for k, v in attrs.items():
+                if v is None:
+                    continue
+                d = ET.SubElement(n, "data", key=key_ids[("node", k)])
+                d.text = self.format_value(v)
+        for src, dst, attrs in self.edges:
+            e = ET.SubElement(graph, "edge", source=src, target=dst)
+            for k, v in attrs.items():
+                if v is None:
+                    continue
+                d = ET.SubElement(e, "data", key=key_ids[("edge", k)])
+                d.text = self.format_value(v)
+        ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+
+    def write_gexf(self, path):
+        root = ET.Element("gexf", xmlns=self.GEXF_NS, version="1.2")
+        graph = ET.SubElement(root, "graph", mode="static", defaultedgetype="directed")
+        attr_ids = {}
+        for domain, attr_list in (
+                ("node", self.collect_attrs(self.nodes.values())),
+                ("edge", self.collect_attrs([e[2] for e in self.edges]))):
+            attributes = ET.SubElement(graph, "attributes", {"class": domain})
+            for aid, (name, _, gexf_type) in enumerate(attr_list):
+                attr_ids[(domain, name)] = str(aid)
+                ET.SubElement(attributes, "attribute", id=str(aid), title=name, type=gexf_type)
+        nodes = ET.SubElement(graph, "nodes")
+        for nid, attrs in self.nodes.items():
+            n = ET.SubElement(nodes, "node", id=nid, label=str(attrs.get("label", nid)))
+            attvalues = ET.SubElement(n, "attvalues")
+            for k, v in attrs.items():
+                if v is None:
+                    continue
+                ET.SubElement(attvalues, "attvalue", {"for": attr_ids[("node", k)],
+                    "value": self.format_value(v)})
+        edges = ET.SubElement(graph, "edges")
+        for eid, (src, dst, attrs) in enumerate(self.edges):
+            e = ET.SubElement(edges, "edge", id=str(eid), source=src, target=dst)
+            attvalues = ET.SubElement(e, "attvalues")
+            for k, v in attrs.items():
+                if v is None:
+                    continue
+                ET.SubElement(attvalues, "attvalue", {"for": attr_ids[("edge", k)],
+                    "value": self.format_value(v)})
+        ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
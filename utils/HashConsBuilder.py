@@ -0,0 +1,209 @@
+import pyverilog.vparser.ast as vast
+
+import copy
+
+"""
+Hash-consing of vast expressions. Used in FlowGuard to share the generated logic.
+
+Every structurally identical expression is represented by one interned node, so
+the expression DAG built by the instrumentation only stores each subexpression
+once and structural equality becomes an identity check. Interned nodes are never
+modified, a fresh tree is materialized whenever one has to be handed to code that
+rewrites trees in place (the optimizer, the final AST).
+"""
+
+# The operators whose result is always 1 bit, no matter the width of the operands
+SINGLE_BIT_OPERATORS = (vast.Eq, vast.NotEq, vast.Eql, vast.NotEql, vast.LessThan,
+        vast.GreaterThan, vast.LessEq, vast.GreaterEq, vast.Land, vast.Lor, vast.Ulnot,
+        vast.Uand, vast.Unand, vast.Uor, vast.Unor, vast.Uxor, vast.Uxnor)
+
+# The bitwise operators, whose result is 1 bit if all operands are 1 bit
+BITWISE_OPERATORS = (vast.And, vast.Or, vast.Xor, vast.Xnor, vast.Unot)
+
+class HashConsExprBuilder(object):
+    def __init__(self, optimizer, is_single_bit_signal=None, prefix="flowguard_cse_"):
+        """
+        optimizer: the visitor used by simplify(), it may rewrite the tree in place
+        is_single_bit_signal: callback telling whether an Identifier, Pointer or
+            Partselect is 1 bit wide. Only 1 bit expressions are hoisted.
+        prefix: the name prefix of the hoisted wires
+        """
+        self.optimizer = optimizer
+        self.is_single_bit_signal = is_single_bit_signal
+        self.prefix = prefix
+        # structural key => interned node
+        self.table = {}
+        # id(interned node) => structural key
+        self.keys = {}
+        # id(interned node) => interned simplified node
+        self.simplified = {}
+        # id(interned node) => whether the node is 1 bit
+        self.single_bit = {}
+        self.wire_cnt = 0
+        self.hit = 0
+        self.miss = 0
+
+    @staticmethod
+    def get_fields(node):
+        """
+        Return: the names of the attributes holding the children of node, None if
+        node is treated as a leaf
+        """
+        if isinstance(node, vast.Cond):
+            return ("cond", "true_value", "false_value")
+        if isinstance(node, vast.UnaryOperator):
+            return ("right",)
+        if isinstance(node, vast.Operator):
+            return ("left", "right")
+        if isinstance(node, vast.Pointer):
+            return ("var", "ptr")
+        if isinstance(node, vast.Partselect):
+            return ("var", "msb", "lsb")
+        if isinstance(node, vast.Repeat):
+            return ("value", "times")
+        return None
+
+    def get_children(self, node):
+        if isinstance(node, vast.Concat):
+            return node.list
+        fields = self.get_fields(node)
+        if fields == None:
+            return ()
+        return [getattr(node, f) for f in fields]
+
+    def rebuild(self, node, children):
+        """
+        Return: a shallow copy of node with its children replaced
+        """
+        r = copy.copy(node)
+        if isinstance(node, vast.Concat):
+            r.list = list(children)
+        else:
+            for f, c in zip(self.get_fields(node), children):
+                setattr(r, f, c)
+        return r
+
+    def is_interned(self, node):
+        # interned nodes are kept alive by self.table, so their ids are never reused
+        return id(node) in self.keys
+
+    def intern(self, node):
+        """
+        Return: the interned node structurally identical to node
+        """
+        if self.is_interned(node):
+            return node
+        if isinstance(node, (vast.IntConst, vast.StringConst)):
+            key = (node.__class__, node.value)
+        elif isinstance(node, vast.Identifier) and node.scope == None:
+            key = (node.__class__, node.name)
+        elif isinstance(node, vast.Concat) or self.get_fields(node) != None:
+            children = [self.intern(c) for c in self.get_children(node)]
+            key = (node.__class__,) + tuple(id(c) for c in children)
+            if key in self.table:
+                self.hit += 1
+                return self.table[key]
+            if any(c is not o for c, o in zip(children, self.get_children(node))):
+                node = self.rebuild(node, children)
+        else:
+            # unknown nodes are only equal to themselves
+            key = ("opaque", id(node))
+        if key in self.table:
+            self.hit += 1
+            return self.table[key]
+        self.miss += 1
+        self.table[key] = node
+        self.keys[id(node)] = key
+        return node
+
+    def materialize(self, node, names=None, keep_root=False):
+        """
+        Return: a fresh tree of node, which shares nothing with the interned DAG.
+        names: id(interned node) => name, these nodes are replaced by an Identifier
+        keep_root: do not replace node itself, used to build the hoisted wires
+        """
+        if names != None and id(node) in names and not keep_root:
+            return vast.Identifier(names[id(node)])
+        children = self.get_children(node)
+        if len(children) == 0:
+            return copy.copy(node)
+        return self.rebuild(node, [self.materialize(c, names) for c in children])
+
+    def simplify(self, node):
+        """
+        Return: the interned simplified version of node. The simplification of
+        each distinct expression only runs once.
+        """
+        node = self.intern(node)
+        if id(node) in self.simplified:
+            return self.simplified[id(node)]
+        r = self.intern(self.optimizer.visit(self.materialize(node)))
+        self.simplified[id(node)] = r
+        self.simplified[id(r)] = r
+        return r
+
+    def is_single_bit(self, node):
+        if id(node) in self.single_bit:
+            return self.single_bit[id(node)]
+        if isinstance(node, SINGLE_BIT_OPERATORS):
+            r = True
+        elif isinstance(node, BITWISE_OPERATORS):
+            r = all(self.is_single_bit(c) for c in self.get_children(node))
+        elif isinstance(node, vast.Cond):
+            r = self.is_single_bit(node.true_value) and self.is_single_bit(node.false_value)
+        elif isinstance(node, vast.IntConst):
+            r = node.value.startswith("1'")
+        elif isinstance(node, (vast.Identifier, vast.Pointer, vast.Partselect)):
+            r = self.is_single_bit_signal != None and self.is_single_bit_signal(node)
+        else:
+            r = False
+        self.single_bit[id(node)] = r
+        return r
+
+    def is_hoistable(self, node):
+        # hoisting a signal or a constant does not save anything
+        if isinstance(node, (vast.Identifier, vast.IntConst, vast.Pointer, vast.Partselect)):
+            return False
+        if len(self.get_children(node)) == 0:
+            return False
+        return self.is_single_bit(node)
+
+    def hoist(self, roots):
+        """
+        Find the 1 bit subexpressions referenced more than once in the DAG of the
+        interned roots.
+        Return: (names, wires)
+            names: id(interned node) => name of the wire holding it
+            wires: list of (name, interned node), children before parents
+        """
+        refcnt = {}
+        order = []
+        visited = set()
+        for root in roots:
+            stack = [(root, False)]
+            while len(stack) > 0:
+                node, expanded = stack.pop()
+                if expanded:
+                    order.append(node)
+                    continue
+                refcnt[id(node)] = refcnt.get(id(node), 0) + 1
+                if id(node) in visited:
+                    continue
+                visited.add(id(node))
+                stack.append((node, True))
+                for c in self.get_children(node):
+                    stack.append((c, False))
+
+        names = {}
+        wires = []
+        for node in order:
+            if refcnt[id(node)] < 2 or not self.is_hoistable(node):
+                continue
+            name = self.prefix + str(self.wire_cnt)
+            self.wire_cnt += 1
+            names[id(node)] = name
+            wires.append((name, node))
+        return (names, wires)
+
+    def stats(self):
+        return "HashConsExprBuilder: {} distinct nodes, {} hits".format(self.miss, self.hit)
@@ -0,0 +1,159 @@
+import csv
+import json
+import math
+import os
+
+"""
+Choose the sample depth of a SignalTapII or ILA recorder for a given trace width,
+against a budget of on-chip memory blocks.
+
+A device profile describes the memory blocks of a device:
+    {
+        "memory": "M20K",
+        "block_bits": 20480,
+        "configs": [[512, 40], [1024, 20], [2048, 10]],  # [depth, width] aspect ratios
+        "blocks": 11721  # optional, the blocks available on the device
+    }
+The built-in profiles describe a family of devices and have no "blocks", a budget is required
+with them, see check_budget.
+A recorder of width W and depth D is assumed to use, for the best aspect ratio [d, w],
+ceil(D / d) * ceil(W / w) blocks. The sweep results of the SWEEP modes can replace this
+estimation, see SweepCostModel.
+The recorders of all the clock domains of a module are sized together with the same depth,
+so that their capture windows cover the same number of samples.
+"""
+
+DEVICE_PROFILES = {
+    # Intel Stratix 10/Arria 10
+    "M20K": {
+        "memory": "M20K",
+        "block_bits": 20480,
+        "configs": [[512, 40], [1024, 20], [2048, 10]]
+    },
+    # Xilinx 7-series/UltraScale
+    "BRAM36": {
+        "memory": "BRAM36",
+        "block_bits": 36864,
+        "configs": [[512, 72], [1024, 36], [2048, 18], [4096, 9], [8192, 4], [16384, 2], [32768, 1]]
+    }
+}
+
+
+def load_device_profile(name_or_path):
+    """
+    Return: the profile dict of a built-in device profile (see DEVICE_PROFILES) or of a json file
+    """
+    if name_or_path in DEVICE_PROFILES:
+        return DEVICE_PROFILES[name_or_path]
+    with open(name_or_path) as f:
+        profile = json.load(f)
+    for key in ("memory", "block_bits", "configs"):
+        if not key in profile:
+            raise ValueError("Device profile {} has no \"{}\"".format(name_or_path, key))
+    return profile
+
+
+def check_budget(name_or_path, budget_blocks=None, budget_bits=None):
+    """
+    Raise: ValueError if the recorders cannot be sized against the profile, i.e. there is
+    neither a budget nor "blocks" in the profile
+    """
+    if budget_blocks != None or budget_bits != None:
+        return
+    if not "blocks" in load_device_profile(name_or_path):
+        raise ValueError("The device profile {} has no \"blocks\", give a memory budget with "
+                "--tasksupport-bram-budget or --tasksupport-bram-budget-bits".format(name_or_path))
+
+
+class SweepCostModel(object):
+    """
+    The memory blocks measured by the SWEEPSTP/SWEEPILA builds, one point per (width, depth).
+    The results are a csv file with the columns "width,depth,blocks", or a json list of
+    {"width", "depth", "blocks"}.
+    """
+
+    def __init__(self, path):
+        if os.path.splitext(path)[1] == ".json":
+            with open(path) as f:
+                rows = json.load(f)
+        else:
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+        # list of (width, depth, blocks)
+        self.points = [(int(r["width"]), int(r["depth"]), int(r["blocks"])) for r in rows]
+
+    def get_blocks(self, width, depth):
+        """
+        Return: the blocks of the cheapest measured recorder at least as wide and as deep,
+        None if there is no such measurement
+        """
+        candidates = [blocks for w, d, blocks in self.points if w >= width and d >= depth]
+        if len(candidates) == 0:
+            return None
+        return min(candidates)
+
+
+class RecorderSizing(object):
+    def __init__(self, profile, budget_blocks=None, budget_bits=None, cost_model=None):
+        """
+        profile: a device profile dict, see load_device_profile
+        budget_blocks/budget_bits: the memory the recorders may use, the blocks of the
+            profile if both are None
+        cost_model: optional SweepCostModel, preferred over the estimation of the profile
+        """
+        self.profile = profile
+        if budget_blocks == None and budget_bits != None:
+            budget_blocks = budget_bits // profile["block_bits"]
+        if budget_blocks == None:
+            budget_blocks = profile.get("blocks")
+        if budget_blocks == None:
+            raise ValueError("No memory budget, and the device profile {} has no \"blocks\"".format(
+                profile["memory"]))
+        self.budget_blocks = budget_blocks
+        self.cost_model = cost_model
+        # the blocks used by the recorders sized so far
+        self.used_blocks = 0
+
+    def get_blocks(self, width, depth):
+        if self.cost_model != None:
+            blocks = self.cost_model.get_blocks(width, depth)
+            if blocks != None:
+                return blocks
+        return min(math.ceil(depth / d) * math.ceil(width / w) for d, w in self.profile["configs"])
+
+    def get_depths(self, recorders):
+        """
+        Size recorders together: pick the largest power-of-two depth, the same for all of them
+        and clipped to the range of each one, whose recorders fit in the remaining budget, and
+        reserve their blocks.
+        recorders: [(width, min_depth, max_depth)]
+        Return: [depth], one per recorder
+        Raise: ValueError if the recorders do not fit even with their min_depth
+        """
+        if len(recorders) == 0:
+            return []
+        available = self.budget_blocks - self.used_blocks
+
+        def get_plan(depth):
+            return [min(max(depth, min_depth), max_depth) for _, min_depth, max_depth in recorders]
+
+        def get_plan_blocks(depths):
+            return [self.get_blocks(width, d) for (width, _, _), d in zip(recorders, depths)]
+
+        d = min(min_depth for _, min_depth, _ in recorders)
+        depths = get_plan(d)
+        if sum(get_plan_blocks(depths)) > available:
+            raise ValueError("The {} recorders do not fit in the remaining {} {} blocks even with depths {}".format(
+                " + ".join("{}-bit".format(width) for width, _, _ in recorders), available,
+                self.profile["memory"], depths))
+        while d <= max(max_depth for _, _, max_depth in recorders):
+            plan = get_plan(d)
+            if sum(get_plan_blocks(plan)) <= available:
+                depths = plan
+            d *= 2
+        for (width, _, _), depth, blocks in zip(recorders, depths, get_plan_blocks(depths)):
+            self.used_blocks += blocks
+            print("Recorder sizing: {} bits x {} samples, {} {} blocks ({} bits), {}/{} blocks used".format(
+                width, depth, blocks, self.profile["memory"], blocks * self.profile["block_bits"],
+                self.used_blocks, self.budget_blocks))
+        return depths
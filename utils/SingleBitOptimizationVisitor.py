@@ -1,4 +1,5 @@
 import pyverilog.vparser.ast as vast
+import pyverilog.dataflow.dataflow as df
 from passes.common import getDimensions
 from utils.common import ASTNodeVisitor
 from utils.ValueParsing import verilog_string_to_int
@@ -7,18 +8,203 @@ import copy
 
 """
 Optimize a list of single bit operations. Used in FlowGuard to save logic.
+
+Every operand is assumed to be 1 bit wide. And/Or chains are flattened into n-ary
+operations before applying constant folding, idempotence (A & A = A), complement
+(A & ~A = 0) and absorption (A & (A | B) = A). Subtrees are compared through
+structural keys computed once per node, so one visit is linear in the tree size.
 """
 
 class SingleBitOptimizationVisitor(ASTNodeVisitor):
     def __init__(self, const_tbl=None):
+        """
+        const_tbl: identifier name => vast.IntConst, signals known to be constant
+        """
         super().__init__(False)
         self.const_tbl = const_tbl
+        # id(node) => (node, structural key id), only valid during one visit
+        self.keys = {}
+        # structural key => structural key id
+        self.key_ids = {}
+
+    @staticmethod
+    def get_const_tbl(terms, binddict):
+        """
+        Find the 1 bit signals that are constant according to the dataflow: signals
+        tied to a constant, and registers only ever assigned one constant (e.g. only
+        assigned at reset) or their own value.
+        Return: identifier name => vast.IntConst
+        """
+        const_tbl = {}
+        for termname, bds in binddict.items():
+            if len(bds) != 1 or len(termname.scopechain) != 2 or not termname in terms:
+                continue
+            term = terms[termname]
+            if 'Input' in term.termtype or 'Inout' in term.termtype:
+                continue
+            if term.dims != None or term.msb == None or term.lsb == None:
+                continue
+            if term.msb.eval() != term.lsb.eval():
+                continue
+            bd = bds[0]
+            if bd.msb != None or bd.lsb != None or bd.ptr != None:
+                continue
+            value = SingleBitOptimizationVisitor.get_df_const(bd.tree, termname)
+            if value == 0 or value == 1:
+                const_tbl[termname.scopechain[1].scopename] = vast.IntConst("1'b" + str(value))
+        return const_tbl
+
+    # The value that the dataflow tree always assigns to termname, None if it is
+    # not constant. "hold" means that termname keeps its value.
+    @staticmethod
+    def get_df_const(tree, termname):
+        if tree == None:
+            return "hold"
+        if isinstance(tree, df.DFTerminal):
+            return "hold" if tree.name == termname else None
+        if isinstance(tree, df.DFEvalValue) or isinstance(tree, df.DFIntConst):
+            try:
+                return tree.eval()
+            except Exception:
+                return None
+        if isinstance(tree, df.DFBranch):
+            values = set()
+            for n in (tree.truenode, tree.falsenode):
+                v = SingleBitOptimizationVisitor.get_df_const(n, termname)
+                if v == None:
+                    return None
+                values.add(v)
+            values.discard("hold")
+            if len(values) == 0:
+                return "hold"
+            if len(values) == 1:
+                return values.pop()
+        return None
+
+    @staticmethod
+    def get_const(node):
+        """
+        Return: 1 or 0 if node is a 1 bit constant, otherwise None
+        """
+        if not isinstance(node, vast.IntConst):
+            return None
+        value = node.value.replace("_", "")
+        if value == "1" or value == "0":
+            return int(value)
+        if not value.startswith("1'"):
+            return None
+        digits = value[2:].lstrip("sS")
+        if len(digits) < 2 or not digits[0] in "bBhHdDoO":
+            return None
+        if digits[1:] == "1" or digits[1:] == "0":
+            return int(digits[1:])
+        return None
+
+    @staticmethod
+    def make_const(value):
+        return vast.IntConst("1'b1") if value else vast.IntConst("1'b0")
+
+    def visit(self, node):
+        # a new tree, the keys of the previous one may refer to modified nodes
+        if len(self.stack) == 0:
+            self.keys = {}
+            self.key_ids = {}
+        return super().visit(node)
+
+    def key(self, node):
+        """
+        Return: a small integer, equal for structurally identical subtrees
+        """
+        if id(node) in self.keys:
+            return self.keys[id(node)][1]
+        const = self.get_const(node)
+        if const != None:
+            k = ("const", const)
+        elif isinstance(node, vast.IntConst):
+            k = ("intconst", node.value)
+        elif isinstance(node, vast.Identifier) and node.scope == None:
+            k = ("id", node.name)
+        elif isinstance(node, (vast.Operator, vast.Pointer, vast.Partselect,
+                vast.Concat, vast.Repeat)):
+            k = (node.__class__,) + tuple(self.key(c) for c in node.children())
+        else:
+            k = ("opaque", id(node))
+        if not k in self.key_ids:
+            self.key_ids[k] = len(self.key_ids)
+        self.keys[id(node)] = (node, self.key_ids[k])
+        return self.key_ids[k]
+
+    def flatten(self, node, cls, operands):
+        # collect the operands of a chain of cls, without visiting them
+        if node.__class__ == cls:
+            self.flatten(node.left, cls, operands)
+            self.flatten(node.right, cls, operands)
+        else:
+            operands.append(node)
+
+    def get_operand_keys(self, node, cls):
+        operands = []
+        self.flatten(node, cls, operands)
+        return set(self.key(o) for o in operands)
+
+    def build_chain(self, cls, operands):
+        r = operands[0]
+        for o in operands[1:]:
+            r = cls(r, o)
+        return r
+
+    def visit_nary(self, node, cls, dual):
+        """
+        Simplify the And (cls=vast.And, dual=vast.Or) or Or (cls=vast.Or,
+        dual=vast.And) chain rooted at node.
+        """
+        # the constant that absorbs the whole chain, 0 for And and 1 for Or
+        zero = 0 if cls == vast.And else 1
+        raw = []
+        self.flatten(node, cls, raw)
+        operands = []
+        for o in raw:
+            o = self.visit(o)
+            # a simplified operand may become a chain of cls itself
+            self.flatten(o, cls, operands)
+
+        # constant folding and idempotence
+        kept = []
+        seen = set()
+        for o in operands:
+            const = self.get_const(o)
+            if const == zero:
+                return self.make_const(zero)
+            if const == 1 - zero:
+                continue
+            k = self.key(o)
+            if k in seen:
+                continue
+            seen.add(k)
+            kept.append(o)
+
+        # complement: A & ~A = 0, A | ~A = 1
+        for o in kept:
+            if isinstance(o, vast.Unot) and self.key(o.right) in seen:
+                return self.make_const(zero)
+
+        # absorption: A & (A | B) = A, A | (A & B) = A
+        absorbed = []
+        for o in kept:
+            if o.__class__ == dual:
+                dual_keys = self.get_operand_keys(o, dual)
+                if len(dual_keys & seen) > 0:
+                    continue
+            absorbed.append(o)
+
+        if len(absorbed) == 0:
+            return self.make_const(1 - zero)
+        return self.build_chain(cls, absorbed)
 
     def visit_IntConst(self, node):
-        if node.value == "1":
-            return vast.IntConst("1'b1")
-        elif node.value == "0":
-            return vast.IntConst("1'b0")
+        const = self.get_const(node)
+        if const != None:
+            return self.make_const(const)
         return node
 
     def visit_Pointer(self, node):
@@ -27,93 +213,55 @@ class SingleBitOptimizationVisitor(ASTNodeVisitor):
     def visit_Identifier(self, node):
         if self.const_tbl != None:
             if node.name in self.const_tbl:
-                return self.const_tbl[node.name]
+                return copy.copy(self.const_tbl[node.name])
         return node
 
     def visit_Unot(self, node):
-        node.right = self.visit(node.right)
-        if isinstance(node.right, vast.Unot):
-            return node.right.right
-        if isinstance(node.right, vast.IntConst):
-            if node.right.value == "1'b1":
-                return vast.IntConst("1'b0")
-            elif node.right.value == "1'b0":
-                return vast.IntConst("1'b1")
-        # We give up here
+        right = self.visit(node.right)
+        if isinstance(right, vast.Unot):
+            return right.right
+        const = self.get_const(right)
+        if const != None:
+            return self.make_const(1 - const)
+        if right is not node.right:
+            return vast.Unot(right)
         return node
 
     def visit_And(self, node):
-        node.left = self.visit(node.left)
-        node.right = self.visit(node.right)
-        if isinstance(node.left, vast.IntConst):
-            if node.left.value == "1'b1":
-                return node.right
-            if node.left.value == "1'b0":
-                return vast.IntConst("1'b0")
-        if isinstance(node.right, vast.IntConst):
-            if node.right.value == "1'b1":
-                return node.left
-            if node.right.value == "1'b0":
-                return vast.IntConst("1'b0")
-        if node.left == node.right:
-            return node.left
-        if isinstance(node.right, vast.And):
-            # A & (A & B) --> A & B
-            if node.left == node.right.left:
-                return node.right
-            # A & (B & A) --> B & A
-            if node.left == node.right.right:
-                return node.right
-        if isinstance(node.left, vast.And):
-            # (A & B) & A --> A & B
-            if node.left.left == node.right:
-                return node.left
-            # (B & A) & A --> B & A
-            if node.left.right == node.right:
-                return node.right
-        return node
+        return self.visit_nary(node, vast.And, vast.Or)
 
     def visit_Or(self, node):
-        node.left = self.visit(node.left)
-        node.right = self.visit(node.right)
-        if isinstance(node.left, vast.IntConst):
-            if node.left.value == "1'b1":
-                return vast.IntConst("1'b1")
-            if node.left.value == "1'b0":
-                return node.right
-        if isinstance(node.right, vast.IntConst):
-            if node.right.value == "1'b1":
-                return vast.IntConst("1'b1")
-            if node.right.value == "1'b0":
-                return node.left
-        if node.left == node.right:
-            return node.left
-        if isinstance(node.right, vast.Or):
-            # A | (A | B)
-            if node.left == node.right.left:
-                return node.right
-            # A | (B | A)
-            if node.left == node.right.right:
-                return node.right
-        if isinstance(node.left, vast.Or):
-            # (A | B) | A
-            if node.right == node.left.left:
-                return node.left
-            # (B | A) | A
-            if node.right == node.left.right:
-                return node.left
-        return node
+        return self.visit_nary(node, vast.Or, vast.And)
 
     def visit_Cond(self, node):
-        node.cond = self.visit(node.cond)
-        node.true_value = self.visit(node.true_value)
-        node.false_value = self.visit(node.false_value)
-        if isinstance(node.cond, vast.IntConst):
-            if node.cond.value == "1'b1":
-                return node.true_value
-            if node.cond.value == "1'b0":
-                return node.false_value
-        return node
+        cond = self.visit(node.cond)
+        true_value = self.visit(node.true_value)
+        false_value = self.visit(node.false_value)
+        const = self.get_const(cond)
+        if const == 1:
+            return true_value
+        if const == 0:
+            return false_value
+        if self.key(true_value) == self.key(false_value):
+            return true_value
+        true_const = self.get_const(true_value)
+        false_const = self.get_const(false_value)
+        # c ? 1 : 0 = c, c ? 0 : 1 = ~c
+        if true_const == 1 and false_const == 0:
+            return cond
+        if true_const == 0 and false_const == 1:
+            return self.visit(vast.Unot(cond))
+        # c ? 1 : B = c | B, c ? A : 0 = c & A
+        if true_const == 1:
+            return self.visit(vast.Or(cond, false_value))
+        if false_const == 0:
+            return self.visit(vast.And(cond, true_value))
+        # c ? 0 : B = ~c & B, c ? A : 1 = ~c | A
+        if true_const == 0:
+            return self.visit(vast.And(vast.Unot(cond), false_value))
+        if false_const == 1:
+            return self.visit(vast.Or(vast.Unot(cond), true_value))
+        return vast.Cond(cond, true_value, false_value)
 
     def visit_Node(self, node):
         return node
@@ -9,10 +9,12 @@ class XilinxILA(object):
     # "C_PROBE<N>_TYPE" {0}: DATA_AND_TRIGGER, {1}: DATA, {2}: TRIGGER
 
     def __init__(self, clk, data_trigger_list, data_list, trigger_list,
-            sample_depth=ILA_DEFAULT_SAMPLE_DEPTH, emulated=False):
+            sample_depth=ILA_DEFAULT_SAMPLE_DEPTH, emulated=False, buffer_name="w_buffer"):
         """
         data_trigger_list, data_list, trigger_list are lists of (verilog signals, width), i.e. (vast.Node, int).
         sample_depth: int
+        emulated: instantiate "<ila name>_emulated", generated by recording/xilinx/create_ila.py
+        buffer_name: the buffer the emulated ILA dumps its samples to (without the extension)
         """
         self.clk = clk
         self.data_trigger_list = data_trigger_list
@@ -21,6 +23,7 @@ class XilinxILA(object):
         self.all_probes = self.data_trigger_list + self.data_list + self.trigger_list
         self.emulated = emulated
         self.sample_depth = sample_depth
+        self.buffer_name = buffer_name
 
     def build_param_list(self):
         self.param_list = []
@@ -66,8 +69,11 @@ class XilinxILA(object):
         # save total width as comment
         total_width = sum([probe[1] for probe in self.data_trigger_list + self.data_list])
         commands.append("# total width: {}".format(total_width))
+        commands.append("# buffer: {}".format(self.buffer_name))
 
-        with open(self.ILA_TCL_OUTPUT, 'w') as f:
+        # one script for all the instances, the first one starts a new file
+        mode = 'w' if XilinxILA.ILA_INSTANCE_CNT == 0 else 'a'
+        with open(self.ILA_TCL_OUTPUT, mode) as f:
             print('\n'.join(commands), file=f)
         full_tcl_path = os.path.realpath(self.ILA_TCL_OUTPUT)
         print("Total Width to record: {}".format(total_width))
@@ -80,10 +86,13 @@ class XilinxILA(object):
         self.build_param_list()
         self.build_port_list()
         self.print_tcl_commands()
+        mod_name = self.getILAName()
+        if self.emulated:
+            mod_name += "_emulated"
         instance = vast.Instance(
-            self.getILAName(),
+            mod_name,
             "ila_inst_"+str(XilinxILA.ILA_INSTANCE_CNT), self.port_list, self.param_list)
         r = vast.InstanceList(
-            self.getILAName(), self.param_list, [instance])
+            mod_name, self.param_list, [instance])
         XilinxILA.ILA_INSTANCE_CNT += 1
         return r